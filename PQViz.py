@@ -188,6 +188,11 @@ def dropdown_handler_pop_group(change):
 
 pop_group_drop_down.observe(dropdown_handler_pop_group, names="value")
 
+# Load boundaries and data for the selected state and population group in the
+# background, so they are ready by the time the cells below need them
+prefetcher = maps.Prefetcher(results_folder)
+prefetcher.watch(state_drop_down, pop_group_drop_down)
+
 display(demo_drop_down)
 display(state_drop_down)
 display(pop_group_drop_down)
@@ -210,14 +215,7 @@ print(f"Population Group: {population_group}")
 # In[ ]:
 
 
-prev_data = create_dataframes.create_prevalence_df(file_path=results_folder,
-                                                   population_group=population_group)
-
-
-# In[ ]:
-
-
-pop_data = create_dataframes.create_population_df(results_folder, population_group)
+prev_data, pop_data, cube = prefetcher.frames(population_group)
 
 
 # ## Suppressed Data
@@ -258,14 +256,14 @@ check_suppressed.check_suppressed(prev_data, "state")
 demo_dropdown_options = pop_data[demographic_type].unique()
 pop_type_drowdown_options = pop_data["Population type"].unique()
 style = dict(description_width="100px")
-interact(plots.plot_pop,
+interact(plots.plot_pop_cached,
          sam_type=widgets.Dropdown(options=pop_type_drowdown_options, 
                                    description="Sample Type:"),
          selected_demo=widgets.Dropdown(options=demo_dropdown_options, 
                                         description= "{}:".format(str.capitalize(demographic_type))), 
          demographic_type=fixed(demographic_type),
          population_group=fixed(population_group),
-         df=fixed(pop_data));
+         df=fixed(plots.PlotData(pop_data, [demographic_type])));
 
 
 # ## Plotting Prevalence
@@ -288,7 +286,7 @@ interact(plots.plot_pop,
 demo_dropdown_options = prev_data[demographic_type].unique()
 prev_type_drowdown_options = prev_data["Prevalence type"].unique()
 style = dict(description_width="100px")
-interact(plots.plot_prevalence, 
+interact(plots.plot_prevalence_cached, 
          selected_demo=widgets.Dropdown(
              options=demo_dropdown_options,
              description="{}:".format(str.capitalize(demographic_type)),
@@ -299,7 +297,25 @@ interact(plots.plot_prevalence,
              style=style),
          demographic_type=fixed(demographic_type),
          population_group=fixed(population_group),
-         df=fixed(prev_data));
+         df=fixed(plots.PlotData(prev_data, [demographic_type])));
+
+
+# ### Comparing all values
+# 
+# To compare every value of the selected demographic side by side, the cell below draws one panel per value on shared axes. Select a prevalence type to redraw the grid.
+
+# In[ ]:
+
+
+interact(plots.plot_prevalence_facets,
+         prevalence_type=widgets.Dropdown(
+             options=prev_type_drowdown_options,
+             description="Prevalence Type: ",
+             style=style),
+         demographic_type=fixed(demographic_type),
+         population_group=fixed(population_group),
+         ncols=fixed(4),
+         df=fixed(plots.PlotData(prev_data)));
 
 
 # ## Crude prevalence measures from CDC PLACES
@@ -318,7 +334,10 @@ mdd = widgets.Dropdown(options=measure_options,
                        description="PLACES Measure:",
                        disabled=False,
                        style={"description_width": "165px"})
-interact(maps.choropleth_map_places, selected_state=fixed(selected_state), selected_measure=mdd);
+interact(maps.choropleth_map_places,
+         selected_state=fixed(selected_state),
+         selected_measure=mdd,
+         tile_url=fixed(None));
 
 
 # The map should zoom to your state when it loads. Click on any ZCTA shown to see its crude prevalence value, which will appear under the map.
@@ -330,6 +349,8 @@ interact(maps.choropleth_map_places, selected_state=fixed(selected_state), selec
 # Note that the map below will show values grouped at the ZCTA3 level, rather than the finer-grained ZCTA5 level shown in the CDC PLACES data in the map directly above.
 # 
 # Areas of the map filled with light grey represent ZCTA3 areas without values present in the data. Areas filled with  dark grey represent ZCTA3 areas with suppressed data.
+# 
+# Use the _Show_ menu to color ZCTA3s by the probability that their prevalence is above the threshold, or by their rank in the state. Both are simulated from the standard errors reported by CODI-PQ; click a ZCTA3 to see its rank interval.
 
 # In[ ]:
 
@@ -343,9 +364,19 @@ prevalence_type_dropdown = widgets.Dropdown(options=prev_type_drowdown_options,
                                            description="Prevalence Type:",
                                            disabled=False,
                                            style={"description_width": "165px"})
+layer_dropdown = widgets.Dropdown(options=maps.MAP_LAYERS,
+                                  description="Show:",
+                                  disabled=False,
+                                  style={"description_width": "165px"})
+threshold_slider = widgets.FloatSlider(value=20.0, min=0.0, max=100.0, step=0.5,
+                                       description="Threshold (%):",
+                                       style={"description_width": "165px"})
 interact(maps.choropleth_map_pq, 
          selected_state=fixed(selected_state), 
-         df=fixed(prev_data),
+         df=fixed(cube),
          category=category_dropdown,
-         prevalence_type=prevalence_type_dropdown);
+         prevalence_type=prevalence_type_dropdown,
+         tile_url=fixed(None),
+         layer=layer_dropdown,
+         threshold=threshold_slider);
 
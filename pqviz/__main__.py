@@ -0,0 +1,542 @@
+"""
+Command line entry point for PQViz, run as `python -m pqviz <command>` from the
+top-level project directory so the bundled reference data can be found.
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+from . import tiles
+from .maps import TILE_MAX_ZOOM
+
+
+def run_tiles(args):
+    if not args.no_prerender:
+        tiles.prerender_tiles(
+            states=args.states,
+            min_zoom=args.min_zoom,
+            max_zoom=args.max_zoom,
+            tile_dir=args.tile_dir,
+        )
+    if not args.no_serve:
+        tiles.serve_tiles(
+            port=args.port, tile_dir=args.tile_dir, states=args.states, host=args.host
+        )
+
+
+def run_export_maps(args):
+    from . import create_dataframes, export
+
+    prev_data = create_dataframes.create_prevalence_df(
+        Path(args.results_folder), args.population_group
+    )
+    manifest = export.export_maps(
+        prev_data,
+        args.output_dir,
+        states=args.states,
+        formats=args.formats,
+        max_workers=args.workers,
+    )
+    failed = [m for m in manifest["maps"] if m["status"] != "ok"]
+    print(
+        f"Exported {len(manifest['maps']) - len(failed)} maps to {args.output_dir} "
+        f"in {manifest['seconds']}s ({len(failed)} failed)"
+    )
+
+
+def run_export_plots(args):
+    from . import create_dataframes, export
+
+    results_folder = Path(args.results_folder)
+    prev_data = create_dataframes.create_prevalence_df(
+        results_folder, args.population_group
+    )
+    pop_data = create_dataframes.create_population_df(
+        results_folder, args.population_group
+    )
+    for demographic_type in args.demographic_types:
+        index = export.export_plots(
+            prev_data,
+            pop_data,
+            args.output_dir,
+            demographic_type,
+            args.population_group,
+            formats=args.formats,
+            max_workers=args.workers,
+            force=args.force,
+        )
+        failed = [p for p in index["plots"] if p["status"] == "error"]
+        print(
+            f"Exported {demographic_type} plots to {args.output_dir} in "
+            f"{index['seconds']}s: {index['rendered']} rendered, "
+            f"{len(index['plots']) - index['rendered']} unchanged, "
+            f"{len(failed)} failed"
+        )
+
+
+def run_pipeline(args):
+    from . import pipeline
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    records = pipeline.Pipeline(
+        args.results_folder,
+        output_dir=args.output_dir,
+        population_group=args.population_group,
+        demographic_types=args.demographic_types,
+        states=args.states,
+        plot_formats=args.plot_formats,
+        map_formats=args.map_formats,
+        max_workers=args.workers,
+        stages=args.stages,
+        force=args.force,
+    ).run()
+    if any(record["status"] == "error" for record in records.values()):
+        raise SystemExit(1)
+
+
+def run_serve(args):
+    from . import server
+
+    server.serve(
+        Path(args.results_folder),
+        population_group=args.population_group,
+        host=args.host,
+        port=args.port,
+    )
+
+
+def run_store(args):
+    from . import store
+
+    for fname in store.materialize(
+        args.results_folder,
+        args.population_group,
+        store_dir=args.store_dir,
+        force=args.force,
+    ):
+        print(f"Shared dataset ready: {fname}")
+    if args.places:
+        store.shared_places(args.store_dir)
+        print(f"Shared dataset ready: {store.dataset_fname(args.store_dir, 'places')}")
+
+
+def run_append(args):
+    from . import timeseries
+
+    written = timeseries.append_run(
+        args.results_folder, args.population_group, store_dir=args.store_dir
+    )
+    if written:
+        for fname in written:
+            print(f"Appended {fname}")
+    else:
+        print(f"{args.results_folder} is already in {args.store_dir}")
+
+
+def run_diff(args):
+    from . import diff
+
+    changes = diff.diff_folders(
+        args.old_folder, args.new_folder, args.population_group, args.tolerance
+    )
+    print(diff.summarize(changes).to_string())
+    if args.output:
+        changes.to_csv(args.output, index=False)
+        print(f"Wrote {len(changes)} changed cells to {args.output}")
+
+
+def run_synthetic(args):
+    from . import synthetic
+
+    written = synthetic.generate_reports(
+        args.output_dir,
+        args.population_group,
+        args.reports,
+        states=args.states,
+        years=args.years,
+        seed=args.seed,
+    )
+    print(f"Wrote {len(written)} synthetic reports to {args.output_dir}")
+
+
+def run_benchmark(args):
+    from . import benchmark
+
+    options = {"memory": not args.no_memory}
+    if args.suite == "ingest":
+        options.update(scales=args.scales, population_groups=args.population_groups)
+    else:
+        options.update(states=args.states)
+    report, regressions = benchmark.run_suite(
+        args.suite,
+        output_dir=args.output_dir,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance,
+        **options,
+    )
+    for result in report["results"]:
+        labels = " ".join(
+            f"{result[key]!s:<10}"
+            for key in benchmark.RESULT_KEYS[1:]
+            if result.get(key) is not None
+        )
+        line = f"{labels} {result['seconds']:9.3f}s"
+        if result.get("peak_bytes") is not None:
+            line += f" {result['peak_bytes'] / 1024**2:10.1f} MB peak"
+        if result.get("payload_bytes") is not None:
+            line += f" {result['payload_bytes'] / 1024**2:10.1f} MB payload"
+        print(line)
+    print(f"Wrote {Path(args.output_dir) / f'{args.suite}.json'}")
+    if args.save_baseline:
+        print(f"Saved baseline {benchmark.baseline_fname(args.suite, args.output_dir)}")
+    for regression in regressions:
+        labels = " ".join(
+            str(regression[key])
+            for key in benchmark.RESULT_KEYS[1:]
+            if regression.get(key) is not None
+        )
+        print(
+            f"Regression: {labels} {regression['metric']} {regression['baseline']} "
+            f"-> {regression['current']} ({regression['ratio']}x)"
+        )
+    if regressions:
+        raise SystemExit(1)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="pqviz")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    tiles_parser = subparsers.add_parser(
+        "tiles",
+        help="Pre-render ZCTA boundary vector tiles and serve them locally",
+    )
+    tiles_parser.add_argument(
+        "--states", nargs="+", help="State abbreviations to render (default: all)"
+    )
+    tiles_parser.add_argument(
+        "--min-zoom", type=int, default=tiles.TILE_MIN_ZOOM, help="Lowest zoom level"
+    )
+    tiles_parser.add_argument(
+        "--max-zoom", type=int, default=TILE_MAX_ZOOM, help="Highest zoom level"
+    )
+    tiles_parser.add_argument(
+        "--tile-dir", default=tiles.TILE_DIR, help="Directory to cache tiles in"
+    )
+    tiles_parser.add_argument("--host", default="localhost", help="Host to serve on")
+    tiles_parser.add_argument(
+        "--port", type=int, default=tiles.TILE_PORT, help="Port to serve on"
+    )
+    tiles_parser.add_argument(
+        "--no-prerender",
+        action="store_true",
+        default=False,
+        help="Skip pre-rendering and render tiles on request only",
+    )
+    tiles_parser.add_argument(
+        "--no-serve",
+        action="store_true",
+        default=False,
+        help="Pre-render tiles and exit without serving them",
+    )
+    tiles_parser.set_defaults(func=run_tiles)
+
+    maps_parser = subparsers.add_parser(
+        "export-maps",
+        help="Render every state, weight category and prevalence type map to files",
+    )
+    maps_parser.add_argument("results_folder", help="Folder of CODI-PQ outputs")
+    maps_parser.add_argument(
+        "--population-group",
+        choices=["Pediatric", "Adult"],
+        default="Pediatric",
+        help="Type of population",
+    )
+    maps_parser.add_argument(
+        "--output-dir", default="map_output", help="Directory to write maps into"
+    )
+    maps_parser.add_argument(
+        "--states", nargs="+", help="State abbreviations (default: all in results)"
+    )
+    maps_parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=["png", "html"],
+        default=["png", "html"],
+        help="File formats to render",
+    )
+    maps_parser.add_argument(
+        "--workers", type=int, help="Number of worker processes (default: CPUs)"
+    )
+    maps_parser.set_defaults(func=run_export_maps)
+
+    plots_parser = subparsers.add_parser(
+        "export-plots",
+        help="Render every prevalence and population plot of a demographic to files",
+    )
+    plots_parser.add_argument("results_folder", help="Folder of CODI-PQ outputs")
+    plots_parser.add_argument(
+        "--population-group",
+        choices=["Pediatric", "Adult"],
+        default="Pediatric",
+        help="Type of population",
+    )
+    plots_parser.add_argument(
+        "--demographic-types",
+        nargs="+",
+        choices=["sex", "race", "age", "zcta3"],
+        default=["zcta3"],
+        help="Demographics to plot each value of",
+    )
+    plots_parser.add_argument(
+        "--output-dir", default="plot_output", help="Directory to write plots into"
+    )
+    plots_parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=["png", "pdf", "svg"],
+        default=["png", "pdf", "svg"],
+        help="File formats to render",
+    )
+    plots_parser.add_argument(
+        "--workers", type=int, help="Number of worker processes (default: CPUs)"
+    )
+    plots_parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="Render every plot, even if its data has not changed",
+    )
+    plots_parser.set_defaults(func=run_export_plots)
+
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Run the ingest, suppression, plot, map and report pipeline",
+    )
+    run_parser.add_argument("results_folder", help="Folder of CODI-PQ outputs")
+    run_parser.add_argument(
+        "--population-group",
+        choices=["Pediatric", "Adult"],
+        default="Pediatric",
+        help="Type of population",
+    )
+    run_parser.add_argument(
+        "--demographic-types",
+        nargs="+",
+        choices=["sex", "race", "age", "zcta3"],
+        default=["zcta3"],
+        help="Demographics to check and plot",
+    )
+    run_parser.add_argument(
+        "--output-dir", default="pqviz_output", help="Directory to write outputs into"
+    )
+    run_parser.add_argument(
+        "--states",
+        nargs="+",
+        help="State abbreviations to map (default: all in results)",
+    )
+    run_parser.add_argument(
+        "--plot-formats",
+        nargs="+",
+        choices=["png", "pdf", "svg"],
+        default=["png"],
+        help="File formats of plots",
+    )
+    run_parser.add_argument(
+        "--map-formats",
+        nargs="+",
+        choices=["png", "html"],
+        default=["png"],
+        help="File formats of maps",
+    )
+    run_parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=["prevalence", "population", "suppression", "plots", "maps", "report"],
+        help="Stages to run, with the stages they depend on (default: all)",
+    )
+    run_parser.add_argument(
+        "--workers", type=int, help="Number of worker processes (default: CPUs)"
+    )
+    run_parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="Run every stage, even if its inputs have not changed",
+    )
+    run_parser.set_defaults(func=run_pipeline)
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Serve JSON queries and plots of one results folder over HTTP",
+    )
+    serve_parser.add_argument("results_folder", help="Folder of CODI-PQ outputs")
+    serve_parser.add_argument(
+        "--population-group",
+        choices=["Pediatric", "Adult"],
+        default="Pediatric",
+        help="Type of population",
+    )
+    serve_parser.add_argument("--host", default="localhost", help="Host to serve on")
+    serve_parser.add_argument("--port", type=int, default=8766, help="Port to serve on")
+    serve_parser.set_defaults(func=run_serve)
+
+    store_parser = subparsers.add_parser(
+        "store",
+        help="Write ingested results as memory-mapped datasets shared by kernels",
+    )
+    store_parser.add_argument("results_folder", help="Folder of CODI-PQ outputs")
+    store_parser.add_argument(
+        "--population-group",
+        choices=["Pediatric", "Adult"],
+        default="Pediatric",
+        help="Type of population",
+    )
+    store_parser.add_argument(
+        "--store-dir", default="pqviz_store", help="Directory of shared datasets"
+    )
+    store_parser.add_argument(
+        "--places",
+        action="store_true",
+        default=False,
+        help="Also write the CDC PLACES data",
+    )
+    store_parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="Rewrite the datasets even if the results have not changed",
+    )
+    store_parser.set_defaults(func=run_store)
+
+    append_parser = subparsers.add_parser(
+        "append",
+        help="Append a run of results to the multi-year time-series store",
+    )
+    append_parser.add_argument("results_folder", help="Folder of CODI-PQ outputs")
+    append_parser.add_argument(
+        "--population-group",
+        choices=["Pediatric", "Adult"],
+        default="Pediatric",
+        help="Type of population",
+    )
+    append_parser.add_argument(
+        "--store-dir",
+        default="pqviz_timeseries",
+        help="Directory of the time-series store",
+    )
+    append_parser.set_defaults(func=run_append)
+
+    diff_parser = subparsers.add_parser(
+        "diff",
+        help="Report the prevalence cells that differ between two runs of results",
+    )
+    diff_parser.add_argument("old_folder", help="Folder of the earlier CODI-PQ run")
+    diff_parser.add_argument("new_folder", help="Folder of the later CODI-PQ run")
+    diff_parser.add_argument(
+        "--population-group",
+        choices=["Pediatric", "Adult"],
+        default="Pediatric",
+        help="Type of population",
+    )
+    diff_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.0,
+        help="Largest difference in a value still counted as unchanged",
+    )
+    diff_parser.add_argument(
+        "--output", default=None, help="csv file to write the changed cells to"
+    )
+    diff_parser.set_defaults(func=run_diff)
+
+    synthetic_parser = subparsers.add_parser(
+        "synthetic",
+        help="Write synthetic CODI-PQ reports for testing at scale",
+    )
+    synthetic_parser.add_argument("output_dir", help="Folder to write reports into")
+    synthetic_parser.add_argument(
+        "--reports", type=int, default=1000, help="Number of reports"
+    )
+    synthetic_parser.add_argument(
+        "--population-group",
+        choices=["Pediatric", "Adult"],
+        default="Pediatric",
+        help="Type of population",
+    )
+    synthetic_parser.add_argument(
+        "--states",
+        nargs="+",
+        default=["NC", "SC", "VA"],
+        help="State abbreviations to spread reports over",
+    )
+    synthetic_parser.add_argument(
+        "--years", default="2016 - 2018", help="Years of the query"
+    )
+    synthetic_parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the random generator"
+    )
+    synthetic_parser.set_defaults(func=run_synthetic)
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark",
+        help="Time and memory-profile PQViz on synthetic data against a baseline",
+    )
+    benchmark_parser.add_argument(
+        "suite", choices=["ingest", "maps"], help="Suite to run"
+    )
+    benchmark_parser.add_argument(
+        "--scales",
+        nargs="+",
+        type=int,
+        default=[100, 1000],
+        help="Numbers of synthetic reports to ingest (ingest suite)",
+    )
+    benchmark_parser.add_argument(
+        "--population-groups",
+        nargs="+",
+        choices=["Pediatric", "Adult"],
+        default=["Pediatric", "Adult"],
+        help="Population groups to ingest (ingest suite)",
+    )
+    benchmark_parser.add_argument(
+        "--states",
+        nargs="+",
+        help="State abbreviations to map (maps suite; default: all)",
+    )
+    benchmark_parser.add_argument(
+        "--output-dir",
+        default="pqviz_benchmarks",
+        help="Directory of reports, baselines and synthetic inputs",
+    )
+    benchmark_parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        default=False,
+        help="Skip the memory profile, which runs each stage a second time",
+    )
+    benchmark_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Share by which a stage may exceed its baseline",
+    )
+    benchmark_parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        default=False,
+        help="Save this run as the baseline instead of comparing with it",
+    )
+    benchmark_parser.set_defaults(func=run_benchmark)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
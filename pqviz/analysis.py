@@ -0,0 +1,282 @@
+"""
+Comparisons between demographic groups: pairwise significance tests, and
+simulated exceedance probabilities and rank intervals.
+
+Prevalence estimates of two groups are compared with a two-sided z-test on their
+difference, using the standard errors reported by CODI-PQ and treating the
+groups as independent samples:
+
+    z = (p_a - p_b) / sqrt(se_a ** 2 + se_b ** 2)
+
+Every pair of groups is tested at once: the differences and their standard
+errors are computed by broadcasting the prevalence and standard error arrays
+against themselves, so comparing thousands of ZCTA3s takes one pass over an
+n x n array rather than a loop over pairs. P-values are then adjusted for the
+number of comparisons.
+
+    estimates = analysis.group_estimates(prev_data, "zcta3", category, "Crude", "NC")
+    analysis.pairwise_tests(estimates)                # one row per pair
+    analysis.pairwise_tests(estimates, matrix=True)   # adjusted p-values by group
+
+The uncertainty of each group's estimate is also simulated: prevalence is drawn
+from a normal distribution with the reported standard error, for every group at
+once, in chunks of draws small enough to bound memory. From the draws come the
+probability that each group's prevalence is above a threshold, and an interval
+for its rank among the groups:
+
+    analysis.simulate_uncertainty(estimates, threshold=20)
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from .cube import MISSING, Cube
+
+
+# Multiple comparison adjustments of p-values accepted by pairwise_tests()
+ADJUSTMENTS = ["holm", "bonferroni", "fdr_bh", "none"]
+
+# Number of draws simulated by simulate_uncertainty(), and the most memory the
+# draws of one chunk may take
+DRAWS = 10_000
+MAX_CHUNK_BYTES = 64 * 1024**2
+
+
+def group_estimates(df, demographic_type, category, prevalence_type, state=None):
+    """
+    Return the prevalence and standard error of each value of a demographic, for
+    one weight category and prevalence type. Groups with suppressed prevalence
+    are left out. Rows for the same group, e.g. across files, are averaged as in
+    the bar plots.
+
+    Parameters:
+    df: DataFrame of prevalence data, or a Cube of it
+    demographic_type: Demographic to compare, expected values ['sex', 'race', 'age', 'zcta3']
+    category: Weight category/class
+    prevalence_type: Prevalence type, one of ['Age-Adjusted', 'Crude', 'Weighted']
+    state: Optional two-letter state abbreviation to limit the groups to
+
+    Returns:
+    A DataFrame indexed by demographic value with Prevalence and Standard Error.
+    """
+    if isinstance(df, Cube):
+        selection = {"category": category, "type": prevalence_type}
+        if state is not None:
+            selection["state"] = state
+        labels = df.axes[demographic_type]
+        estimates = pd.DataFrame(
+            {
+                "Prevalence": df.reduce("prevalence", selection, [demographic_type]),
+                "Standard Error": df.reduce("se", selection, [demographic_type]),
+            },
+            index=pd.Index(labels, name=demographic_type),
+        )
+        estimates = estimates.loc[labels != MISSING]
+    else:
+        rows = df.loc[
+            (df["Weight Category"] == category)
+            & (df["Prevalence type"] == prevalence_type)
+        ]
+        if state is not None:
+            states = rows["state"].map(lambda s: getattr(s, "abbr", s))
+            rows = rows.loc[states == state]
+        rows = rows.assign(
+            Prevalence=pd.to_numeric(rows["Prevalence"]),
+            **{"Standard Error": pd.to_numeric(rows["Standard Error"])},
+        )
+        estimates = rows.groupby(demographic_type, observed=True)[
+            ["Prevalence", "Standard Error"]
+        ].mean()
+    return estimates.dropna()
+
+
+def adjust_pvalues(pvalues, method="holm"):
+    """
+    Adjust p-values for multiple comparisons.
+
+    Parameters:
+    pvalues: Array of p-values
+    method: One of ADJUSTMENTS: 'holm' (Holm-Bonferroni step-down), 'bonferroni',
+        'fdr_bh' (Benjamini-Hochberg false discovery rate), or 'none'
+
+    Returns:
+    An array of adjusted p-values, in the order given.
+    """
+    pvalues = np.asarray(pvalues, dtype=float)
+    m = len(pvalues)
+    if method == "none" or m == 0:
+        return pvalues.copy()
+    if method == "bonferroni":
+        return np.minimum(pvalues * m, 1.0)
+
+    order = np.argsort(pvalues, kind="stable")
+    ranked = pvalues[order]
+    if method == "holm":
+        adjusted = np.maximum.accumulate(ranked * (m - np.arange(m)))
+    elif method == "fdr_bh":
+        adjusted = ranked * m / np.arange(1, m + 1)
+        adjusted = np.minimum.accumulate(adjusted[::-1])[::-1]
+    else:
+        raise ValueError(
+            f"Unknown adjustment {method!r}, expected one of {ADJUSTMENTS}"
+        )
+    result = np.empty(m)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+
+def pairwise_tests(estimates, alpha=0.05, adjustment="holm", matrix=False):
+    """
+    Test every pair of groups for a difference in prevalence.
+
+    Parameters:
+    estimates: DataFrame indexed by group with Prevalence and Standard Error
+        columns, as from group_estimates()
+    alpha: Significance level, and 1 - the confidence level of the intervals
+    adjustment: Multiple comparison adjustment, one of ADJUSTMENTS
+    matrix: Return square matrices by group instead of one row per pair
+
+    Returns:
+    If matrix is False, a DataFrame with a row for each pair of groups (a, b):
+    the difference a - b, its standard error and confidence interval, z, the
+    p-value, the adjusted p-value, and whether the adjusted p-value is below
+    alpha. If matrix is True, a dict of DataFrames indexed by group on both axes
+    holding 'difference', 'z', 'p' and 'p_adjusted'.
+    """
+    groups = estimates.index.to_numpy()
+    prevalence = estimates["Prevalence"].to_numpy(dtype=float)
+    se = estimates["Standard Error"].to_numpy(dtype=float)
+    n = len(groups)
+
+    # Differences and their standard errors for every pair, by broadcasting
+    difference = prevalence[:, None] - prevalence[None, :]
+    variance = se**2
+    diff_se = np.sqrt(variance[:, None] + variance[None, :])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = difference / diff_se
+
+    # Each unordered pair is tested once, from the upper triangle
+    a, b = np.triu_indices(n, k=1)
+    pair_p = 2 * stats.norm.sf(np.abs(z[a, b]))
+    pair_p_adjusted = adjust_pvalues(pair_p, adjustment)
+
+    if matrix:
+        p = np.full((n, n), np.nan)
+        p_adjusted = np.full((n, n), np.nan)
+        p[a, b] = p[b, a] = pair_p
+        p_adjusted[a, b] = p_adjusted[b, a] = pair_p_adjusted
+        index = estimates.index
+        return {
+            name: pd.DataFrame(values, index=index, columns=index)
+            for name, values in [
+                ("difference", difference),
+                ("z", z),
+                ("p", p),
+                ("p_adjusted", p_adjusted),
+            ]
+        }
+
+    margin = stats.norm.isf(alpha / 2) * diff_se[a, b]
+    name = estimates.index.name or "group"
+    return pd.DataFrame(
+        {
+            f"{name}_a": groups[a],
+            f"{name}_b": groups[b],
+            "difference": difference[a, b],
+            "se": diff_se[a, b],
+            "ci_lower": difference[a, b] - margin,
+            "ci_upper": difference[a, b] + margin,
+            "z": z[a, b],
+            "p": pair_p,
+            "p_adjusted": pair_p_adjusted,
+            "significant": pair_p_adjusted < alpha,
+        }
+    )
+
+
+def simulate_prevalence(estimates, draws=DRAWS, seed=0, chunk_size=None):
+    """
+    Draw simulated prevalence for every group, from a normal distribution with the
+    group's prevalence as mean and its standard error as standard deviation,
+    clipped to 0-100%.
+
+    Parameters:
+    estimates: DataFrame indexed by group with Prevalence and Standard Error
+        columns, as from group_estimates()
+    draws: Total number of draws
+    seed: Seed of the random generator, so results can be reproduced
+    chunk_size: Number of draws per chunk; by default as many as fit in
+        MAX_CHUNK_BYTES
+
+    Yields:
+    Arrays of shape (draws in the chunk, groups).
+    """
+    prevalence = estimates["Prevalence"].to_numpy(dtype=float)
+    se = np.nan_to_num(estimates["Standard Error"].to_numpy(dtype=float))
+    if chunk_size is None:
+        chunk_size = max(1, MAX_CHUNK_BYTES // (8 * max(len(prevalence), 1)))
+    rng = np.random.default_rng(seed)
+    for start in range(0, draws, chunk_size):
+        size = min(chunk_size, draws - start)
+        values = rng.normal(prevalence, se, size=(size, len(prevalence)))
+        yield np.clip(values, 0, 100, out=values)
+
+
+def simulate_uncertainty(
+    estimates, threshold=None, draws=DRAWS, interval=0.9, seed=0, chunk_size=None
+):
+    """
+    Simulate the probability that each group's prevalence is above a threshold,
+    and the interval of its rank among the groups, 1 being the highest.
+
+    Ranks are counted in an n x n histogram of group by rank as the chunks of
+    draws are simulated, so memory is bounded by the chunk size and the number
+    of groups rather than the number of draws.
+
+    Parameters:
+    estimates: DataFrame indexed by group with Prevalence and Standard Error
+        columns, as from group_estimates()
+    threshold: Prevalence, in percent, to compare with; defaults to the mean
+        prevalence of the groups
+    draws: Total number of draws
+    interval: Coverage of the rank intervals
+    seed: Seed of the random generator, so results can be reproduced
+    chunk_size: Number of draws per chunk; see simulate_prevalence()
+
+    Returns:
+    A DataFrame indexed by group with the Prevalence and Standard Error, the
+    exceedance probability, and the median, lower and upper rank; empty if there
+    are no groups.
+    """
+    n = len(estimates)
+    if threshold is None:
+        threshold = estimates["Prevalence"].mean()
+    result = estimates[["Prevalence", "Standard Error"]].copy()
+    result.attrs["threshold"] = threshold
+    if n == 0:
+        ranks = np.zeros(0, dtype=np.int64)
+        return result.assign(
+            **{"Exceedance probability": np.zeros(0)},
+            **{"Rank": ranks, "Rank lower": ranks, "Rank upper": ranks},
+        )
+    above = np.zeros(n)
+    rank_counts = np.zeros(n * n, dtype=np.int64)
+    groups = np.arange(n)
+    for values in simulate_prevalence(estimates, draws, seed, chunk_size):
+        above += (values > threshold).sum(axis=0)
+        # Rank of each group within each draw, by descending prevalence
+        order = np.argsort(-values, axis=1)
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, groups[None, :], axis=1)
+        rank_counts += np.bincount(
+            (groups[None, :] * n + ranks).ravel(), minlength=n * n
+        )
+
+    cdf = np.cumsum(rank_counts.reshape(n, n), axis=1) / draws
+    tail = (1 - interval) / 2
+    result["Exceedance probability"] = above / draws
+    result["Rank"] = np.argmax(cdf >= 0.5, axis=1) + 1
+    result["Rank lower"] = np.argmax(cdf >= tail, axis=1) + 1
+    result["Rank upper"] = np.argmax(cdf >= 1 - tail - 1e-12, axis=1) + 1
+    return result
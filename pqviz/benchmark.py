@@ -0,0 +1,390 @@
+"""
+Benchmark suites timing and memory-profiling PQViz on synthetic data, with
+stored baselines to catch performance regressions.
+
+The ingest suite writes synthetic CODI-PQ reports (see synthetic.py) at several
+scales, once, and measures each stage of ingest over them: reading the
+prevalence and population frames, materializing the Cube, and writing the
+frames as shared datasets. Each stage is timed on its own, then run again under
+tracemalloc for its peak memory, since tracing slows the code it traces.
+
+The maps suite builds the PQ map of every state with boundaries, from synthetic
+reports covering each ZCTA3 of the country, and the CDC PLACES map when the
+PLACES data is present, without a browser. For each state it measures loading
+the boundaries, joining values to ZCTA5s, constructing the map widgets with the
+caches warm, and the size of the widget state sent to the browser, as JSON.
+The caches of boundaries and joins are cleared before they are measured, so
+they are timed cold.
+
+Every run writes a JSON report of its results. Saved as the baseline, a report
+is what later runs are compared with: a stage is flagged as a regression when
+it is slower or takes more memory than its baseline by more than the tolerance,
+and by more than timer or allocator noise. Run as a subcommand of the pqviz
+entry point:
+
+    python -m pqviz benchmark ingest --scales 100 1000 10000 --save-baseline
+    python -m pqviz benchmark ingest --scales 100 1000 10000
+    python -m pqviz benchmark maps --states DE NC TX
+"""
+
+from contextlib import redirect_stdout
+import json
+import os
+from pathlib import Path
+import platform
+import tempfile
+import time
+import tracemalloc
+
+from ipywidgets import Widget
+from ipywidgets.embed import dependency_state, embed_data
+
+from . import create_dataframes, maps, store, synthetic
+from .cube import Cube
+
+
+# Directory of benchmark reports, baselines and generated inputs
+BENCHMARK_DIR = Path("pqviz_benchmarks")
+
+# Numbers of synthetic reports the ingest suite runs over by default
+INGEST_SCALES = [100, 1000]
+
+# Share by which a stage may exceed its baseline before it is a regression, and
+# the smallest differences counted at all, below which timings and peaks are noise
+TOLERANCE = 0.25
+MIN_SECONDS = 0.05
+MIN_BYTES = 1024**2
+MIN_PAYLOAD_BYTES = 1024
+
+# Fields identifying a result, to match it with its baseline
+RESULT_KEYS = ["suite", "population_group", "reports", "map", "state", "stage"]
+
+# CDC PLACES measure drawn by the maps suite
+PLACES_MEASURE = "Obesity"
+
+
+def measure(func, *args, memory=True, setup=None):
+    """
+    Run a function and measure its wall time, and, if memory is True, run it
+    again under tracemalloc for its peak allocated bytes.
+
+    Parameters:
+    func: Function to run, with args
+    memory: Also measure the peak memory
+    setup: Optional function called before each run, untimed, e.g. to clear caches
+
+    Returns:
+    The result of the function, the seconds it took, and its peak bytes or None.
+    """
+    setup = setup or (lambda: None)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        setup()
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        peak = None
+        if memory:
+            del result
+            setup()
+            tracemalloc.start()
+            try:
+                result = func(*args)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return result, seconds, peak
+
+
+def synthetic_inputs(
+    population_group, reports, output_dir=BENCHMARK_DIR, states=None, name=None
+):
+    """
+    Return the folder of synthetic reports for a scale, writing them on first use.
+
+    Parameters:
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    reports: Number of reports
+    output_dir: Directory holding the generated reports
+    states: States to spread reports over; defaults to those of generate_reports()
+    name: Name of the folder; defaults to the population group and scale
+    """
+    name = name or f"{population_group.lower()}_{reports}"
+    folder = Path(output_dir) / "reports" / name
+    if len(list(folder.glob("*.csv"))) != reports:
+        for fname in folder.glob("*.csv"):
+            fname.unlink()
+        options = {} if states is None else {"states": states}
+        synthetic.generate_reports(folder, population_group, reports, **options)
+    return folder
+
+
+def _write_frames(prev_data, pop_data):
+    with tempfile.TemporaryDirectory() as store_dir:
+        store.write_dataset(prev_data, store.dataset_fname(store_dir, "prevalence"))
+        store.write_dataset(pop_data, store.dataset_fname(store_dir, "population"))
+
+
+def run_ingest(
+    scales=INGEST_SCALES,
+    population_groups=("Pediatric", "Adult"),
+    memory=True,
+    output_dir=BENCHMARK_DIR,
+):
+    """
+    Benchmark each ingest stage over synthetic reports at each scale.
+
+    Parameters:
+    scales: Numbers of reports to ingest
+    population_groups: Population groups, each ingested from its own layout
+    memory: Also measure the peak memory of each stage
+    output_dir: Directory holding the generated reports
+
+    Returns:
+    A list of result dicts, one per population group, scale and stage, with the
+    seconds, peak bytes and number of rows produced.
+    """
+    results = []
+    for population_group in population_groups:
+        for reports in scales:
+            folder = synthetic_inputs(population_group, reports, output_dir)
+            frames = {}
+
+            def stage(name, func, *args):
+                result, seconds, peak = measure(func, *args, memory=memory)
+                results.append(
+                    {
+                        "suite": "ingest",
+                        "population_group": population_group,
+                        "reports": reports,
+                        "stage": name,
+                        "seconds": round(seconds, 4),
+                        "peak_bytes": peak,
+                        "rows": len(result) if hasattr(result, "__len__") else None,
+                    }
+                )
+                return result
+
+            frames["prevalence"] = stage(
+                "prevalence",
+                create_dataframes.create_prevalence_df,
+                folder,
+                population_group,
+            )
+            frames["population"] = stage(
+                "population",
+                create_dataframes.create_population_df,
+                folder,
+                population_group,
+            )
+            stage("cube", Cube.from_frames, frames["prevalence"], frames["population"])
+            stage("store", _write_frames, frames["prevalence"], frames["population"])
+    return results
+
+
+def payload_bytes(widget):
+    """
+    Return the size in bytes of the JSON state of a widget and every widget it
+    depends on, as sent to the browser to display it.
+    """
+    data = embed_data(views=[widget], state=dependency_state(widget))
+    return len(json.dumps(data["manager_state"]).encode())
+
+
+def _clear_caches(*loaders):
+    """Return a function clearing the caches of cached loaders."""
+
+    def clear():
+        for loader in loaders:
+            loader.cache_clear()
+
+    return clear
+
+
+def run_maps(states=None, memory=True, output_dir=BENCHMARK_DIR):
+    """
+    Benchmark building the PQ and CDC PLACES maps of each state.
+
+    Parameters:
+    states: Two-letter state abbreviations; defaults to every state with boundaries
+    memory: Also measure the peak memory of each stage
+    output_dir: Directory holding the generated reports
+
+    Returns:
+    A list of result dicts, one per map, state and stage, with the seconds and
+    peak bytes; the payload stage has the bytes of the map's widget state, and
+    the seconds taken to serialize it.
+    """
+    all_states = sorted(maps.STATE_BOUNDS)
+    states = states or all_states
+    population_group = "Pediatric"
+    # One report of all children for each geography of the country
+    reports = len(synthetic.state_geographies(all_states))
+    folder = synthetic_inputs(
+        population_group, reports, output_dir, states=all_states, name="maps"
+    )
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        prev_data = create_dataframes.create_prevalence_df(folder, population_group)
+    cube = Cube.from_frames(prev_data)
+    category = synthetic.WEIGHT_CATEGORIES[population_group][3][0]
+
+    map_types = ["pq"]
+    if any(Path(f).is_file() for f in [maps.PLACES_FNAME, f"{maps.PLACES_FNAME}.gz"]):
+        map_types.append("places")
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            maps._cached_places()
+
+    results = []
+    for map_type in map_types:
+        for abbr in states:
+
+            def stage(name, func, *args, setup=None):
+                result, seconds, peak = measure(func, *args, memory=memory, setup=setup)
+                results.append(
+                    {
+                        "suite": "maps",
+                        "map": map_type,
+                        "state": abbr,
+                        "stage": name,
+                        "seconds": round(seconds, 4),
+                        "peak_bytes": peak,
+                    }
+                )
+                return result
+
+            state_gj = stage(
+                "boundaries",
+                maps.load_state_boundaries,
+                abbr,
+                setup=_clear_caches(maps.load_state_boundaries),
+            )
+            results[-1]["rows"] = len(state_gj["features"])
+            if map_type == "pq":
+                values = stage(
+                    "join",
+                    maps.state_layer_values,
+                    abbr,
+                    cube,
+                    category,
+                    "Crude",
+                    setup=_clear_caches(maps.state_zctas),
+                )
+                results[-1]["rows"] = len(values[0])
+                widget = stage(
+                    "layer", maps.choropleth_map_pq, abbr, cube, category, "Crude"
+                )
+            else:
+                places = stage(
+                    "join",
+                    maps.state_places,
+                    abbr,
+                    setup=_clear_caches(maps.state_zctas, maps.state_places),
+                )
+                results[-1]["rows"] = len(places)
+                widget = stage(
+                    "layer", maps.choropleth_map_places, abbr, PLACES_MEASURE
+                )
+            size = stage("payload", payload_bytes, widget)
+            results[-1]["payload_bytes"] = size
+            # Drop the map's widgets from the registry, which holds every widget
+            Widget.close_all()
+    return results
+
+
+SUITES = {"ingest": run_ingest, "maps": run_maps}
+
+
+def write_report(suite, results, fname):
+    """Write the results of a suite to a JSON report, with the machine they ran on."""
+    report = {
+        "suite": suite,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    fname = Path(fname)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    fname.write_text(json.dumps(report, indent=2))
+    return report
+
+
+def baseline_fname(suite, output_dir=BENCHMARK_DIR):
+    """Return the path of the stored baseline of a suite."""
+    return Path(output_dir) / "baselines" / f"{suite}.json"
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare results with a baseline report.
+
+    Parameters:
+    results: List of result dicts
+    baseline: Baseline report, as written by write_report()
+    tolerance: Share by which a result may exceed its baseline
+
+    Returns:
+    A list of regressions, each a result's identifying fields, the metric, its
+    baseline and current values, and their ratio.
+    """
+    baseline_results = {
+        tuple(r.get(k) for k in RESULT_KEYS): r for r in baseline["results"]
+    }
+    regressions = []
+    for result in results:
+        key = tuple(result.get(k) for k in RESULT_KEYS)
+        previous = baseline_results.get(key)
+        if previous is None:
+            continue
+        for metric, noise in [
+            ("seconds", MIN_SECONDS),
+            ("peak_bytes", MIN_BYTES),
+            ("payload_bytes", MIN_PAYLOAD_BYTES),
+        ]:
+            before, after = previous.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            if after > before * (1 + tolerance) and after - before > noise:
+                regressions.append(
+                    {
+                        **{k: result.get(k) for k in RESULT_KEYS if k in result},
+                        "metric": metric,
+                        "baseline": before,
+                        "current": after,
+                        "ratio": round(after / before, 2) if before else None,
+                    }
+                )
+    return regressions
+
+
+def run_suite(
+    suite,
+    output_dir=BENCHMARK_DIR,
+    save_baseline=False,
+    tolerance=TOLERANCE,
+    **options,
+):
+    """
+    Run a benchmark suite, write its report, and compare it with the stored
+    baseline or save it as the new baseline.
+
+    Parameters:
+    suite: Name of a suite in SUITES
+    output_dir: Directory of reports and baselines
+    save_baseline: Store this run as the baseline instead of comparing with it
+    tolerance: Share by which a result may exceed its baseline
+    options: Options of the suite's run function
+
+    Returns:
+    The report and the list of regressions, empty without a baseline.
+    """
+    results = SUITES[suite](output_dir=output_dir, **options)
+    report = write_report(suite, results, Path(output_dir) / f"{suite}.json")
+    baseline = baseline_fname(suite, output_dir)
+    if save_baseline:
+        write_report(suite, results, baseline)
+        return report, []
+    if not baseline.is_file():
+        return report, []
+    return report, compare(results, json.loads(baseline.read_text()), tolerance)
@@ -8,8 +8,12 @@ import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from .cube import Cube
+
 
 def check_suppressed(df, attribute):
+    if isinstance(df, Cube):
+        return df.suppression_table(attribute)
     suppressed_values = df.groupby(["Weight Category", attribute])
     suppressed_values = suppressed_values.count().rsub(suppressed_values.size(), axis=0)
     suppressed_values = suppressed_values[
@@ -32,13 +36,15 @@ def suppressed_zcta3(df, category, prevalence_type):
     prevalence type suppressed zcta3s.
 
     Parameters:
-    df: DataFrame of prevalence data
+    df: DataFrame of prevalence data, or a Cube of it
     category: Weight category/class
     prevalence_type: Prevalence type, one of ['Age-Adjusted', 'Crude', 'Weighted']
 
     Returns:
-    A numpy array of ZCTA3s with suppressed prevalence values.
+    A list of ZCTA3s with suppressed prevalence values.
     """
+    if isinstance(df, Cube):
+        return df.zcta3_values(category, prevalence_type)[1]
     return df.loc[
         (df["Weight Category"] == category)
         & (df["Prevalence type"] == prevalence_type)
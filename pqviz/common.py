@@ -0,0 +1,35 @@
+"""
+Helpers shared across PQViz modules. This module imports nothing from the rest of
+the package, so any module can use it without creating an import cycle.
+"""
+
+import hashlib
+from pathlib import Path
+
+import us
+
+
+def inputs_fingerprint(results_folder):
+    """
+    Hash the names, sizes and modification times of the files in a results folder.
+    """
+    digest = hashlib.sha1()
+    for fname in sorted(Path(results_folder).rglob("*")):
+        if fname.is_file():
+            stat = fname.stat()
+            digest.update(f"{fname}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def restore_states(df):
+    """
+    Turn a state column of state abbreviations back into us.State objects, as in
+    frames from create_prevalence_df().
+    """
+    if "state" in df.columns:
+        states = {
+            abbr: us.states.lookup(abbr) if isinstance(abbr, str) else abbr
+            for abbr in df["state"].unique()
+        }
+        df["state"] = df["state"].astype(object).map(states)
+    return df
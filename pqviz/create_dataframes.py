@@ -8,6 +8,8 @@ import pandas as pd
 import seaborn as sns
 import us
 
+from .crosswalk import resolve_location_code
+
 
 def create_prevalence_df(file_path, population_group):
     """
@@ -70,20 +72,9 @@ def create_prevalence_df(file_path, population_group):
                 .reset_index()
                 .at[0, 0]
             )
-            # identify state
-            if len(location_code) == 2:
-                state_cd = location_code
-                df["zcta3"] = np.nan
-
-            else:
-                zcta3 = []
-                states = []
-                for loc in [l.strip() for l in location_code.split(",")]:
-                    zcta3.append(loc[2:])
-                    states.append(loc[:2])
-                df["zcta3"] = ",".join(zcta3)
-                states = list(set(states))
-                state_cd = ",".join(states)
+            # identify state and zcta3s
+            zcta3, state_cd = resolve_location_code(location_code)
+            df["zcta3"] = zcta3
 
             state = us.states.lookup(state_cd)
             df["state"] = state
@@ -151,20 +142,9 @@ def create_prevalence_df(file_path, population_group):
                 .reset_index()
                 .at[0, 0]
             )
-            # identify state
-            if len(location_code) == 2:
-                state_cd = location_code
-                df["zcta3"] = np.nan
-
-            else:
-                zcta3 = []
-                states = []
-                for loc in [l.strip() for l in location_code.split(",")]:
-                    zcta3.append(loc[2:])
-                    states.append(loc[:2])
-                df["zcta3"] = ",".join(zcta3)
-                states = list(set(states))
-                state_cd = ",".join(states)
+            # identify state and zcta3s
+            zcta3, state_cd = resolve_location_code(location_code)
+            df["zcta3"] = zcta3
 
             state = us.states.lookup(state_cd)
             df["state"] = state
@@ -322,20 +302,9 @@ def create_population_df(file_path, population_group):
                 .reset_index()
                 .at[0, 0]
             )
-            # identify state
-            if len(location_code) == 2:
-                state_cd = location_code
-                df["zcta3"] = np.nan
-
-            else:
-                zcta3 = []
-                states = []
-                for loc in [l.strip() for l in location_code.split(",")]:
-                    zcta3.append(loc[2:])
-                    states.append(loc[:2])
-                df["zcta3"] = ",".join(zcta3)
-                states = list(set(states))
-                state_cd = ",".join(states)
+            # identify state and zcta3s
+            zcta3, state_cd = resolve_location_code(location_code)
+            df["zcta3"] = zcta3
 
             state = us.states.lookup(state_cd)
             df["state"] = state
@@ -403,20 +372,9 @@ def create_population_df(file_path, population_group):
                 .reset_index()
                 .at[0, 0]
             )
-            # identify state
-            if len(location_code) == 2:
-                state_cd = location_code
-                df["zcta3"] = np.nan
-
-            else:
-                zcta3 = []
-                states = []
-                for loc in [l.strip() for l in location_code.split(",")]:
-                    zcta3.append(loc[2:])
-                    states.append(loc[:2])
-                df["zcta3"] = ",".join(zcta3)
-                states = list(set(states))
-                state_cd = ",".join(states)
+            # identify state and zcta3s
+            zcta3, state_cd = resolve_location_code(location_code)
+            df["zcta3"] = zcta3
             state = us.states.lookup(state_cd)
             df["state"] = state
             # read in age as outputed from pq
@@ -0,0 +1,238 @@
+"""
+Geography crosswalk between ZIP Codes, ZCTA5s, ZCTA3s and states.
+
+The UDS Mapper ZIP Code to ZCTA mapping is read once with string types, so codes
+keep their leading zeros, and compacted into sorted code arrays with integer
+index arrays for each relationship. Lookups are binary searches and array slices
+rather than DataFrame filters. The arrays are stored in a binary sidecar next to
+the mapping file, and rebuilt whenever the mapping file is newer.
+"""
+
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import us
+
+
+CROSSWALK_FNAME = Path("reference_data/zcta-zip-mapping-2020.csv.gz")
+
+# ZIP Codes in the mapping without a ZCTA (freely associated states) use this value
+NO_ZCTA = "No ZCTA"
+
+
+class Crosswalk:
+    """
+    Array-backed lookups between ZIP Codes, ZCTA5s, ZCTA3s and states.
+
+    Codes are held in sorted arrays (zips, zcta5s, zcta3s, states). Each ZIP Code
+    points to its ZCTA5 and each ZCTA5 to its ZCTA3 by position. The many-to-many
+    relationships of states to ZCTA5s and ZCTA3s to states are held in compressed
+    form: the members of the i-th state are state_zcta5[state_offsets[i]:
+    state_offsets[i + 1]], and likewise for zcta3_state and zcta3_offsets.
+    """
+
+    ARRAYS = [
+        "zips",
+        "zip_zcta5",
+        "zcta5s",
+        "zcta5_zcta3",
+        "zcta3s",
+        "states",
+        "state_offsets",
+        "state_zcta5",
+        "zcta3_offsets",
+        "zcta3_state",
+    ]
+
+    def __init__(self, **arrays):
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_dataframe(cls, z2z):
+        """
+        Build the crosswalk from the ZIP Code to ZCTA mapping, read with string types.
+        """
+        z2z = z2z.loc[z2z["ZCTA"] != NO_ZCTA].sort_values("ZIP_CODE")
+        zips = z2z["ZIP_CODE"].to_numpy(dtype="U5")
+        zcta5s, zip_zcta5 = np.unique(
+            z2z["ZCTA"].to_numpy(dtype="U5"), return_inverse=True
+        )
+        zcta3s, zcta5_zcta3 = np.unique(zcta5s.astype("U3"), return_inverse=True)
+        states, zip_state = np.unique(
+            z2z["STATE"].to_numpy(dtype="U2"), return_inverse=True
+        )
+
+        # Distinct (state, ZCTA5) pairs, sorted by state then ZCTA5
+        pairs = np.unique(np.stack([zip_state, zip_zcta5], axis=1), axis=0)
+        state_offsets = np.searchsorted(pairs[:, 0], np.arange(len(states) + 1))
+        state_zcta5 = pairs[:, 1]
+
+        # Distinct (ZCTA3, state) pairs, sorted by ZCTA3 then state
+        pairs = np.unique(
+            np.stack([zcta5_zcta3[pairs[:, 1]], pairs[:, 0]], axis=1), axis=0
+        )
+        zcta3_offsets = np.searchsorted(pairs[:, 0], np.arange(len(zcta3s) + 1))
+        zcta3_state = pairs[:, 1]
+
+        return cls(
+            zips=zips,
+            zip_zcta5=zip_zcta5.astype(np.int32),
+            zcta5s=zcta5s,
+            zcta5_zcta3=zcta5_zcta3.astype(np.int32),
+            zcta3s=zcta3s,
+            states=states,
+            state_offsets=state_offsets.astype(np.int32),
+            state_zcta5=state_zcta5.astype(np.int32),
+            zcta3_offsets=zcta3_offsets.astype(np.int32),
+            zcta3_state=zcta3_state.astype(np.int32),
+        )
+
+    @classmethod
+    def load(cls, fname):
+        """Load a crosswalk saved with save()."""
+        with np.load(fname, allow_pickle=False) as arrays:
+            return cls(**{name: arrays[name] for name in cls.ARRAYS})
+
+    def save(self, fname):
+        """Save the crosswalk arrays to a binary .npz file."""
+        np.savez(fname, **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @staticmethod
+    def _positions(codes, values):
+        """
+        Return the positions of values within a sorted code array, and a mask of
+        which values were found.
+        """
+        values = np.asarray(values, dtype=codes.dtype)
+        pos = np.searchsorted(codes, values)
+        pos = np.minimum(pos, len(codes) - 1)
+        return pos, codes[pos] == values
+
+    def state_zcta5s(self, abbr):
+        """
+        Return a sorted array of the ZCTA5s in a state.
+
+        Parameters:
+        abbr: Two-letter state abbreviation
+
+        Returns:
+        A numpy array of ZCTA5 strings, empty for an unknown state.
+        """
+        pos, found = self._positions(self.states, [abbr])
+        if not found[0]:
+            return self.zcta5s[:0]
+        i = pos[0]
+        members = self.state_zcta5[self.state_offsets[i] : self.state_offsets[i + 1]]
+        return self.zcta5s[members]
+
+    def zcta5_to_zcta3(self, zcta5s):
+        """
+        Return the ZCTA3 of each of an array of ZCTA5s; unknown ZCTA5s map to "".
+        """
+        pos, found = self._positions(self.zcta5s, zcta5s)
+        return np.where(found, self.zcta3s[self.zcta5_zcta3[pos]], "")
+
+    def zip_to_zcta5(self, zips):
+        """
+        Return the ZCTA5 of each of an array of ZIP Codes; unknown ZIP Codes map to "".
+        """
+        pos, found = self._positions(self.zips, zips)
+        return np.where(found, self.zcta5s[self.zip_zcta5[pos]], "")
+
+    def zcta3_states(self, zcta3):
+        """
+        Return a sorted array of the states containing any ZCTA5 of a ZCTA3.
+
+        Parameters:
+        zcta3: Three-digit ZCTA3 code
+
+        Returns:
+        A numpy array of state abbreviations, empty for an unknown ZCTA3.
+        """
+        pos, found = self._positions(self.zcta3s, [zcta3])
+        if not found[0]:
+            return self.states[:0]
+        i = pos[0]
+        members = self.zcta3_state[self.zcta3_offsets[i] : self.zcta3_offsets[i + 1]]
+        return self.states[members]
+
+
+@lru_cache(maxsize=None)
+def load_crosswalk(fname=CROSSWALK_FNAME):
+    """
+    Load the geography crosswalk, from its binary sidecar if it is up to date, or
+    else from the ZIP Code to ZCTA mapping file, saving the sidecar for next time.
+
+    Parameters:
+    fname: File path for the ZIP Code to ZCTA mapping csv data
+
+    Returns:
+    A Crosswalk.
+    """
+    fname = Path(fname)
+    sidecar = fname.with_name(fname.name.split(".")[0] + ".npz")
+    if sidecar.is_file() and sidecar.stat().st_mtime >= fname.stat().st_mtime:
+        return Crosswalk.load(sidecar)
+
+    z2z = pd.read_csv(fname, dtype=str, encoding="utf-8-sig")
+    crosswalk = Crosswalk.from_dataframe(z2z)
+    try:
+        crosswalk.save(sidecar)
+    except OSError:
+        # A read-only install can still use the crosswalk, just without the sidecar
+        pass
+    return crosswalk
+
+
+def parse_location_code(location_code):
+    """
+    Split a CODI-PQ geography code into its state FIPS code and ZCTA3s. Codes are
+    either a two-digit state FIPS code, or a comma-separated list of state FIPS
+    codes each followed by a three-digit ZCTA3, e.g. "37270, 37271".
+
+    Parameters:
+    location_code: Geography code as extracted from a PQ output file
+
+    Returns:
+    A comma-separated string of ZCTA3s, or np.nan for a state-level code, and a
+    comma-separated string of the distinct state FIPS codes.
+    """
+    codes = [code.strip() for code in location_code.split(",")]
+    if len(codes) == 1 and len(codes[0]) == 2:
+        return np.nan, codes[0]
+    zcta3s = ",".join(code[2:] for code in codes)
+    state_cds = ",".join(sorted(set(code[:2] for code in codes)))
+    return zcta3s, state_cds
+
+
+@lru_cache(maxsize=None)
+def resolve_location_code(location_code, fname=CROSSWALK_FNAME):
+    """
+    Parse a CODI-PQ geography code with parse_location_code(), and check each of
+    its ZCTA3s against the crosswalk: a ZCTA3 unknown to it, or without ZCTA5s in
+    the state its code gives, is reported but kept. Each distinct code is resolved
+    once, as a results folder holds a file per geography and demographic group.
+
+    Parameters:
+    location_code: Geography code as extracted from a PQ output file
+    fname: File path for the ZIP Code to ZCTA mapping csv data
+
+    Returns:
+    As parse_location_code().
+    """
+    zcta3s, state_cds = parse_location_code(location_code)
+    if not isinstance(zcta3s, str):
+        return zcta3s, state_cds
+
+    crosswalk = load_crosswalk(fname)
+    for code in (code.strip() for code in location_code.split(",")):
+        state = us.states.lookup(code[:2])
+        if state is None or state.abbr not in crosswalk.zcta3_states(code[2:]):
+            print(
+                f"ZCTA3 {code[2:]} of geography {location_code} is not in state "
+                f"{code[:2]}"
+            )
+    return zcta3s, state_cds
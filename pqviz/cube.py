@@ -0,0 +1,459 @@
+"""
+A dense, array-backed cube of PQ results for fast slicing.
+
+Every interactive view of the notebook is a slice of the same few dimensions:
+weight category, prevalence type, and the demographic columns sex, race, age,
+state, ZCTA3 and year. After ingest, the long prevalence and population frames
+are materialized once into numpy arrays with one axis per dimension. Each axis
+is coded: its labels are held in a sorted array, and a label's position is its
+code. Plots, maps and suppression tables then read values by array indexing and
+reductions instead of filtering the long frame.
+
+Each ZCTA3 lies in one state, so state and ZCTA3 share a single geography axis
+holding only the (state, ZCTA3) pairs present in the results, rather than an
+axis each, whose product would be almost entirely empty for national results.
+Selections and reductions by state or ZCTA3 are translated to the geography
+axis, so callers still use 'state' and 'zcta3' as axes.
+
+Fields of the cube, each with the axes of FIELD_AXES:
+
+    prevalence   mean prevalence of the cell, NaN where suppressed or missing
+    se           mean standard error of the cell
+    present      whether the results include the cell
+    suppressed   whether the prevalence of the cell was suppressed
+    population   weighted population count, without the prevalence type axis
+    sample       sample count, without the prevalence type axis
+"""
+
+import numpy as np
+import pandas as pd
+import us
+
+
+# Demographic dimensions of the cube, after weight category and prevalence type
+DIMENSIONS = ["sex", "race", "age", "state", "zcta3", "year"]
+
+# Dimensions held together on the geography axis of the fields
+GEOGRAPHY = ["state", "zcta3"]
+
+# Axes of the fields
+FIELD_AXES = ["category", "type", "sex", "race", "age", "geography", "year"]
+
+# Axes selected to find the row of the whole population of a ZCTA3
+POPULATION_AXES = ["sex", "race", "age", "year"]
+
+# Label of cells without a value for a dimension, e.g. zcta3 of state-level results
+MISSING = ""
+
+# Largest number of cells allowed in a cube, to catch results that would be too
+# sparse to hold densely
+MAX_CELLS = 50_000_000
+
+
+def _labels(series):
+    """Return the labels of a column as text, with states as abbreviations."""
+    values = [getattr(v, "abbr", v) for v in series]
+    return (
+        pd.Series(values, index=series.index, dtype=object).fillna(MISSING).astype(str)
+    )
+
+
+def population_labels(labels):
+    """
+    Return the labels of the row of a ZCTA3 that covers its whole population: for
+    each demographic, the label listing the most values, as "Male, Female", with
+    ties going to the first in sorted order, and the latest years.
+
+    Parameters:
+    labels: Dict of each of POPULATION_AXES to its labels
+
+    Returns:
+    A dict of axis name to label.
+    """
+    selection = {
+        name: max(sorted(labels[name]), key=lambda label: len(label.split(",")))
+        for name in POPULATION_AXES
+        if name != "year"
+    }
+    selection["year"] = max(labels["year"])
+    return selection
+
+
+def _mean_into(shape, codes, values):
+    """
+    Average values into a dense array at the given codes; cells without a value
+    are NaN. Rows for the same cell, as duplicate files would give, are averaged
+    like the bar plots average them.
+    """
+    flat = np.ravel_multi_index(codes, shape)
+    size = int(np.prod(shape))
+    valid = ~np.isnan(values)
+    sums = np.bincount(flat[valid], weights=values[valid], minlength=size)
+    counts = np.bincount(flat[valid], minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return means.reshape(shape)
+
+
+def _group_sum(values, groups, size):
+    """Sum an array over the groups of the positions of its last axis."""
+    sums = np.zeros(values.shape[:-1] + (size,), dtype=values.dtype)
+    np.add.at(sums, (Ellipsis, groups), values)
+    return sums
+
+
+class Cube:
+    """
+    PQ results as dense arrays over coded axes.
+
+    Attributes:
+    axes: Dict of axis name to the array of its labels, in axis order
+    geography: Dict of 'state' and 'zcta3' to the codes of each position of the
+        geography axis on those axes
+    prevalence, se, present, suppressed: Arrays over FIELD_AXES
+    population, sample: Arrays over FIELD_AXES except 'type'; None without population data
+    """
+
+    def __init__(self, axes, geography, fields):
+        self.axes = axes
+        self.geography = geography
+        self.prevalence = fields["prevalence"]
+        self.se = fields["se"]
+        self.present = fields["present"]
+        self.suppressed = fields["suppressed"]
+        self.population = fields.get("population")
+        self.sample = fields.get("sample")
+
+    @classmethod
+    def from_frames(cls, prev_data, pop_data=None):
+        """
+        Materialize a cube from the frames created using create_prevalence_df() and
+        create_population_df().
+
+        Raises:
+        ValueError: If the cube would have more than MAX_CELLS cells.
+        """
+        frames = [prev_data] if pop_data is None else [prev_data, pop_data]
+        labels = [
+            {dim: _labels(df[dim]) for dim in ["Weight Category"] + DIMENSIONS}
+            for df in frames
+        ]
+        axes = {
+            "category": np.unique(
+                np.concatenate([l["Weight Category"].to_numpy() for l in labels])
+            ),
+            "type": np.unique(prev_data["Prevalence type"].astype(str)),
+        }
+        for dim in DIMENSIONS:
+            axes[dim] = np.unique(np.concatenate([l[dim].to_numpy() for l in labels]))
+
+        def codes(df_labels, axis_names):
+            return tuple(
+                np.searchsorted(
+                    axes[name],
+                    df_labels["Weight Category" if name == "category" else name],
+                )
+                for name in axis_names
+            )
+
+        # Code each (state, ZCTA3) pair present in the results on the geography axis
+        n_zcta3s = len(axes["zcta3"])
+        pairs = [
+            state * n_zcta3s + zcta3
+            for state, zcta3 in (codes(l, GEOGRAPHY) for l in labels)
+        ]
+        geography_pairs = np.unique(np.concatenate(pairs))
+        geography = {
+            "state": geography_pairs // n_zcta3s,
+            "zcta3": geography_pairs % n_zcta3s,
+        }
+
+        def field_codes(df_labels, df_pairs):
+            return codes(df_labels, ["sex", "race", "age"]) + (
+                np.searchsorted(geography_pairs, df_pairs),
+                np.searchsorted(axes["year"], df_labels["year"]),
+            )
+
+        shape = tuple(
+            len(geography_pairs) if name == "geography" else len(axes[name])
+            for name in FIELD_AXES
+        )
+        if np.prod(shape, dtype=np.int64) > MAX_CELLS:
+            raise ValueError(f"Cube of shape {shape} is too large to materialize")
+
+        prev_labels = dict(labels[0], type=prev_data["Prevalence type"].astype(str))
+        prev_codes = (
+            codes(prev_labels, ["category"])
+            + (np.searchsorted(axes["type"], prev_labels["type"]),)
+            + field_codes(prev_labels, pairs[0])
+        )
+        prevalence = pd.to_numeric(prev_data["Prevalence"]).to_numpy(dtype=float)
+        fields = {
+            "prevalence": _mean_into(shape, prev_codes, prevalence),
+            "se": _mean_into(
+                shape,
+                prev_codes,
+                pd.to_numeric(prev_data["Standard Error"]).to_numpy(dtype=float),
+            ),
+            "present": np.zeros(shape, dtype=bool),
+            "suppressed": np.zeros(shape, dtype=bool),
+        }
+        fields["present"][prev_codes] = True
+        fields["suppressed"][prev_codes] = np.isnan(prevalence)
+        # A cell is suppressed only if none of its rows has a value
+        fields["suppressed"] &= np.isnan(fields["prevalence"])
+
+        if pop_data is not None:
+            pop_shape = shape[:1] + shape[2:]
+            pop_codes = codes(labels[1], ["category"]) + field_codes(
+                labels[1], pairs[1]
+            )
+            pop_type = pop_data["Population type"].astype(str).to_numpy()
+            counts = pop_data["Population"].to_numpy(dtype=float)
+            for field, pop_type_name in [
+                ("population", "Population"),
+                ("sample", "Sample"),
+            ]:
+                rows = pop_type == pop_type_name
+                fields[field] = _mean_into(
+                    pop_shape, tuple(c[rows] for c in pop_codes), counts[rows]
+                )
+        return cls(axes, geography, fields)
+
+    @property
+    def shape(self):
+        return self.prevalence.shape
+
+    @property
+    def nbytes(self):
+        """Total size of the cube's arrays in bytes."""
+        arrays = [self.prevalence, self.se, self.present, self.suppressed]
+        arrays += [a for a in (self.population, self.sample) if a is not None]
+        return sum(a.nbytes for a in arrays)
+
+    def axis(self, name):
+        """Return the position of an axis in the fields; state and zcta3 share one."""
+        return FIELD_AXES.index("geography" if name in GEOGRAPHY else name)
+
+    def code(self, axis, label):
+        """
+        Return the code of a label on an axis, or -1 if the axis has no such label.
+        States may be given as us.State objects, names or abbreviations.
+        """
+        if axis == "state":
+            label = getattr(label, "abbr", label)
+            state = us.states.lookup(str(label)) if len(str(label)) > 2 else None
+            label = state.abbr if state else label
+        labels = self.axes[axis]
+        pos = np.searchsorted(labels, str(label))
+        if pos < len(labels) and labels[pos] == str(label):
+            return int(pos)
+        return -1
+
+    def _select(self, values, selection, field_axes=FIELD_AXES):
+        """
+        Select the cells of a field by axis labels. Axes not in the selection are
+        kept whole; selecting a state or ZCTA3 keeps the positions of the
+        geography axis within it.
+
+        Parameters:
+        values: Array of a field
+        selection: Dict of axis name to one label
+        field_axes: Names of the field's axes
+
+        Returns:
+        The selected cells, the names of their axes, and the positions of the
+        geography axis kept, or None if a label is not in the cube.
+        """
+        codes = {name: self.code(name, label) for name, label in selection.items()}
+        if any(code < 0 for code in codes.values()):
+            return None
+        index = tuple(codes.get(name, slice(None)) for name in field_axes)
+        remaining = [name for name in field_axes if name not in selection]
+        cells = values[index]
+        kept = np.ones(len(self.geography["state"]), dtype=bool)
+        for name in GEOGRAPHY:
+            if name in codes:
+                kept &= self.geography[name] == codes[name]
+        positions = np.flatnonzero(kept)
+        if len(positions) < len(kept):
+            cells = np.take(cells, positions, axis=remaining.index("geography"))
+        return cells, remaining, positions
+
+    def _any_by_label(self, cells, selection, axis):
+        """
+        Return, for each label of an axis, whether any cell of a boolean field in a
+        selection is set.
+        """
+        labels = self.axes[axis]
+        found = np.zeros(len(labels), dtype=bool)
+        selected = self._select(cells, selection)
+        if selected is None:
+            return found
+        cells, remaining, positions = selected
+        if axis in GEOGRAPHY:
+            cells = np.moveaxis(cells, remaining.index("geography"), 0)
+            any_cells = cells.reshape(len(positions), -1).any(axis=1)
+            found[self.geography[axis][positions[any_cells]]] = True
+        elif axis in selection:
+            found[self.code(axis, selection[axis])] = cells.any()
+        else:
+            cells = np.moveaxis(cells, remaining.index(axis), 0)
+            found = cells.reshape(len(labels), -1).any(axis=1)
+        return found
+
+    def reduce(self, field, selection, keep, fill=None):
+        """
+        Select cells by label and average a field over every other axis except
+        those kept, counting only cells present in the results.
+
+        Parameters:
+        field: Name of a field, one of ['prevalence', 'se', 'population', 'sample']
+        selection: Dict of axis name to one label
+        keep: Names of the axes to keep, in order
+        fill: Value used for suppressed cells before averaging; if None they are
+            left out of the average
+
+        Returns:
+        An array over the kept axes, NaN where no cell has a value.
+        """
+        field_axes = list(FIELD_AXES)
+        if field in ("population", "sample"):
+            field_axes.remove("type")
+            selection = {k: v for k, v in selection.items() if k != "type"}
+            present = self.present.any(axis=FIELD_AXES.index("type"))
+        else:
+            present = self.present
+        selected = self._select(getattr(self, field), selection, field_axes)
+        if selected is None:
+            return np.full([len(self.axes[name]) for name in keep], np.nan)
+        values, remaining, positions = selected
+        present = self._select(present, selection, field_axes)[0]
+
+        if fill is not None:
+            values = np.where(present, np.nan_to_num(values, nan=fill), np.nan)
+        # Move the kept axes to the front, in order, with the geography axis last
+        # if a state or ZCTA3 is kept, and average the rest
+        kept = [name for name in keep if name not in GEOGRAPHY]
+        kept_geography = [name for name in keep if name in GEOGRAPHY]
+        front = kept + (["geography"] if kept_geography else [])
+        values = np.moveaxis(
+            values, [remaining.index(n) for n in front], range(len(front))
+        )
+        values = values.reshape(values.shape[: len(front)] + (-1,))
+        counts = (~np.isnan(values)).sum(axis=-1)
+        sums = np.nansum(values, axis=-1)
+        if kept_geography:
+            # Sum the positions of the geography axis into their states or ZCTA3s
+            sizes = tuple(len(self.axes[name]) for name in kept_geography)
+            groups = np.ravel_multi_index(
+                [self.geography[name][positions] for name in kept_geography], sizes
+            )
+            sums, counts = (
+                _group_sum(a, groups, int(np.prod(sizes))).reshape(a.shape[:-1] + sizes)
+                for a in (sums, counts)
+            )
+            kept += kept_geography
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        return np.moveaxis(means, [kept.index(n) for n in keep], range(len(keep)))
+
+    def plot_rows(self, demographic_type, selected_demo, sample_type):
+        """
+        Return the rows plotted for one demographic value and prevalence or
+        population type, in the form of plots.plot_subset(): one row per weight
+        category, values as numbers and suppressed values as 0.
+        """
+        selection = {demographic_type: selected_demo}
+        if sample_type in ("Population", "Sample"):
+            field = sample_type.lower()
+            columns = {"Population": self.reduce(field, selection, ["category"], 0)}
+        else:
+            selection["type"] = sample_type
+            columns = {
+                "Prevalence": self.reduce("prevalence", selection, ["category"], 0),
+                "Standard Error": self.reduce("se", selection, ["category"], 0),
+            }
+        rows = self._any_by_label(self.present, selection, "category")
+
+        states = self.reduce_labels("state", selection)
+        df = pd.DataFrame({"Weight Category": self.axes["category"], **columns})
+        df[demographic_type] = selected_demo
+        df["state"] = us.states.lookup(states[0]) if len(states) else None
+        return df.loc[rows].reset_index(drop=True)
+
+    def reduce_labels(self, axis, selection):
+        """Return the labels of an axis present in the results for a selection."""
+        found = self._any_by_label(self.present, selection, axis)
+        return self.axes[axis][found & (self.axes[axis] != MISSING)]
+
+    def zcta3_values(self, category, prevalence_type):
+        """
+        Return the prevalence of each ZCTA3 for a weight category and prevalence
+        type, from the row of its whole population (see population_labels()), and
+        the ZCTA3s with suppressed values.
+
+        Returns:
+        A Series of ZCTA3 to prevalence for ZCTA3s with values, and a list of
+        ZCTA3s with suppressed values.
+        """
+        selection = {"category": category, "type": prevalence_type}
+        population = population_labels(
+            {name: self.axes[name] for name in POPULATION_AXES}
+        )
+        values = self.reduce("prevalence", {**selection, **population}, ["zcta3"])
+        suppressed = self._any_by_label(self.suppressed, selection, "zcta3")
+        zcta3s = self.axes["zcta3"]
+        has_label = zcta3s != MISSING
+        valid = has_label & ~np.isnan(values)
+        return (
+            pd.Series(values[valid], index=zcta3s[valid], dtype=float),
+            zcta3s[has_label & suppressed].tolist(),
+        )
+
+    def suppression_table(self, attribute):
+        """
+        Count suppressed values by weight category and a demographic, in the form
+        of check_suppressed.check_suppressed().
+
+        Returns:
+        A DataFrame of counts, or None if nothing is suppressed.
+        """
+        counts = np.moveaxis(
+            self.suppressed,
+            [self.axis("category"), self.axis(attribute)],
+            [0, 1],
+        )
+        counts = counts.reshape(counts.shape[:2] + (-1,)).sum(axis=-1)
+        if attribute in GEOGRAPHY:
+            counts = _group_sum(
+                counts, self.geography[attribute], len(self.axes[attribute])
+            )
+        # Rows without a value for the demographic are left out, as by groupby()
+        counts[:, self.axes[attribute] == MISSING] = 0
+        category_codes, attribute_codes = np.nonzero(counts)
+        if len(category_codes) == 0:
+            print("There are no suppressed values for this demographic level.")
+            return None
+        return pd.DataFrame(
+            {
+                "Weight Category": self.axes["category"][category_codes],
+                attribute: self.axes[attribute][attribute_codes],
+                "Number of subpopulations with suppressed values": counts[
+                    category_codes, attribute_codes
+                ],
+            }
+        )
+
+
+def cube_or_frame(prev_data, pop_data=None):
+    """
+    Materialize a Cube from the prevalence and population frames, or, if the
+    results are too large for one, return the prevalence frame in its place; the
+    plots, maps and suppression tables take either.
+    """
+    try:
+        return Cube.from_frames(prev_data, pop_data)
+    except ValueError as e:
+        print(f"Using the data frames directly: {e}")
+        return prev_data
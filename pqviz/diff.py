@@ -0,0 +1,221 @@
+"""
+Differences between two runs of CODI-PQ over the same data, e.g. before and
+after a site fixes its data and runs the query again.
+
+The prevalence cells of both runs are aligned on their dimensions: weight
+category, prevalence type, sex, race, age, state, ZCTA3 and years. Each
+dimension is coded as integers over the labels of both runs, and the codes are
+packed into one integer key per cell. Both runs are sorted by key and merged
+with a binary search, so aligning national runs costs two sorts rather than a
+merge of wide text frames. Only cells that differ are reported:
+
+    changed       both runs have a value, and it differs
+    suppressed    the old run has a value, the new run suppressed it
+    unsuppressed  the old run suppressed the cell, the new run has a value
+    added         the cell is only in the new run
+    removed       the cell is only in the old run
+
+    changes = diff.diff_runs(old_prev_data, new_prev_data)
+    diff.summarize(changes)
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import create_dataframes
+from .common import restore_states
+
+
+# Columns identifying a prevalence cell
+KEY_COLUMNS = [
+    "Weight Category",
+    "Prevalence type",
+    "sex",
+    "race",
+    "age",
+    "state",
+    "zcta3",
+    "year",
+]
+
+CHANGE_TYPES = ["changed", "suppressed", "unsuppressed", "added", "removed"]
+
+
+def _codes(old, new):
+    """
+    Code the key columns of both runs as integers over their combined labels,
+    and pack them into one int64 key per row.
+
+    Returns:
+    The keys of the old and new rows, and the labels of each key column.
+    """
+    old_keys = np.zeros(len(old), dtype=np.int64)
+    new_keys = np.zeros(len(new), dtype=np.int64)
+    labels = {}
+    radix = 1
+    for column in reversed(KEY_COLUMNS):
+        values = pd.concat([old[column], new[column]], ignore_index=True)
+        # Missing values, e.g. zcta3 of state-level results, get a code too
+        codes, uniques = pd.factorize(values.to_numpy(dtype=object), sort=False)
+        uniques = list(uniques)
+        if (codes < 0).any():
+            codes = np.where(codes < 0, len(uniques), codes)
+            uniques.append(None)
+        if column == "state":
+            uniques = [getattr(s, "abbr", s) for s in uniques]
+        labels[column] = np.array(uniques, dtype=object)
+        old_keys += codes[: len(old)].astype(np.int64) * radix
+        new_keys += codes[len(old) :].astype(np.int64) * radix
+        radix *= len(uniques)
+        if radix >= 2**62:
+            raise ValueError("Too many distinct cells to pack into one integer key")
+    return old_keys, new_keys, labels
+
+
+def _unique_cells(keys, df):
+    """
+    Sort the rows of a run by key, averaging the values of rows with the same key,
+    as the bar plots do for results repeated across files.
+
+    Returns:
+    The sorted unique keys, and the prevalence and standard error of each.
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    columns = []
+    for column in ["Prevalence", "Standard Error"]:
+        values = pd.to_numeric(df[column]).to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        sums = np.bincount(
+            inverse[valid], weights=values[valid], minlength=len(unique_keys)
+        )
+        counts = np.bincount(inverse[valid], minlength=len(unique_keys))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            columns.append(sums / counts)
+    return unique_keys, columns[0], columns[1]
+
+
+def diff_runs(old, new, tolerance=0.0):
+    """
+    Compare the prevalence cells of two runs.
+
+    Parameters:
+    old: DataFrame created using create_prevalence_df() from the earlier run
+    new: DataFrame created using create_prevalence_df() from the later run
+    tolerance: Largest difference in prevalence or standard error still counted
+        as unchanged
+
+    Returns:
+    A DataFrame with a row for each cell that differs: its KEY_COLUMNS, the
+    change type, one of CHANGE_TYPES, the old and new prevalence and standard
+    error, and the difference in prevalence.
+    """
+    old_keys, new_keys, labels = _codes(old, new)
+    old_keys, old_prev, old_se = _unique_cells(old_keys, old)
+    new_keys, new_prev, new_se = _unique_cells(new_keys, new)
+
+    # Merge the sorted keys: position of each new key among the old keys
+    pos = np.searchsorted(old_keys, new_keys)
+    pos_in_range = np.minimum(pos, max(len(old_keys) - 1, 0))
+    matched = (
+        (pos < len(old_keys)) & (old_keys[pos_in_range] == new_keys)
+        if len(old_keys)
+        else np.zeros(len(new_keys), dtype=bool)
+    )
+    old_matched = np.zeros(len(old_keys), dtype=bool)
+    old_matched[pos[matched]] = True
+
+    # Values of the matched cells, side by side
+    o = pos[matched]
+    a_prev, b_prev = old_prev[o], new_prev[matched]
+    a_se, b_se = old_se[o], new_se[matched]
+    a_has, b_has = ~np.isnan(a_prev), ~np.isnan(b_prev)
+    with np.errstate(invalid="ignore"):
+        differs = (np.abs(b_prev - a_prev) > tolerance) | (
+            np.abs(np.nan_to_num(b_se) - np.nan_to_num(a_se)) > tolerance
+        )
+    change = np.full(len(o), "", dtype=object)
+    change[a_has & b_has & differs] = "changed"
+    change[a_has & ~b_has] = "suppressed"
+    change[~a_has & b_has] = "unsuppressed"
+    reported = change != ""
+
+    parts = [
+        (
+            new_keys[matched][reported],
+            change[reported],
+            a_prev[reported],
+            b_prev[reported],
+            a_se[reported],
+            b_se[reported],
+        ),
+        (
+            new_keys[~matched],
+            np.full((~matched).sum(), "added", dtype=object),
+            np.full((~matched).sum(), np.nan),
+            new_prev[~matched],
+            np.full((~matched).sum(), np.nan),
+            new_se[~matched],
+        ),
+        (
+            old_keys[~old_matched],
+            np.full((~old_matched).sum(), "removed", dtype=object),
+            old_prev[~old_matched],
+            np.full((~old_matched).sum(), np.nan),
+            old_se[~old_matched],
+            np.full((~old_matched).sum(), np.nan),
+        ),
+    ]
+    keys, change, a_prev, b_prev, a_se, b_se = (
+        np.concatenate(arrays) for arrays in zip(*parts)
+    )
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+
+    # Unpack the key columns of the reported cells
+    result = {}
+    for column in reversed(KEY_COLUMNS):
+        n = len(labels[column])
+        result[column] = labels[column][keys % n]
+        keys = keys // n
+    result = pd.DataFrame({column: result[column] for column in KEY_COLUMNS})
+    result = result.assign(
+        change=change[order],
+        **{
+            "old Prevalence": a_prev[order],
+            "new Prevalence": b_prev[order],
+            "old Standard Error": a_se[order],
+            "new Standard Error": b_se[order],
+            "difference": b_prev[order] - a_prev[order],
+        },
+    )
+    return restore_states(result)
+
+
+def summarize(changes):
+    """
+    Summarize a diff from diff_runs(): the number of cells of each change type,
+    and for changed cells the mean and largest absolute difference in prevalence.
+
+    Returns:
+    A DataFrame indexed by change type.
+    """
+    counts = changes["change"].value_counts().reindex(CHANGE_TYPES, fill_value=0)
+    summary = pd.DataFrame({"cells": counts})
+    difference = (
+        changes["difference"].abs().groupby(changes["change"]).agg(["mean", "max"])
+    )
+    summary["mean absolute difference"] = difference["mean"]
+    summary["largest absolute difference"] = difference["max"]
+    return summary
+
+
+def diff_folders(old_folder, new_folder, population_group, tolerance=0.0):
+    """
+    Ingest two folders of CODI-PQ outputs and compare their prevalence cells with
+    diff_runs().
+    """
+    old = create_dataframes.create_prevalence_df(Path(old_folder), population_group)
+    new = create_dataframes.create_prevalence_df(Path(new_folder), population_group)
+    return diff_runs(old, new, tolerance)
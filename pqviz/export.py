@@ -0,0 +1,470 @@
+"""
+Batch export of PQ prevalence maps and plots to static files for reporting.
+
+Renders one map per state, weight category and prevalence type as a static PNG
+(drawn headless with geopandas and matplotlib) and as a standalone HTML page of
+the interactive map, spreading the work across a pool of processes. A manifest
+describing every map is written alongside the files.
+
+Likewise renders the plot_prevalence() and plot_pop() bar plots of every
+demographic value and prevalence or population type to PNG, PDF or SVG files,
+with an index recording a fingerprint of the data behind each plot so plots whose
+data has not changed are not rendered again.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import re
+import time
+
+import geopandas as gpd
+from ipywidgets.embed import embed_minimal_html
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import BoundaryNorm, ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+import numpy as np
+
+from . import maps, plots
+
+
+MAP_FORMATS = ["png", "html"]
+PLOT_FORMATS = ["png", "pdf", "svg"]
+
+# Function drawing each kind of plot from the rows of one plot
+PLOT_KINDS = {
+    "prevalence": plots.prevalence_figure,
+    "population": plots.pop_figure,
+}
+
+def _mp_context():
+    """
+    Return the multiprocessing context worker pools start from. Pools may be
+    created from threads, as by the pipeline, and forking a process with other
+    threads running can deadlock, so workers start from a fresh process instead.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+
+
+# Prevalence dataset shared by the workers of a pool, set once per process
+_WORKER_DF = None
+
+
+def _init_worker(df):
+    global _WORKER_DF
+    _WORKER_DF = df
+
+
+# PlotData of each plot kind shared by the workers of a pool
+_WORKER_PLOT_DATA = None
+
+
+def _init_plot_worker(prev_data, pop_data):
+    global _WORKER_PLOT_DATA
+    _WORKER_PLOT_DATA = {
+        "prevalence": plots.PlotData(prev_data),
+        "population": plots.PlotData(pop_data),
+    }
+
+
+def slugify(value):
+    """Make a value safe for use in a file name."""
+    return re.sub(r"[^A-Za-z0-9]+", "_", str(value)).strip("_")
+
+
+def map_fname(output_dir, selected_state, category, prevalence_type, fmt):
+    """Return the path of an exported map file."""
+    name = f"{selected_state}_{slugify(category)}_{slugify(prevalence_type)}.{fmt}"
+    return Path(output_dir) / selected_state / name
+
+
+@lru_cache(maxsize=None)
+def state_boundaries_gdf(selected_state):
+    """
+    Return the ZCTA boundaries of a state as a GeoDataFrame, built from the
+    boundaries cached by maps.load_state_boundaries().
+    """
+    state_gj = maps.load_state_boundaries(selected_state)
+    return gpd.GeoDataFrame.from_features(state_gj["features"], crs=maps.BOUNDARY_CRS)
+
+
+def render_map_png(
+    fname, selected_state, df, category, prevalence_type, figsize=(10, 8), dpi=150
+):
+    """
+    Draw a static PNG version of maps.choropleth_map_pq(), with ZCTA5s colored by
+    the prevalence of their ZCTA3 and ZCTA5s of suppressed ZCTA3s shaded grey.
+
+    Parameters:
+    fname: File path to write the PNG to
+    selected_state: Two-letter state abbreviation
+    df: DataFrame of prevalence data
+    category: Weight category/class
+    prevalence_type: Prevalence type, one of ['Age-Adjusted', 'Crude', 'Weighted']
+    figsize: Figure size in inches
+    dpi: Resolution of the PNG
+
+    Returns:
+    The number of ZCTA5s drawn with a prevalence value.
+    """
+    valmap, suppressed_zcta3s = maps.state_prevalence_values(
+        selected_state, df, category, prevalence_type
+    )
+    gdf = state_boundaries_gdf(selected_state)
+    values = gdf["ZCTA5CE10"].map(valmap)
+    suppressed = gdf["ZCTA5CE10"].str[:3].isin(suppressed_zcta3s)
+
+    # Same steps as the StepColormap used by the interactive map
+    bins = np.linspace(0, 100, len(maps.COLOR_SCALE) + 1)
+    cmap = ListedColormap(maps.COLOR_SCALE)
+    norm = BoundaryNorm(bins, cmap.N)
+
+    # A bare Figure draws without pyplot, so the caller's backend is left alone
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    gdf.plot(ax=ax, facecolor="white", edgecolor="black", linewidth=0.2)
+    if suppressed.any():
+        gdf[suppressed].plot(
+            ax=ax, facecolor=maps.SUPPRESSED_COLOR, edgecolor="black", linewidth=0.2
+        )
+    if values.notna().any():
+        gdf.assign(value=values)[values.notna()].plot(
+            ax=ax,
+            column="value",
+            cmap=cmap,
+            norm=norm,
+            edgecolor="black",
+            linewidth=0.2,
+        )
+    fig.colorbar(
+        ScalarMappable(norm=norm, cmap=cmap),
+        ax=ax,
+        shrink=0.6,
+        label=f"{prevalence_type} prevalence (%)",
+    )
+    ax.legend(
+        handles=[Patch(facecolor=maps.SUPPRESSED_COLOR, label="Suppressed")],
+        loc="lower left",
+    )
+    ax.set_title(f"{category}\n{prevalence_type} Prevalence in {selected_state}")
+    ax.set_axis_off()
+    fig.savefig(fname, dpi=dpi, bbox_inches="tight")
+    return int(values.notna().sum())
+
+
+def render_map_html(fname, selected_state, df, category, prevalence_type):
+    """
+    Write the interactive maps.choropleth_map_pq() map as a standalone HTML page.
+    """
+    widget = maps.choropleth_map_pq(
+        selected_state=selected_state,
+        df=df,
+        category=category,
+        prevalence_type=prevalence_type,
+    )
+    embed_minimal_html(
+        fname, views=[widget], title=f"{selected_state} {category} {prevalence_type}"
+    )
+
+
+def _export_state_category(
+    output_dir, selected_state, category, prevalence_types, formats
+):
+    """
+    Render the maps for one state and weight category in a worker process, so
+    boundaries loaded for the state are reused across prevalence types.
+    """
+    entries = []
+    for prevalence_type in prevalence_types:
+        entry = {
+            "state": selected_state,
+            "category": category,
+            "prevalence_type": prevalence_type,
+            "files": {},
+        }
+        start = time.perf_counter()
+        try:
+            for fmt in formats:
+                fname = map_fname(
+                    output_dir, selected_state, category, prevalence_type, fmt
+                )
+                fname.parent.mkdir(parents=True, exist_ok=True)
+                if fmt == "png":
+                    entry["zcta5s_with_values"] = render_map_png(
+                        fname, selected_state, _WORKER_DF, category, prevalence_type
+                    )
+                elif fmt == "html":
+                    render_map_html(
+                        fname, selected_state, _WORKER_DF, category, prevalence_type
+                    )
+                entry["files"][fmt] = str(fname.relative_to(output_dir))
+            entry["status"] = "ok"
+        except Exception as e:
+            entry["status"] = "error"
+            entry["error"] = repr(e)
+        entry["seconds"] = round(time.perf_counter() - start, 3)
+        entries.append(entry)
+    return entries
+
+
+def export_maps(
+    df,
+    output_dir,
+    states=None,
+    categories=None,
+    prevalence_types=None,
+    formats=MAP_FORMATS,
+    max_workers=None,
+):
+    """
+    Render every combination of state, weight category and prevalence type of a
+    prevalence dataset to static map files in parallel, and write a manifest.
+
+    Parameters:
+    df: DataFrame of prevalence data created using create_prevalence_df()
+    output_dir: Directory to write maps into, one subdirectory per state
+    states: List of two-letter state abbreviations; defaults to the states in df
+    categories: List of weight categories; defaults to those in df
+    prevalence_types: List of prevalence types; defaults to those in df
+    formats: File formats to render, any of ['png', 'html']
+    max_workers: Number of worker processes; defaults to the number of CPUs
+
+    Returns:
+    The manifest, a dict listing every map rendered with its files and timing.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if states is None:
+        states = sorted({s.abbr for s in df["state"].dropna() if hasattr(s, "abbr")})
+    if categories is None:
+        categories = sorted(df["Weight Category"].unique())
+    if prevalence_types is None:
+        prevalence_types = sorted(df["Prevalence type"].unique())
+
+    start = time.perf_counter()
+    entries = []
+    with ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(),
+        mp_context=_mp_context(),
+        initializer=_init_worker,
+        initargs=(df,),
+    ) as executor:
+        futures = [
+            executor.submit(
+                _export_state_category,
+                output_dir,
+                selected_state,
+                category,
+                prevalence_types,
+                formats,
+            )
+            for selected_state in states
+            for category in categories
+        ]
+        for future in as_completed(futures):
+            for entry in future.result():
+                print(
+                    f"Rendered {entry['state']} {entry['category']} "
+                    f"{entry['prevalence_type']}: {entry['status']}"
+                )
+                entries.append(entry)
+
+    entries.sort(key=lambda e: (e["state"], e["category"], e["prevalence_type"]))
+    manifest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seconds": round(time.perf_counter() - start, 3),
+        "formats": list(formats),
+        "maps": entries,
+    }
+    with open(output_dir / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def plot_fname(output_dir, population_group, demographic_type, plot, fmt):
+    """Return the path of an exported plot file."""
+    name = f"{plot['kind']}_{slugify(plot['demo'])}_{slugify(plot['type'])}.{fmt}"
+    return Path(output_dir) / population_group / demographic_type / name
+
+
+def list_plots(plot_data, demographic_type, population_group):
+    """
+    List every plot of each kind, one per demographic value and prevalence or
+    population type, with a fingerprint of the rows it is drawn from.
+
+    Parameters:
+    plot_data: Dict of plot kind to the PlotData it draws from
+    demographic_type: Demographic to plot each value of
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+
+    Returns:
+    A list of dicts with the kind, demographic value, type and fingerprint.
+    """
+    entries = []
+    for kind, data in plot_data.items():
+        for demo, sample_type in data.groups(demographic_type):
+            rows = plots.plot_rows(
+                data, demographic_type, demo, sample_type, population_group
+            )
+            entries.append(
+                {
+                    "kind": kind,
+                    "demo": demo,
+                    "type": sample_type,
+                    "fingerprint": plots.data_fingerprint(rows),
+                }
+            )
+    entries.sort(key=lambda e: (e["kind"], str(e["demo"]), e["type"]))
+    return entries
+
+
+def _export_plot_group(output_dir, demographic_type, population_group, group, formats):
+    """
+    Render a group of plots in a worker process, reusing one renderer and its
+    figure for all of them.
+    """
+    renderer = plots.BarPlotRenderer()
+    entries = []
+    for plot in group:
+        entry = dict(plot, files={})
+        start = time.perf_counter()
+        try:
+            rows = plots.plot_rows(
+                _WORKER_PLOT_DATA[plot["kind"]],
+                demographic_type,
+                plot["demo"],
+                plot["type"],
+                population_group,
+            )
+            fig = PLOT_KINDS[plot["kind"]](
+                rows, plot["demo"], plot["type"], population_group, renderer
+            )
+            for fmt in formats:
+                fname = plot_fname(
+                    output_dir, population_group, demographic_type, plot, fmt
+                )
+                fname.parent.mkdir(parents=True, exist_ok=True)
+                fig.savefig(fname, format=fmt, bbox_inches="tight")
+                entry["files"][fmt] = str(fname.relative_to(output_dir))
+            entry["status"] = "ok"
+        except Exception as e:
+            entry["status"] = "error"
+            entry["error"] = repr(e)
+        entry["seconds"] = round(time.perf_counter() - start, 3)
+        entries.append(entry)
+    return entries
+
+
+def _is_current(output_dir, plot, previous, formats):
+    """
+    Check whether a plot was rendered before from the same data, in every format.
+    """
+    return (
+        previous is not None
+        and previous.get("status") in ("ok", "unchanged")
+        and previous["fingerprint"] == plot["fingerprint"]
+        and all(
+            fmt in previous["files"] and (output_dir / previous["files"][fmt]).is_file()
+            for fmt in formats
+        )
+    )
+
+
+def export_plots(
+    prev_data,
+    pop_data,
+    output_dir,
+    demographic_type,
+    population_group,
+    formats=PLOT_FORMATS,
+    max_workers=None,
+    force=False,
+    chunksize=8,
+):
+    """
+    Render the plot_prevalence() and plot_pop() plots of every demographic value
+    and prevalence or population type to files in parallel, and write an index.
+    Plots listed in an existing index with the same data fingerprint and files are
+    skipped.
+
+    Parameters:
+    prev_data: DataFrame created using create_prevalence_df()
+    pop_data: DataFrame created using create_population_df()
+    output_dir: Directory to write plots into, laid out as
+        {population_group}/{demographic_type}/{kind}_{value}_{type}.{format}
+    demographic_type: Demographic to plot each value of, e.g. 'sex', 'race', 'age', 'zcta3'
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    formats: File formats to render, any of ['png', 'pdf', 'svg']
+    max_workers: Number of worker processes; defaults to the number of CPUs
+    force: Render every plot, even if its data has not changed
+    chunksize: Number of plots rendered by a worker per task
+
+    Returns:
+    The index, a dict listing every plot with its files, fingerprint and timing.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index_fname = output_dir / population_group / demographic_type / "index.json"
+    previous = {}
+    if index_fname.is_file() and not force:
+        with open(index_fname) as f:
+            previous = {
+                (p["kind"], p["demo"], p["type"]): p for p in json.load(f)["plots"]
+            }
+
+    plot_data = {
+        "prevalence": plots.PlotData(prev_data),
+        "population": plots.PlotData(pop_data),
+    }
+    start = time.perf_counter()
+    entries = []
+    stale = []
+    for plot in list_plots(plot_data, demographic_type, population_group):
+        old = previous.get((plot["kind"], plot["demo"], plot["type"]))
+        if _is_current(output_dir, plot, old, formats):
+            entries.append(dict(old, status="unchanged"))
+        else:
+            stale.append(plot)
+
+    if stale:
+        with ProcessPoolExecutor(
+            max_workers=max_workers or os.cpu_count(),
+            mp_context=_mp_context(),
+            initializer=_init_plot_worker,
+            initargs=(prev_data, pop_data),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _export_plot_group,
+                    output_dir,
+                    demographic_type,
+                    population_group,
+                    stale[i : i + chunksize],
+                    formats,
+                )
+                for i in range(0, len(stale), chunksize)
+            ]
+            for future in as_completed(futures):
+                entries.extend(future.result())
+
+    entries.sort(key=lambda e: (e["kind"], str(e["demo"]), e["type"]))
+    index = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seconds": round(time.perf_counter() - start, 3),
+        "population_group": population_group,
+        "demographic_type": demographic_type,
+        "formats": list(formats),
+        "rendered": len(stale),
+        "plots": entries,
+    }
+    index_fname.parent.mkdir(parents=True, exist_ok=True)
+    with open(index_fname, "w") as f:
+        json.dump(index, f, indent=2)
+    return index
@@ -0,0 +1,230 @@
+"""
+Spatial autocorrelation of prevalence: global Moran's I, and local Getis-Ord
+Gi* to flag hot and cold spots, among the ZCTA3s of a state.
+
+PQ results are reported by ZCTA3, so the tests run over ZCTA3s: ZCTA5s would
+only repeat the value of their ZCTA3, and neighbors sharing a value would be
+flagged as clusters however the values of the ZCTA3s are arranged.
+
+Spatial weights come from the adjacency of a state's ZCTA3s (see spatial.py).
+Moran's I uses row-standardized weights, so each area is compared with the
+average of its neighbors; Gi* uses binary weights including the area itself:
+
+    I = n / S0 * sum_ij(w_ij * z_i * z_j) / sum_i(z_i ** 2)
+    Gi*_i = sum_j(w*_ij * x_j) / sum_j(x_j)
+
+where z is prevalence minus its mean and S0 the sum of the weights. Gi* is
+reported as a z-score against its expectation under no clustering.
+
+Significance is tested by permutation. For Moran's I, prevalence is shuffled
+across areas; for Gi*, each area keeps its value and its neighbors' values are
+drawn from the other areas (conditional permutation). Permutations are drawn in
+batches as arrays, so the statistics of a whole batch come from one sparse
+matrix product or one gather, and memory is bounded by MAX_CHUNK_BYTES. P-values
+are folded: the share of permutations at least as extreme as the observed
+value, on whichever side it falls.
+
+    results = hotspots.hotspots("NC", cube, category, "Crude")
+    results.attrs["morans_i"]
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import us
+
+from . import analysis, spatial
+
+
+# Default number of permutations of the significance tests
+PERMUTATIONS = 999
+
+# Labels of areas by the sign and significance of their Gi* z-score
+CLUSTERS = ["Hot spot", "Cold spot", "Not significant"]
+
+
+def row_standardize(adjacency):
+    """
+    Scale each row of an adjacency matrix to sum to 1. Areas without neighbors keep
+    an empty row.
+    """
+    counts = np.asarray(adjacency.sum(axis=1)).ravel()
+    with np.errstate(divide="ignore"):
+        scale = np.where(counts > 0, 1 / counts, 0.0)
+    return sparse.diags(scale) @ adjacency
+
+
+def _chunk_size(areas, width=1):
+    """Return the number of permutations whose arrays fit in MAX_CHUNK_BYTES."""
+    return max(1, analysis.MAX_CHUNK_BYTES // (8 * max(areas * width, 1)))
+
+
+def _folded_pvalue(observed, permuted_larger, permutations):
+    """
+    Fold the count of permutations at least as large as the observed value into a
+    pseudo p-value for the more extreme side.
+    """
+    extreme = np.minimum(permuted_larger, permutations - permuted_larger)
+    return (extreme + 1) / (permutations + 1)
+
+
+def morans_i(values, adjacency, permutations=PERMUTATIONS, seed=0, chunk_size=None):
+    """
+    Compute global Moran's I and test it by permutation.
+
+    Parameters:
+    values: Array of prevalence of each area
+    adjacency: Symmetric sparse matrix of neighboring areas
+    permutations: Number of random permutations
+    seed: Seed of the random generator, so results can be reproduced
+    chunk_size: Number of permutations per batch; by default as many as fit in
+        MAX_CHUNK_BYTES
+
+    Returns:
+    A dict with I, its expectation under no autocorrelation, the z-score and
+    p-value from the permutations, and the number of areas.
+    """
+    x = np.asarray(values, dtype=float)
+    n = len(x)
+    weights = row_standardize(adjacency)
+    s0 = weights.sum()
+    z = x - x.mean()
+    denominator = (z**2).sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        observed = n / s0 * (z @ (weights @ z)) / denominator
+
+    chunk_size = chunk_size or _chunk_size(n)
+    rng = np.random.default_rng(seed)
+    permuted = []
+    for start in range(0, permutations, chunk_size):
+        size = min(chunk_size, permutations - start)
+        # One permutation per column: shuffle each column of a tiled copy
+        shuffled = rng.permuted(np.tile(z[:, None], (1, size)), axis=0)
+        numerators = (shuffled * (weights @ shuffled)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            permuted.append(n / s0 * numerators / denominator)
+    permuted = np.concatenate(permuted) if permuted else np.array([])
+
+    larger = (permuted >= observed).sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z_score = (observed - permuted.mean()) / permuted.std()
+    return {
+        "I": observed,
+        "expected": -1 / (n - 1) if n > 1 else np.nan,
+        "z": z_score,
+        "p": _folded_pvalue(observed, larger, permutations),
+        "areas": n,
+    }
+
+
+def local_gi_star(
+    values, adjacency, permutations=PERMUTATIONS, seed=0, chunk_size=None
+):
+    """
+    Compute local Getis-Ord Gi* for every area and test it by conditional
+    permutation.
+
+    Each batch of permutations draws, for every permutation, one random order of
+    n - 1 positions. Area i takes its first k_i positions, skipping its own, as
+    its neighbors, k_i being its number of neighbors, so the neighbor sums of
+    all areas in the batch are one gather and one masked sum.
+
+    Parameters:
+    values: Array of prevalence of each area, all positive
+    adjacency: Symmetric sparse matrix of neighboring areas
+    permutations: Number of random permutations
+    seed: Seed of the random generator, so results can be reproduced
+    chunk_size: Number of permutations per batch; by default as many as fit in
+        MAX_CHUNK_BYTES
+
+    Returns:
+    A DataFrame with a row per area, in order: Gi*, its z-score, and the p-value
+    from the permutations.
+    """
+    x = np.asarray(values, dtype=float)
+    n = len(x)
+    adjacency = adjacency.tocsr()
+    neighbors = np.diff(adjacency.indptr)
+    lag = x + adjacency @ x
+    total = x.sum()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        observed = lag / total
+
+    # Expectation and variance of the neighborhood sum, including the area itself
+    weight_sum = neighbors + 1
+    mean = x.mean()
+    std = x.std()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z_score = (lag - mean * weight_sum) / (
+            std * np.sqrt((n * weight_sum - weight_sum**2) / (n - 1))
+        )
+
+    larger = np.zeros(n, dtype=np.int64)
+    k_max = int(neighbors.max()) if n else 0
+    if k_max > 0:
+        keep = np.arange(k_max)[None, None, :] < neighbors[:, None, None]
+        areas = np.arange(n)[:, None, None]
+        chunk_size = chunk_size or _chunk_size(n, k_max)
+        rng = np.random.default_rng(seed)
+        for start in range(0, permutations, chunk_size):
+            size = min(chunk_size, permutations - start)
+            draws = np.argsort(rng.random((size, n - 1)), axis=1)[:, :k_max]
+            # Shift positions at or after each area's own, to skip it
+            positions = draws[None, :, :] + (draws[None, :, :] >= areas)
+            lags = x[:, None] + np.where(keep, x[positions], 0.0).sum(axis=2)
+            larger += (lags / total >= observed[:, None]).sum(axis=1)
+    # Areas without neighbors have no neighborhood to test
+    p = np.where(neighbors > 0, _folded_pvalue(observed, larger, permutations), 1.0)
+    return pd.DataFrame({"Gi*": observed, "Gi* z": z_score, "Gi* p": p})
+
+
+def hotspots(
+    selected_state,
+    df,
+    category,
+    prevalence_type,
+    permutations=PERMUTATIONS,
+    alpha=0.05,
+    seed=0,
+):
+    """
+    Flag hot and cold spots of prevalence among the ZCTA3s of a state, for one
+    weight category and prevalence type. ZCTA3s with suppressed values are left
+    out, along with their share of the weights.
+
+    Parameters:
+    selected_state: State name or two-letter abbreviation
+    df: DataFrame of prevalence data, or a Cube of it
+    category: Weight category/class
+    prevalence_type: Prevalence type, one of ['Age-Adjusted', 'Crude', 'Weighted']
+    permutations: Number of random permutations of the significance tests
+    alpha: Significance level of the clusters
+    seed: Seed of the random generator, so results can be reproduced
+
+    Returns:
+    A DataFrame indexed by ZCTA3 with the Prevalence, the Gi*, its
+    z-score and p-value, and the cluster, one of CLUSTERS. The global Moran's I
+    from morans_i() is in attrs['morans_i'].
+    """
+    abbr = us.states.lookup(selected_state).abbr
+    labels, adjacency = spatial.state_adjacency(abbr, "zcta3")
+    estimates = analysis.group_estimates(
+        df, "zcta3", category, prevalence_type, state=abbr
+    )
+    prevalence = estimates["Prevalence"].reindex(labels).to_numpy()
+    has_value = ~np.isnan(prevalence)
+    labels = labels[has_value]
+    prevalence = prevalence[has_value]
+    adjacency = adjacency[has_value][:, has_value]
+
+    result = local_gi_star(prevalence, adjacency, permutations, seed)
+    result.index = pd.Index(labels, name="zcta3")
+    result.insert(0, "Prevalence", prevalence)
+    significant = result["Gi* p"] < alpha
+    result["Cluster"] = np.select(
+        [significant & (result["Gi* z"] > 0), significant & (result["Gi* z"] < 0)],
+        CLUSTERS[:2],
+        CLUSTERS[2],
+    )
+    result.attrs["morans_i"] = morans_i(prevalence, adjacency, permutations, seed)
+    return result
@@ -1,7 +1,12 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
 import gzip
 import json
 from pathlib import Path
 import shutil
+import threading
+import warnings
 
 import branca.colormap as cm
 import geopandas as gpd
@@ -16,6 +21,7 @@ from ipyleaflet import (
     Map,
     Marker,
     Popup,
+    VectorTileLayer,
     WidgetControl,
 )
 from ipywidgets import Label, Layout, VBox
@@ -24,12 +30,12 @@ import numpy as np
 import pandas as pd
 import us
 
+from . import analysis, create_dataframes, hotspots, spatial
 from .check_suppressed import suppressed_zcta3
+from .crosswalk import CROSSWALK_FNAME, load_crosswalk
+from .cube import POPULATION_AXES, Cube, cube_or_frame, population_labels
 
 
-# ZCTA-ZIP Code mapping for filtering by state
-Z2Z = pd.read_csv("reference_data/zcta-zip-mapping-2020.csv.gz")
-
 # Note: DC is not included by default in the v2 release line; assure it's there
 if us.states.DC not in us.STATES:
     us.STATES.append(us.states.DC)
@@ -62,6 +68,12 @@ PLACES_MEASURES = [
     ("Obesity", "OBESITY_CrudePrev", "Obesity, crude prevalence among adults"),
 ]
 
+# Fill color for ZCTA5s belonging to a ZCTA3 with suppressed values on tile layers
+SUPPRESSED_COLOR = "#BBBBBB"
+
+# CDC PLACES data by ZCTA5, bundled gzipped and unzipped on first use
+PLACES_FNAME = "reference_data/cdc-places-zcta-2020.csv"
+
 # Color scheme taken from NYT COVID hotspot map
 # https://www.nytimes.com/interactive/2021/us/covid-cases.html
 COLOR_SCALE = [
@@ -79,11 +91,149 @@ COLOR_SCALE = [
     "#4C0D3E",
 ]
 
+# Directory of per-state ZCTA boundary files, one gzipped geojson per state, and
+# their coordinate reference system
+BOUNDARY_DIR = Path("reference_data/state_boundaries")
+BOUNDARY_CRS = "EPSG:4269"
+
 # Shorthand set of state-level bounding boxes for zooming to extent w/fit_bounds()
-STATE_BOUNDS = json.load(open("reference_data/state_boundaries/state_bounds.json"))
+STATE_BOUNDS = json.load(open(BOUNDARY_DIR / "state_bounds.json"))
+
+# Values choropleth_map_pq() can color ZCTA3s by: their prevalence, or, simulated
+# from its standard error, the probability that it is above a threshold, or its
+# rank among the ZCTA3s of the state, or its prevalence smoothed with its neighbors,
+# or the Gi* z-score of its neighborhood, positive for hot spots
+MAP_LAYERS = ["Prevalence", "Exceedance probability", "Rank", "Smoothed", "Hotspots"]
+
+# Range of Gi* z-scores on the color scale of the Hotspots layer
+HOTSPOT_Z_RANGE = (-3, 3)
+
+# Name of the layer holding ZCTA boundaries within each vector tile, and the
+# highest zoom level tiles are rendered at; the map scales them beyond that
+TILE_LAYER = "zctas"
+TILE_MAX_ZOOM = 10
+
+# Number of threads warming caches in the background for a Prefetcher
+PREFETCH_WORKERS = 2
+
+# Number of states whose parsed boundaries and PLACES rows are kept in memory
+STATE_CACHE_SIZE = 8
+
+
+def _single_flight(func):
+    """
+    Wrap a cached loader of one key so that concurrent calls for the same key wait
+    for the first to finish and then read its cached result, instead of loading
+    it again. A map drawn while a prefetch of its state is running waits for the
+    prefetch rather than repeating it. The wrapper keeps the cache_info() and
+    cache_clear() of the loader's lru_cache.
+    """
+    locks = defaultdict(threading.Lock)
+    guard = threading.Lock()
+
+    @wraps(func)
+    def wrapper(key):
+        with guard:
+            lock = locks[key]
+        with lock:
+            return func(key)
+
+    def cache_clear():
+        func.cache_clear()
+        with guard:
+            locks.clear()
+
+    wrapper.cache_info = func.cache_info
+    wrapper.cache_clear = cache_clear
+    return wrapper
+
+
+@lru_cache(maxsize=None)
+def _z2z():
+    return pd.read_csv(CROSSWALK_FNAME, dtype=str, encoding="utf-8-sig")
+
+
+def __getattr__(name):
+    # Z2Z, the ZIP Code to ZCTA mapping as a DataFrame, is kept for older notebooks
+    if name == "Z2Z":
+        warnings.warn(
+            "maps.Z2Z is deprecated; use crosswalk.load_crosswalk()",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        return _z2z()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@_single_flight
+@lru_cache(maxsize=STATE_CACHE_SIZE)
+def load_state_boundaries(selected_state):
+    """
+    Load the ZCTA boundary geojson for a state, with the id key specified on all
+    features (required for choropleth mapping to data). Parsed boundaries are
+    cached, so callers must not modify the returned structure in place.
+
+    Parameters:
+    selected_state: Two-letter state abbreviation
+
+    Returns:
+    A dict containing the state's ZCTA boundaries as a geojson FeatureCollection.
+    """
+    state_gj_fname = BOUNDARY_DIR / f"{selected_state}_zctas.geojson.gz"
+    state_gj = json.load(gzip.open(state_gj_fname, "r"))
+    for feature in state_gj["features"]:
+        properties = feature["properties"]
+        feature.update(id=properties["ZCTA5CE10"])
+    return state_gj
+
+
+def vector_tile_layer(tile_url, feature_colors, name="", visible_ids=None):
+    """
+    Produce a layer of ZCTA boundaries served as vector tiles, styled by joining
+    each feature's ZCTA5 id to a precomputed fill color. Only the colors travel
+    through the widget; tiles are fetched by the browser for the current viewport.
+
+    Parameters:
+    tile_url: URL template for the tile server, e.g. from tiles.tile_url()
+    feature_colors: dict of ZCTA5 to fill color for features with a value
+    name: Layer name
+    visible_ids: Optional collection of ZCTA5s to outline when they have no value;
+        features outside of it are hidden. If None, all features are outlined.
+
+    Returns:
+    A VectorTileLayer.
+    """
+    outlined = (
+        "null" if visible_ids is None else json.dumps(dict.fromkeys(visible_ids, 1))
+    )
+    # The lookups are built once, in a closure, rather than for every feature
+    style = f"""{{
+        {TILE_LAYER}: (function() {{
+            var colors = {json.dumps(feature_colors)};
+            var outlined = {outlined};
+            return function(properties, zoom) {{
+                var zcta = properties.ZCTA5CE10;
+                if (zcta in colors) {{
+                    return {{fill: true, fillColor: colors[zcta], fillOpacity: 0.8,
+                             color: "black", weight: 0.5, opacity: 0.8}};
+                }}
+                if (outlined === null || zcta in outlined) {{
+                    return {{fill: true, fillColor: "white", fillOpacity: 0.1,
+                             color: "black", weight: 0.5, opacity: 0.8}};
+                }}
+                return {{fill: false, stroke: false, weight: 0}};
+            }};
+        }})()
+    }}"""
+    return VectorTileLayer(
+        url=tile_url,
+        layer_styles=style,
+        name=name,
+        max_native_zoom=TILE_MAX_ZOOM,
+    )
 
 
-def load_places(fname="reference_data/cdc-places-zcta-2020.csv"):
+def load_places(fname=PLACES_FNAME):
     """
     The CDC PLACES csv data is 20MB unzipped and gzips to 6MB, so it's included
     gzipped. Unzip if needed, because gpd doesn't seem to be able to handle gzipped
@@ -104,41 +254,81 @@ def load_places(fname="reference_data/cdc-places-zcta-2020.csv"):
     return places
 
 
-def choropleth_map_places(selected_state="AL", selected_measure="TotalPopulation"):
-    # US state metadata
-    us_state = us.states.lookup(selected_state)
+@lru_cache(maxsize=1)
+def _cached_places():
+    return load_places()
 
-    # Use ZCTA-ZIP Code mapping to filter by state
-    state_zcta_list = Z2Z.loc[Z2Z["STATE"] == us_state.abbr]["ZCTA"].unique()
 
-    # CDC PLACES data
-    places = load_places()
-    state_places = places.loc[places["ZCTA5"].isin(state_zcta_list)]
+@_single_flight
+@lru_cache(maxsize=STATE_CACHE_SIZE)
+def state_places(selected_state):
+    """
+    Return the CDC PLACES rows of the ZCTA5s in a state. The PLACES data is loaded
+    once, and each state's rows are cached, so callers must not modify the
+    returned DataFrame in place.
+
+    Parameters:
+    selected_state: Two-letter state abbreviation
+
+    Returns:
+    A DataFrame of CDC PLACES data.
+    """
+    places = _cached_places()
+    return places.loc[places["ZCTA5"].isin(state_zctas(selected_state).index)]
+
+
+@_single_flight
+@lru_cache(maxsize=None)
+def state_zctas(selected_state):
+    """
+    Return the ZCTA3 of each ZCTA5 in a state, from the crosswalk. Results are
+    cached, so callers must not modify the returned Series in place.
+
+    Parameters:
+    selected_state: Two-letter state abbreviation
+
+    Returns:
+    A Series of ZCTA3s indexed by ZCTA5.
+    """
+    abbr = us.states.lookup(selected_state).abbr
+    crosswalk = load_crosswalk()
+    zcta5s = crosswalk.state_zcta5s(abbr)
+    return pd.Series(crosswalk.zcta5_to_zcta3(zcta5s), index=zcta5s)
+
+
+def choropleth_map_places(
+    selected_state="AL", selected_measure="TotalPopulation", tile_url=None
+):
+    """
+    Produce a choropleth map of a CDC PLACES measure for ZCTA5s in a state.
+
+    Parameters:
+    selected_state: Two-letter state abbreviation
+    selected_measure: Display name of a measure in PLACES_MEASURES
+    tile_url: Optional URL template of a running tile server (see tiles.py); if
+        given, boundaries are drawn from vector tiles instead of sent as geojson
+
+    Returns:
+    A VBox containing the map and a label for clicked ZCTA values.
+    """
+    # CDC PLACES data for the ZCTA5s of the state, from the ZCTA-ZIP Code crosswalk
+    places = state_places(selected_state).copy()
 
     # State-level boundary file in geojson
-    state_gj_fname = Path(
-        f"reference_data/state_boundaries/{selected_state}_zctas.geojson.gz"
-    )
-    state_gj = json.load(gzip.open(state_gj_fname, "r"))
-    # Specify id key on all features (required for choropleth mapping to data)
-    for feature in state_gj["features"]:
-        properties = feature["properties"]
-        feature.update(id=properties["ZCTA5CE10"])
+    state_gj = load_state_boundaries(selected_state)
 
     measure_display, measure_name, measure_desc = [
         mm for mm in PLACES_MEASURES if mm[0] == selected_measure
     ][0]
     if measure_name == "TotalPopulation":
-        state_places[measure_name] = state_places[measure_name].astype(int)
+        places[measure_name] = places[measure_name].astype(int)
     else:
-        state_places[measure_name] = state_places[measure_name].astype(float)
+        places[measure_name] = places[measure_name].astype(float)
 
-    state_valmap = dict(
-        zip(state_places["ZCTA5"].tolist(), state_places[measure_name].tolist())
-    )
+    state_valmap = dict(zip(places["ZCTA5"].tolist(), places[measure_name].tolist()))
     if selected_measure == "Total Population":
-        value_min = state_places[measure_name].min()
-        value_max = state_places[measure_name].max()
+        value_min = places[measure_name].min()
+        value_max = places[measure_name].max()
     else:
         value_min = 0
         value_max = 100
@@ -158,27 +348,42 @@ def choropleth_map_places(selected_state="AL", selected_measure="TotalPopulation
     m = Map()
     label = Label(layout=Layout(width="100%"))
 
-    def click_handler(event=None, feature=None, id=None, properties=None):
-        if selected_measure == "Total Population":
-            value = f"{state_valmap[id]:,d}"
-        else:
-            value = f"{state_valmap[id]}%"
-        label.value = f"ZCTA {properties['ZCTA5CE10']}: {value} ({measure_desc})"
-
-    choro_layer = Choropleth(
-        geo_data=state_gj,
-        choro_data=state_valmap,
-        colormap=state_colors,
-        value_min=value_min,
-        value_max=value_max,
-        border_color="black",
-        hover_style={"fillOpacity": 0.4},
-        style={"fillOpacity": 0.8},
-        name=measure_display,
-        layout=Layout(width="100%", height="600px"),
-    )
-    choro_layer.on_click(click_handler)
-    m.add_layer(choro_layer)
+    if tile_url:
+        feature_colors = {
+            fid: state_colors.rgb_hex_str(val)
+            for fid, val in state_valmap.items()
+            if fid in state_feature_ids
+        }
+        tile_layer = vector_tile_layer(
+            tile_url,
+            feature_colors,
+            name=measure_display,
+            visible_ids=state_feature_ids,
+        )
+        m.add_layer(tile_layer)
+    else:
+
+        def click_handler(event=None, feature=None, id=None, properties=None):
+            if selected_measure == "Total Population":
+                value = f"{state_valmap[id]:,d}"
+            else:
+                value = f"{state_valmap[id]}%"
+            label.value = f"ZCTA {properties['ZCTA5CE10']}: {value} ({measure_desc})"
+
+        choro_layer = Choropleth(
+            geo_data=state_gj,
+            choro_data=state_valmap,
+            colormap=state_colors,
+            value_min=value_min,
+            value_max=value_max,
+            border_color="black",
+            hover_style={"fillOpacity": 0.4},
+            style={"fillOpacity": 0.8},
+            name=measure_display,
+            layout=Layout(width="100%", height="600px"),
+        )
+        choro_layer.on_click(click_handler)
+        m.add_layer(choro_layer)
 
     legend_colors = {}
     for i, val in enumerate(state_colors.index[1:]):
@@ -197,34 +402,37 @@ def choropleth_map_places(selected_state="AL", selected_measure="TotalPopulation
     return VBox([m, label])
 
 
-def choropleth_map_pq(selected_state="NC", df=None, category="", prevalence_type=""):
-    """
-    Produce a map with three layers: a base map of all ZCTA5s, an intermediate map of
-    ZCTA5s belonging to a ZCTA3 with suppressed values, and a top-level choropleth of
-    ZCTA5s with non-suppressed prevalence values.
-
-    TODO: is there any difference between the base map and the suppressed ZCTA layer?
+def state_prevalence_values(selected_state, df, category, prevalence_type):
     """
+    Assign the prevalence of each ZCTA3 in a dataset to the ZCTA5s of a state
+    belonging to it, for the specified category and prevalence type, from the
+    rows covering the whole population of the ZCTA3 (see cube.population_labels()).
 
-    # US state metadata
-    us_state = us.states.lookup(selected_state)
+    Parameters:
+    selected_state: Two-letter state abbreviation
+    df: DataFrame of prevalence data, or a Cube of it
+    category: Weight category/class
+    prevalence_type: Prevalence type, one of ['Age-Adjusted', 'Crude', 'Weighted']
 
-    # Filter to state-level ZCTAs
-    state_zcta_list = Z2Z.loc[Z2Z["STATE"] == us_state.abbr]["ZCTA"].unique()
+    Returns:
+    A dict of ZCTA5 to prevalence value for ZCTA5s with non-suppressed values, and
+    a list of ZCTA3s with suppressed values.
+    """
+    # State-level ZCTAs, and the ZCTA3 each belongs to
+    zcta5_zcta3s = state_zctas(selected_state)
 
-    # State-level boundary file in geojson
-    state_gj_fname = Path(
-        f"reference_data/state_boundaries/{selected_state}_zctas.geojson.gz"
-    )
-    state_gj = json.load(gzip.open(state_gj_fname, "r"))
-    # Specify id key on all features (required for choropleth mapping to data)
-    for feature in state_gj["features"]:
-        properties = feature["properties"]
-        feature.update(id=properties["ZCTA5CE10"])
+    if isinstance(df, Cube):
+        zcta3_values, suppressed_zcta3s = df.zcta3_values(category, prevalence_type)
+        return zcta5_zcta3s.map(zcta3_values).dropna().to_dict(), suppressed_zcta3s
 
     # ZCTA3s for this dataset with suppressed prevalence valus
     suppressed_zcta3s = suppressed_zcta3(df, category, prevalence_type)
 
+    # Labels of the rows of whole populations, among all rows
+    population = population_labels(
+        {name: df[name].dropna().astype(str).unique() for name in POPULATION_AXES}
+    )
+
     # Limit to selected category and type
     df = df.copy()
     # Just the non-suppressed values
@@ -233,15 +441,184 @@ def choropleth_map_pq(selected_state="NC", df=None, category="", prevalence_type
     df = df.loc[df["Prevalence type"] == prevalence_type]
     df["Prevalence"] = df["Prevalence"].astype(float)
 
-    # Probably inefficient!
-    valmap = {}
-    for z5 in state_zcta_list:
-        for z3 in df["zcta3"].tolist():
-            if z5.startswith(z3):
-                valmap[z5] = df.loc[df["zcta3"] == z3]["Prevalence"].values[0]
+    # Join each ZCTA5 to the value of its ZCTA3's whole population
+    for name, label in population.items():
+        df = df.loc[df[name].astype(str) == label]
+    zcta3_values = df.drop_duplicates("zcta3").set_index("zcta3")["Prevalence"]
+    valmap = zcta5_zcta3s.map(zcta3_values).dropna().to_dict()
+
+    return valmap, suppressed_zcta3s
+
+
+def state_layer_values(
+    selected_state, df, category, prevalence_type, layer="Prevalence", threshold=None
+):
+    """
+    Assign a value of each ZCTA3 in a dataset to the ZCTA5s of a state belonging to
+    it: its prevalence, or, for the other MAP_LAYERS, the probability that its
+    prevalence is above a threshold or its rank among the state's ZCTA3s, both
+    simulated with analysis.simulate_uncertainty(), its prevalence smoothed with
+    its neighbors' by spatial.smooth_state(), which also estimates suppressed
+    ZCTA3s from their neighbors, or the Gi* z-score of its neighborhood from
+    hotspots.hotspots().
+
+    Parameters:
+    selected_state: Two-letter state abbreviation
+    df: DataFrame of prevalence data, or a Cube of it; the Smoothed layer needs a
+        Cube built with population data, for the sample sizes
+    category: Weight category/class
+    prevalence_type: Prevalence type, one of ['Age-Adjusted', 'Crude', 'Weighted']
+    layer: One of MAP_LAYERS
+    threshold: Prevalence threshold of the exceedance probability, in percent;
+        defaults to the mean prevalence of the state's ZCTA3s
+
+    Returns:
+    A dict of ZCTA5 to value for ZCTA5s with non-suppressed values, a list of ZCTA3s
+    with suppressed values, the lowest and highest value of the color scale, and
+    a dict of ZCTA3 to a description of its value.
+    """
+    valmap, suppressed_zcta3s = state_prevalence_values(
+        selected_state, df, category, prevalence_type
+    )
+    if layer == "Prevalence":
+        descriptions = {
+            zcta5[:3]: f"{value} ({prevalence_type} prevalence, {category})"
+            for zcta5, value in valmap.items()
+        }
+        return valmap, suppressed_zcta3s, 0, 100, descriptions
+    if layer not in MAP_LAYERS:
+        raise ValueError(f"Unknown map layer {layer!r}, expected one of {MAP_LAYERS}")
+    if layer == "Smoothed":
+        smoothed = spatial.smooth_state(selected_state, df)
+        smoothed = smoothed.loc[
+            (smoothed["Weight Category"] == category)
+            & (smoothed["Prevalence type"] == prevalence_type)
+        ].set_index("zcta3")
+        descriptions = {
+            zcta3: (
+                f"{value:.1f} estimated from neighbors, suppressed or missing"
+                if pd.isna(observed)
+                else f"{value:.1f} smoothed, {observed} observed"
+            )
+            + f" ({prevalence_type} prevalence, {category})"
+            for zcta3, value, observed in zip(
+                smoothed.index,
+                smoothed["Smoothed prevalence"],
+                smoothed["Prevalence"],
+            )
+        }
+        values = smoothed["Smoothed prevalence"]
+        valmap = state_zctas(selected_state).map(values).dropna().to_dict()
+        return valmap, suppressed_zcta3s, 0, 100, descriptions
+    if layer == "Hotspots":
+        clusters = hotspots.hotspots(selected_state, df, category, prevalence_type)
+        moran = clusters.attrs["morans_i"]
+        descriptions = {
+            zcta3: f"{cluster}, Gi* z {z:.2f}, p {p:.3f}; state Moran's I "
+            f"{moran['I']:.2f}, p {moran['p']:.3f} "
+            f"({prevalence_type} prevalence, {category})"
+            for zcta3, cluster, z, p in zip(
+                clusters.index,
+                clusters["Cluster"],
+                clusters["Gi* z"],
+                clusters["Gi* p"],
+            )
+        }
+        values = clusters["Gi* z"].clip(*HOTSPOT_Z_RANGE)
+        valmap = state_zctas(selected_state).map(values).dropna().to_dict()
+        return valmap, suppressed_zcta3s, *HOTSPOT_Z_RANGE, descriptions
+
+    abbr = us.states.lookup(selected_state).abbr
+    estimates = analysis.group_estimates(
+        df, "zcta3", category, prevalence_type, state=abbr
+    )
+    simulated = analysis.simulate_uncertainty(estimates, threshold)
+    threshold = simulated.attrs["threshold"]
+    if layer == "Exceedance probability":
+        values = simulated["Exceedance probability"] * 100
+        value_min, value_max = 0, 100
+        descriptions = {
+            zcta3: f"{value:.0f}% chance {prevalence_type.lower()} prevalence is "
+            f"above {threshold:.1f}% ({category})"
+            for zcta3, value in values.items()
+        }
+    else:
+        values = simulated["Rank"]
+        value_min, value_max = 1, max(len(simulated), 2)
+        descriptions = {
+            zcta3: f"rank {rank} of {len(simulated)}, 90% interval {lower} - {upper} "
+            f"({prevalence_type} prevalence, {category})"
+            for zcta3, rank, lower, upper in zip(
+                simulated.index,
+                simulated["Rank"],
+                simulated["Rank lower"],
+                simulated["Rank upper"],
+            )
+        }
+    valmap = state_zctas(selected_state).map(values).dropna().to_dict()
+    return valmap, suppressed_zcta3s, value_min, value_max, descriptions
+
+
+def choropleth_map_pq(
+    selected_state="NC",
+    df=None,
+    category="",
+    prevalence_type="",
+    tile_url=None,
+    layer="Prevalence",
+    threshold=None,
+):
+    """
+    Produce a map with three layers: a base map of all ZCTA5s, an intermediate map of
+    ZCTA5s belonging to a ZCTA3 with suppressed values, and a top-level choropleth of
+    ZCTA5s with non-suppressed values.
+
+    The base map outlines every ZCTA5 and reports "no value" when clicked; the
+    suppressed layer fills the ZCTA5s of suppressed ZCTA3s more darkly and reports
+    them as suppressed.
+
+    The choropleth shows the prevalence of each ZCTA3, or another of MAP_LAYERS
+    (see state_layer_values()):
+    Exceedance probability: the simulated probability that its prevalence is above
+        threshold
+    Rank: its simulated rank among the state's ZCTA3s, with its interval
+    Smoothed: its prevalence smoothed toward its neighbors', weighted by sample
+        size, with suppressed or missing ZCTA3s estimated from their neighbors
+    Hotspots: the Gi* z-score of its neighborhood, with significant hot and cold
+        spots and the state's Moran's I described when clicked
+
+    If tile_url is given for a running tile server (see tiles.py), the three layers
+    are drawn as one vector tile layer instead of being sent as geojson.
+
+    Parameters:
+    selected_state: Two-letter state abbreviation
+    df: DataFrame of prevalence data, or a Cube of it; the Smoothed layer needs a
+        Cube built with population data
+    category: Weight category/class
+    prevalence_type: Prevalence type, one of ['Age-Adjusted', 'Crude', 'Weighted']
+    tile_url: URL template of a tile server, e.g. from tiles.tile_url()
+    layer: One of MAP_LAYERS
+    threshold: Prevalence threshold of the Exceedance probability layer, in
+        percent; defaults to the mean prevalence of the state's ZCTA3s
+
+    Returns:
+    A VBox of the map and a label describing the clicked ZCTA.
+    """
+
+    # State-level boundary file in geojson
+    state_gj = load_state_boundaries(selected_state)
+
+    # Values by ZCTA5, and ZCTA3s with suppressed values
+    (
+        valmap,
+        suppressed_zcta3s,
+        value_min,
+        value_max,
+        descriptions,
+    ) = state_layer_values(
+        selected_state, df, category, prevalence_type, layer, threshold
+    )
 
-    value_min = 0
-    value_max = 100
     value_set = np.array([x for x in valmap.values()])
     colors = cm.StepColormap(
         colors=COLOR_SCALE,
@@ -249,84 +626,224 @@ def choropleth_map_pq(selected_state="NC", df=None, category="", prevalence_type
         vmax=value_max,
     )
 
-    m = Map()
-    label = Label(layout=Layout(width="100%"))
-
-    # First, add the base map of all zctas
-    def base_click_handler(event=None, feature=None, id=None, properties=None):
-        value = f"ZCTA {properties['ZCTA5CE10']}: no value ({prevalence_type} prevalence, {category})"
-        label.value = value
-
-    base_layer = GeoJSON(
-        data=state_gj,
-        style={"opacity": 0.8, "color": "black", "weight": 0.8, "fillOpacity": 0.1},
-        hover_style={"fillColor": "blue", "fillOpacity": 0.5},
-    )
-    base_layer.on_click(base_click_handler)
-
     # Identify ZCTAs without a value in state-level geojson
-    missing_zcta5s = []
+    missing_zcta5s = set()
     feature_ids = set([f["id"] for f in state_gj["features"]])
     valmap_ids = set(valmap.keys())
     for fid in feature_ids.difference(valmap_ids):
         valmap[fid] = 0
-        missing_zcta5s.append(fid)
-
-    # Next, add the suppressed ZCTA5 layer
-    def suppressed_click_handler(event=None, feature=None, id=None, properties=None):
-        value = f"ZCTA {properties['ZCTA5CE10']}: suppressed ({prevalence_type} prevalence, {category})"
-        label.value = value
-
-    suppressed_gj = state_gj.copy()
-    suppressed_features = [
-        f for f in suppressed_gj["features"] if f["id"][:3] in suppressed_zcta3s
-    ]
-    suppressed_gj["features"] = suppressed_features
-    suppressed_layer = GeoJSON(
-        data=suppressed_gj,
-        style={
-            "opacity": 1.0,
-            "color": "black",
-            "weight": 0.8,
-            "fillOpacity": 0.2,
-        },
-        hover_style={"fillColor": "green", "fillOpacity": 0.5},
-    )
-    suppressed_layer.on_click(suppressed_click_handler)
-
-    reduced_features = [f for f in state_gj["features"] if valmap[f["id"]] != 0]
-    state_gj["features"] = reduced_features
-
-    def value_click_handler(event=None, feature=None, id=None, properties=None):
-        value = f"ZCTA3 {properties['ZCTA5CE10'][:3]}: {valmap[id]} ({prevalence_type} prevalence, {category})"
-        label.value = value
-
-    choro_layer = Choropleth(
-        geo_data=state_gj,
-        choro_data=valmap,
-        colormap=colors,
-        value_min=value_min,
-        value_max=value_max,
-        border_color="black",
-        hover_style={"fillOpacity": 0.4},
-        style={"fillOpacity": 1.0},
-        name=category,
-        layout=Layout(width="100%", height="600px"),
-    )
-    choro_layer.on_click(value_click_handler)
+        missing_zcta5s.add(fid)
 
-    # Add all three layers together to be explicit
-    layer_group = LayerGroup(layers=(base_layer, suppressed_layer, choro_layer))
-    m.add_layer(layer_group)
+    m = Map()
+    label = Label(layout=Layout(width="100%"))
+
+    if tile_url:
+        # Suppressed ZCTA5s are shaded grey, ZCTA5s with values by the colormap
+        feature_colors = {
+            fid: SUPPRESSED_COLOR for fid in feature_ids if fid[:3] in suppressed_zcta3s
+        }
+        feature_colors.update(
+            {
+                fid: colors.rgb_hex_str(val)
+                for fid, val in valmap.items()
+                if fid not in missing_zcta5s
+            }
+        )
+        tile_layer = vector_tile_layer(
+            tile_url, feature_colors, name=category, visible_ids=feature_ids
+        )
+        m.add_layer(tile_layer)
+    else:
+        # First, add the base map of all zctas
+        def base_click_handler(event=None, feature=None, id=None, properties=None):
+            value = f"ZCTA {properties['ZCTA5CE10']}: no value ({prevalence_type} prevalence, {category})"
+            label.value = value
+
+        base_layer = GeoJSON(
+            data=state_gj,
+            style={"opacity": 0.8, "color": "black", "weight": 0.8, "fillOpacity": 0.1},
+            hover_style={"fillColor": "blue", "fillOpacity": 0.5},
+        )
+        base_layer.on_click(base_click_handler)
+
+        # Next, add the suppressed ZCTA5 layer
+        def suppressed_click_handler(
+            event=None, feature=None, id=None, properties=None
+        ):
+            value = f"ZCTA {properties['ZCTA5CE10']}: suppressed ({prevalence_type} prevalence, {category})"
+            label.value = value
+
+        suppressed_gj = state_gj.copy()
+        suppressed_features = [
+            f for f in suppressed_gj["features"] if f["id"][:3] in suppressed_zcta3s
+        ]
+        suppressed_gj["features"] = suppressed_features
+        suppressed_layer = GeoJSON(
+            data=suppressed_gj,
+            style={
+                "opacity": 1.0,
+                "color": "black",
+                "weight": 0.8,
+                "fillOpacity": 0.2,
+            },
+            hover_style={"fillColor": "green", "fillOpacity": 0.5},
+        )
+        suppressed_layer.on_click(suppressed_click_handler)
+
+        value_gj = state_gj.copy()
+        reduced_features = [
+            f for f in value_gj["features"] if f["id"] not in missing_zcta5s
+        ]
+        value_gj["features"] = reduced_features
+
+        def value_click_handler(event=None, feature=None, id=None, properties=None):
+            zcta3 = properties["ZCTA5CE10"][:3]
+            value = f"ZCTA3 {zcta3}: {descriptions[zcta3]}"
+            label.value = value
+
+        choro_layer = Choropleth(
+            geo_data=value_gj,
+            choro_data=valmap,
+            colormap=colors,
+            value_min=value_min,
+            value_max=value_max,
+            border_color="black",
+            hover_style={"fillOpacity": 0.4},
+            style={"fillOpacity": 1.0},
+            name=category,
+            layout=Layout(width="100%", height="600px"),
+        )
+        choro_layer.on_click(value_click_handler)
+
+        # Add all three layers together to be explicit
+        layer_group = LayerGroup(layers=(base_layer, suppressed_layer, choro_layer))
+        m.add_layer(layer_group)
 
     legend_colors = {}
     for i, val in enumerate(colors.index[1:]):
         val_lower = round(colors.index[i])
         val_upper = round(val)
-        legend_key = f"{val_lower} - {val_upper}%"
+        suffix = "" if layer in ("Rank", "Hotspots") else "%"
+        legend_key = f"{val_lower} - {val_upper}{suffix}"
         legend_colors[legend_key] = colors.rgb_hex_str(val)
-    legend = LegendControl(legend_colors, name="PQ Prevalence", position="bottomright")
+    legend_name = "PQ Prevalence" if layer == "Prevalence" else f"PQ {layer}"
+    legend = LegendControl(legend_colors, name=legend_name, position="bottomright")
     m.add_control(legend)
     m.fit_bounds(STATE_BOUNDS[selected_state])
 
     return VBox([m, label])
+
+
+class Prefetcher:
+    """
+    Warms the map caches in background threads as soon as a selection changes, so
+    the map cells find boundaries and data already loaded.
+
+    For a state, the ZCTA boundaries are decompressed and parsed, the state's
+    ZCTA5s are joined to their ZCTA3s, and its CDC PLACES rows are filtered. For a
+    population group, the results are ingested and materialized as a Cube. Work
+    runs in a thread pool, so the widget callbacks that start it return at once.
+    A new selection cancels the prefetches of earlier selections that have not
+    started; the map functions wait for one that is running rather than repeat it.
+
+        prefetcher = maps.Prefetcher(results_folder)
+        prefetcher.watch(state_drop_down, pop_group_drop_down)
+        prev_data, pop_data, cube = prefetcher.frames(population_group)
+
+    Parameters:
+    results_folder: Folder of CODI-PQ outputs to ingest for each population group;
+        if None, only state data is prefetched
+    max_workers: Number of background threads
+    """
+
+    def __init__(self, results_folder=None, max_workers=PREFETCH_WORKERS):
+        self.results_folder = results_folder
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="pqviz-prefetch"
+        )
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._pending = []
+        self._frames = {}
+
+    def _run(self, generation, func, *args):
+        # Skip work for a selection that has since changed
+        if generation != self._generation:
+            return None
+        try:
+            return func(*args)
+        except FileNotFoundError:
+            # e.g. the PLACES data is not present; the map cell will report it
+            return None
+
+    def prefetch(self, selected_state, population_group=None):
+        """
+        Start warming the caches for a state and, optionally, a population group,
+        cancelling the prefetches of earlier selections that have not started.
+
+        Returns:
+        The list of Futures of the prefetches started.
+        """
+        with self._lock:
+            self._generation += 1
+            for future in self._pending:
+                future.cancel()
+            for group, future in list(self._frames.items()):
+                if group != population_group and future.cancel():
+                    del self._frames[group]
+
+            tasks = [load_state_boundaries, state_zctas, state_places]
+            self._pending = [
+                self.executor.submit(self._run, self._generation, func, selected_state)
+                for func in tasks
+            ]
+            if population_group is not None and self.results_folder is not None:
+                if population_group not in self._frames:
+                    self._frames[population_group] = self.executor.submit(
+                        self._ingest, population_group
+                    )
+            return list(self._pending)
+
+    def _ingest(self, population_group):
+        prev_data = create_dataframes.create_prevalence_df(
+            self.results_folder, population_group
+        )
+        pop_data = create_dataframes.create_population_df(
+            self.results_folder, population_group
+        )
+        return prev_data, pop_data, cube_or_frame(prev_data, pop_data)
+
+    def frames(self, population_group):
+        """
+        Return the prevalence and population frames of a population group and
+        their Cube, waiting for a running prefetch or ingesting them now. If the
+        results are too large for a Cube, the prevalence frame is returned in its
+        place, as the plots and maps take either.
+        """
+        with self._lock:
+            future = self._frames.get(population_group)
+            if future is None or future.cancelled():
+                future = self.executor.submit(self._ingest, population_group)
+                self._frames[population_group] = future
+        return future.result()
+
+    def watch(self, state_dropdown, pop_group_dropdown=None):
+        """
+        Prefetch for the current values of a state dropdown and, optionally, a
+        population group dropdown, and again whenever either changes.
+        """
+
+        def handler(change=None):
+            self.prefetch(
+                state_dropdown.value,
+                pop_group_dropdown.value if pop_group_dropdown is not None else None,
+            )
+
+        state_dropdown.observe(handler, names="value")
+        if pop_group_dropdown is not None:
+            pop_group_dropdown.observe(handler, names="value")
+        handler()
+
+    def shutdown(self):
+        """Cancel pending prefetches and stop the background threads."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,434 @@
+"""
+Headless PQViz pipeline for scheduled production runs, replacing the notebook.
+
+A run ingests a folder of CODI-PQ results, checks suppression, exports plots and
+maps, and writes an HTML report, as a graph of stages:
+
+    prevalence ─┬─ suppression ─┐
+                ├─ maps ────────┼─ report
+    population ─┴─ plots ───────┘
+
+Stages whose inputs are ready run concurrently. Each stage has a key, a hash of
+its settings and the keys of the stages it depends on, with the ingest stages
+also hashing the names, sizes and modification times of the result files. Keys
+and outputs of the last run are kept in pipeline.json in the output directory,
+and a stage whose key is unchanged and whose outputs still exist is skipped.
+Ingested frames are cached between runs as pickles. Each stage logs its timing.
+
+Run as a subcommand of the pqviz entry point:
+
+    python -m pqviz run sample_data/zcta3 --demographic-types zcta3
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+import html
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+
+import pandas as pd
+
+from . import check_suppressed, create_dataframes, export
+from .common import inputs_fingerprint
+
+
+logger = logging.getLogger(__name__)
+
+STATE_FNAME = "pipeline.json"
+
+# Stages rendering in a pool of worker processes, which may run at the same time
+POOL_STAGES = ["plots", "maps"]
+
+
+class Stage:
+    """
+    A pipeline stage: a function of the pipeline run after the stages it depends
+    on, and the pipeline settings it uses.
+
+    The function returns a summary dict saved with the run, listing the files it
+    wrote under "outputs". Stages producing an in-memory artifact for later stages
+    also return it under "artifact", and give a load function to read it back
+    when the stage itself is skipped.
+    """
+
+    def __init__(self, name, func, deps=(), settings=(), load=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.settings = list(settings)
+        self.load = load
+
+
+def _frame_fname(pipeline, name):
+    return pipeline.output_dir / "cache" / f"{name}.pkl"
+
+
+def _ingest(name, create_df):
+    def run(pipeline):
+        df = create_df(pipeline.results_folder, pipeline.population_group)
+        fname = _frame_fname(pipeline, name)
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        df.to_pickle(fname)
+        return {"rows": len(df), "outputs": [str(fname)], "artifact": df}
+
+    return run
+
+
+def _load_frame(name):
+    def load(pipeline):
+        return pd.read_pickle(_frame_fname(pipeline, name))
+
+    return load
+
+
+def run_suppression(pipeline):
+    """
+    Write a table of suppressed values by weight category for each demographic,
+    and count suppressed values by prevalence type.
+    """
+    prev_data = pipeline.artifact("prevalence")
+    suppression_dir = pipeline.output_dir / "suppression"
+    suppression_dir.mkdir(parents=True, exist_ok=True)
+    outputs = []
+    for demographic_type in pipeline.demographic_types:
+        table = check_suppressed.check_suppressed(prev_data, demographic_type)
+        if table is None:
+            table = pd.DataFrame(columns=["Weight Category", demographic_type])
+        fname = suppression_dir / f"{demographic_type}.csv"
+        table.to_csv(fname, index=False)
+        outputs.append(str(fname))
+    counts = prev_data["Prevalence"].isna().groupby(prev_data["Prevalence type"]).sum()
+    return {
+        "suppressed": {ptype: int(n) for ptype, n in counts.items()},
+        "values": len(prev_data),
+        "outputs": outputs,
+    }
+
+
+def run_plots(pipeline):
+    """Export the prevalence and population plots of each demographic."""
+    plot_dir = pipeline.output_dir / "plots"
+    summary = {"rendered": 0, "failed": 0, "outputs": []}
+    for demographic_type in pipeline.demographic_types:
+        index = export.export_plots(
+            pipeline.artifact("prevalence"),
+            pipeline.artifact("population"),
+            plot_dir,
+            demographic_type,
+            pipeline.population_group,
+            formats=pipeline.plot_formats,
+            max_workers=pipeline.stage_workers(),
+        )
+        summary["rendered"] += index["rendered"]
+        summary["failed"] += sum(p["status"] == "error" for p in index["plots"])
+        summary["outputs"].append(
+            str(plot_dir / pipeline.population_group / demographic_type / "index.json")
+        )
+    return summary
+
+
+def run_maps(pipeline):
+    """Export the prevalence maps of each state, category and prevalence type."""
+    map_dir = pipeline.output_dir / "maps"
+    manifest = export.export_maps(
+        pipeline.artifact("prevalence"),
+        map_dir,
+        states=pipeline.states,
+        formats=pipeline.map_formats,
+        max_workers=pipeline.stage_workers(),
+    )
+    return {
+        "maps": len(manifest["maps"]),
+        "failed": sum(m["status"] != "ok" for m in manifest["maps"]),
+        "outputs": [str(map_dir / "manifest.json")],
+    }
+
+
+def run_report(pipeline):
+    """
+    Write an HTML report of the run, linking the suppression tables, plots and
+    maps written by the other stages.
+    """
+    out = pipeline.output_dir
+    parts = [
+        "<html><head><meta charset='utf-8'><title>PQViz report</title></head><body>",
+        "<h1>PQViz report</h1>",
+        f"<p>Results: {html.escape(str(pipeline.results_folder))}<br>"
+        f"Population group: {html.escape(pipeline.population_group)}<br>"
+        f"Created: {time.strftime('%Y-%m-%d %H:%M:%S')}</p>",
+        "<h2>Stages</h2><table border='1'><tr><th>Stage</th><th>Status</th>"
+        "<th>Seconds</th></tr>",
+    ]
+    for name, record in pipeline.records.items():
+        parts.append(
+            f"<tr><td>{name}</td><td>{record.get('status', '')}</td>"
+            f"<td>{record.get('seconds', '')}</td></tr>"
+        )
+    parts.append("</table>")
+
+    if "suppression" in pipeline.records:
+        parts.append("<h2>Suppressed data</h2>")
+        for demographic_type in pipeline.demographic_types:
+            fname = out / "suppression" / f"{demographic_type}.csv"
+            if fname.is_file():
+                table = pd.read_csv(fname)
+                parts.append(f"<h3>{html.escape(demographic_type)}</h3>")
+                if table.empty:
+                    parts.append(
+                        "<p>There are no suppressed values for this demographic level.</p>"
+                    )
+                else:
+                    parts.append(table.to_html(index=False))
+
+    if "plots" in pipeline.records:
+        parts.append("<h2>Plots</h2>")
+        for demographic_type in pipeline.demographic_types:
+            plot_dir = out / "plots"
+            index_fname = plot_dir / pipeline.population_group / demographic_type
+            index_fname = index_fname / "index.json"
+            if not index_fname.is_file():
+                continue
+            with open(index_fname) as f:
+                index = json.load(f)
+            parts.append(f"<h3>{html.escape(demographic_type)}</h3>")
+            for plot in index["plots"]:
+                if "png" in plot.get("files", {}):
+                    src = Path("plots") / plot["files"]["png"]
+                    parts.append(f"<img src='{src.as_posix()}' width='480'>")
+
+    if "maps" in pipeline.records:
+        manifest_fname = out / "maps" / "manifest.json"
+        if manifest_fname.is_file():
+            with open(manifest_fname) as f:
+                manifest = json.load(f)
+            parts.append("<h2>Maps</h2><ul>")
+            for entry in manifest["maps"]:
+                links = ", ".join(
+                    f"<a href='{(Path('maps') / fname).as_posix()}'>{fmt}</a>"
+                    for fmt, fname in entry["files"].items()
+                )
+                parts.append(
+                    f"<li>{entry['state']} {html.escape(entry['category'])} "
+                    f"{entry['prevalence_type']}: {links}</li>"
+                )
+            parts.append("</ul>")
+
+    parts.append("</body></html>")
+    fname = out / "report.html"
+    fname.write_text("\n".join(parts))
+    return {"outputs": [str(fname)]}
+
+
+STAGES = [
+    Stage(
+        "prevalence",
+        _ingest("prevalence", create_dataframes.create_prevalence_df),
+        settings=["inputs", "population_group"],
+        load=_load_frame("prevalence"),
+    ),
+    Stage(
+        "population",
+        _ingest("population", create_dataframes.create_population_df),
+        settings=["inputs", "population_group"],
+        load=_load_frame("population"),
+    ),
+    Stage(
+        "suppression",
+        run_suppression,
+        deps=["prevalence"],
+        settings=["demographic_types"],
+    ),
+    Stage(
+        "plots",
+        run_plots,
+        deps=["prevalence", "population"],
+        settings=["demographic_types", "plot_formats"],
+    ),
+    Stage(
+        "maps",
+        run_maps,
+        deps=["prevalence"],
+        settings=["states", "map_formats"],
+    ),
+    Stage(
+        "report",
+        run_report,
+        deps=["suppression", "plots", "maps"],
+        settings=["demographic_types"],
+    ),
+]
+
+
+class Pipeline:
+    """
+    A run of the pipeline stages over one folder of CODI-PQ results.
+
+    Parameters:
+    results_folder: Folder of CODI-PQ outputs
+    output_dir: Directory for stage outputs, cached frames and the run state
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    demographic_types: Demographics to check and plot, e.g. ['sex', 'race', 'age', 'zcta3']
+    states: State abbreviations to map; defaults to the states in the results
+    plot_formats: File formats of plots, any of ['png', 'pdf', 'svg']
+    map_formats: File formats of maps, any of ['png', 'html']
+    max_workers: Number of worker processes for plots and maps together
+    stages: Names of the stages to run, with the stages they depend on; if None, all
+    force: Run every stage, even if its inputs have not changed
+    """
+
+    def __init__(
+        self,
+        results_folder,
+        output_dir="pqviz_output",
+        population_group="Pediatric",
+        demographic_types=("zcta3",),
+        states=None,
+        plot_formats=("png",),
+        map_formats=("png",),
+        max_workers=None,
+        stages=None,
+        force=False,
+    ):
+        self.results_folder = Path(results_folder)
+        self.output_dir = Path(output_dir)
+        self.population_group = population_group
+        self.demographic_types = list(demographic_types)
+        self.states = states
+        self.plot_formats = list(plot_formats)
+        self.map_formats = list(map_formats)
+        self.max_workers = max_workers
+        self.force = force
+        self.inputs = inputs_fingerprint(self.results_folder)
+
+        self.stages = {stage.name: stage for stage in STAGES}
+        selected = set()
+        for name in stages or self.stages:
+            self._select(name, selected)
+        self.stages = {n: s for n, s in self.stages.items() if n in selected}
+
+        self.records = {}
+        self._artifacts = {}
+        self._lock = threading.Lock()
+
+    def _select(self, name, selected):
+        if name not in selected:
+            selected.add(name)
+            for dep in self.stages[name].deps:
+                self._select(dep, selected)
+
+    def stage_key(self, stage):
+        """
+        Hash a stage's settings with the keys of the stages it depends on.
+        """
+        settings = {name: getattr(self, name) for name in stage.settings}
+        deps = [self.records[dep]["key"] for dep in stage.deps if dep in self.records]
+        data = json.dumps([stage.name, settings, deps], sort_keys=True, default=str)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def artifact(self, name):
+        """
+        Return the in-memory artifact of a stage, loading it from its cached file
+        if the stage was skipped.
+        """
+        with self._lock:
+            if name not in self._artifacts:
+                self._artifacts[name] = self.stages[name].load(self)
+            return self._artifacts[name]
+
+    def stage_workers(self):
+        """
+        Return the number of worker processes of a stage's pool. The stages of
+        POOL_STAGES run at the same time, so those selected share max_workers, or
+        the CPUs, rather than each starting as many.
+        """
+        workers = self.max_workers or os.cpu_count()
+        sharing = sum(name in self.stages for name in POOL_STAGES)
+        return max(workers // max(sharing, 1), 1)
+
+    def _is_cached(self, stage, key, previous):
+        record = previous.get(stage.name)
+        return (
+            not self.force
+            and record is not None
+            and record.get("key") == key
+            and record.get("status") in ("ok", "cached")
+            and all(Path(fname).exists() for fname in record.get("outputs", []))
+        )
+
+    def _run_stage(self, stage, key, previous):
+        start = time.perf_counter()
+        if self._is_cached(stage, key, previous):
+            record = dict(previous[stage.name], status="cached")
+        else:
+            try:
+                summary = stage.func(self)
+                if "artifact" in summary:
+                    with self._lock:
+                        self._artifacts[stage.name] = summary.pop("artifact")
+                record = dict(summary, status="ok")
+            except Exception as e:
+                logger.exception("Stage %s failed", stage.name)
+                record = {"status": "error", "error": repr(e)}
+        record["key"] = key
+        record["seconds"] = round(time.perf_counter() - start, 3)
+        logger.info("%s: %s in %.2fs", stage.name, record["status"], record["seconds"])
+        return record
+
+    def run(self):
+        """
+        Run the stages, concurrently where their dependencies allow, and save the
+        run state.
+
+        Returns:
+        A dict of stage name to its record: status, key, timing and outputs.
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        state_fname = self.output_dir / STATE_FNAME
+        previous = {}
+        if state_fname.is_file():
+            with open(state_fname) as f:
+                previous = json.load(f)["stages"]
+
+        start = time.perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    deps = [d for d in stage.deps if d in self.stages]
+                    if all(d in self.records for d in deps):
+                        del pending[name]
+                        # Stages downstream of a failure are skipped, transitively
+                        if any(
+                            self.records[d]["status"] in ("error", "skipped")
+                            for d in deps
+                        ):
+                            self.records[name] = {"status": "skipped", "key": None}
+                            logger.info("%s: skipped after a failed stage", name)
+                            continue
+                        key = self.stage_key(stage)
+                        future = executor.submit(self._run_stage, stage, key, previous)
+                        running[future] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.records[running.pop(future)] = future.result()
+
+        seconds = round(time.perf_counter() - start, 3)
+        logger.info("Pipeline finished in %.2fs", seconds)
+        with open(state_fname, "w") as f:
+            json.dump(
+                {
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "seconds": seconds,
+                    "stages": {**previous, **self.records},
+                },
+                f,
+                indent=2,
+            )
+        return self.records
@@ -1,8 +1,13 @@
+from collections import OrderedDict
+import hashlib
+import io
 import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import glob
+from IPython.display import Image, display
 from ipywidgets import interact, interactive, fixed, interact_manual
 import ipywidgets as widgets
 from pathlib import Path
@@ -11,152 +16,408 @@ import os
 import warnings
 from textwrap import wrap
 
+from .cube import Cube
+
+# Adult summary row of all obesity classes, left out of plots in favor of each class
+ADULT_SUMMARY_CATEGORY = "(4) Obesity (Classes 1, 2, and 3) (BMI 30+)"
+
+# Axis labels for the BMI categories of each population group, in plotting order
+WEIGHT_CATEGORY_LABELS = {
+    "Pediatric": [
+        "(1) Underweight \n(<5th percentile)",
+        "(2) Healthy Weight \n(5th to <85th percentile)",
+        "(3) Overweight \n(85th to <95th percentile)",
+        "(4) Obesity \n(>95th percentile)",
+        "(4b) Severe Obesity \n(>120% of the 95th percentile)",
+    ],
+    "Adult": [
+        "(1) Underweight \n(BMI<18.5)",
+        "(2) Healthy Weight \n(18.5<=BMI<25)",
+        "(3) Overweight \n(25<=BMI<30)",
+        "(4a) Obesity (Class 1) \n(30<=BMI<35)",
+        "(4b) Obesity (Class 2) \n(35<=BMI<40)",
+        "(4c) Obesity (Class 3) - Severe Obesity \n(BMI 40+)",
+    ],
+}
+
+
+class PlotData:
+    """
+    A DataFrame created using create_prevalence_df() or create_population_df(),
+    with its values converted to numbers once and grouped by demographic value and
+    prevalence or population type, so each plot fetches its rows from a dict
+    instead of filtering the whole frame.
+
+    Groups for a demographic type are built on first use, or up front for the
+    demographic types given when creating the PlotData. The grouped frames are
+    shared between calls and must not be modified.
+    """
+
+    def __init__(self, df, demographic_types=None):
+        self.df = df
+        if "Prevalence type" in df.columns:
+            self.type_column = "Prevalence type"
+            value_columns = ["Prevalence", "Standard Error"]
+        else:
+            self.type_column = "Population type"
+            value_columns = ["Population"]
+
+        self._numeric = df.copy()
+        for column in value_columns:
+            self._numeric[column] = pd.to_numeric(self._numeric[column].fillna(0))
+        self._groups = {}
+        for demographic_type in demographic_types or []:
+            self.groups(demographic_type)
+
+    @property
+    def numeric(self):
+        """The data with values as numbers and suppressed values as 0."""
+        return self._numeric
+
+    def groups(self, demographic_type):
+        """
+        Return a dict of (demographic value, prevalence or population type) to the
+        rows of each group, grouping the data on first use.
+        """
+        if demographic_type not in self._groups:
+            grouped = self._numeric.groupby(
+                [demographic_type, self.type_column], sort=False, observed=True
+            )
+            self._groups[demographic_type] = {key: rows for key, rows in grouped}
+        return self._groups[demographic_type]
+
+    def table(self, demographic_type, sample_type, column):
+        """
+        Return one value column for every demographic value of a prevalence or
+        population type at once, as a DataFrame with a row per demographic value and
+        a column per weight category. Duplicate rows are averaged.
+        """
+        rows = self._numeric.loc[self._numeric[self.type_column] == sample_type]
+        categories = rows["Weight Category"].unique()
+        table = rows.pivot_table(
+            index=demographic_type,
+            columns="Weight Category",
+            values=column,
+            aggfunc="mean",
+            fill_value=0,
+            observed=True,
+        )
+        return table.reindex(columns=categories, fill_value=0).sort_index()
+
+    def subset(self, demographic_type, selected_demo, sample_type):
+        """
+        Return the rows for one demographic value and prevalence or population type.
+        """
+        rows = self.groups(demographic_type).get((selected_demo, sample_type))
+        if rows is None:
+            return self._numeric.iloc[:0]
+        return rows
+
+
+def plot_subset(df, demographic_type, selected_demo, sample_type):
+    """
+    Return the rows of a DataFrame, PlotData or Cube for one demographic value and
+    prevalence or population type, with numeric values and suppressed values as 0.
+    """
+    if isinstance(df, Cube):
+        return df.plot_rows(demographic_type, selected_demo, sample_type)
+    if not isinstance(df, PlotData):
+        df = PlotData(df.loc[df[demographic_type] == selected_demo])
+    return df.subset(demographic_type, selected_demo, sample_type)
+
+
+def plot_rows(df, demographic_type, selected_demo, sample_type, population_group):
+    """
+    Return the rows plotted for one demographic value and prevalence or population
+    type, as plot_subset(), leaving out the Adult summary category.
+    """
+    subsected_df = plot_subset(df, demographic_type, selected_demo, sample_type)
+    if population_group == "Adult":
+        summary_mask = subsected_df["Weight Category"] != ADULT_SUMMARY_CATEGORY
+        subsected_df = subsected_df[summary_mask]
+    return subsected_df
+
+
+class BarPlotRenderer:
+    """
+    Draws horizontal bar plots of values by BMI category on one reusable figure.
+
+    The figure, bars, error bars and labels are created once for a given number of
+    bars, and each later draw updates their data in place instead of building a
+    new plot. The figure is not managed by pyplot, so it is never closed when a
+    notebook cell finishes; show it with display(), or save it with savefig().
+    """
+
+    def __init__(self, figsize=(10, 8)):
+        self.figsize = figsize
+        self.n_bars = None
+
+    def _build(self, n_bars):
+        self.fig = Figure(figsize=self.figsize)
+        self.ax = self.fig.add_subplot()
+        self.n_bars = n_bars
+        y = np.arange(n_bars)
+        zeros = np.zeros(n_bars)
+        self.bars = self.ax.barh(y, zeros, height=0.8, color=sns.color_palette())
+        self.errorbars = self.ax.errorbar(
+            zeros,
+            y,
+            xerr=zeros,
+            linewidth=1.5,
+            color="black",
+            alpha=0.4,
+            capsize=8,
+            ls="none",
+            capthick=2,
+        )
+        self.texts = [
+            self.ax.text(0, i, "", ha="left", va="center") for i in range(n_bars)
+        ]
+        self.ax.set_yticks(y)
+        self.ax.invert_yaxis()
+        self.ax.xaxis.set_major_locator(mticker.MaxNLocator(3))
+        self.ax.xaxis.set_major_formatter(mticker.StrMethodFormatter("{x:,.0f}"))
+        self.ax.set_ylabel("BMI Category", fontsize=16)
+
+    def draw(
+        self,
+        values,
+        errors=None,
+        labels=(),
+        title="",
+        title_size=14,
+        xlabel="",
+        value_labels=False,
+    ):
+        """
+        Draw bars for an array of values, labeling bars of 0 as suppressed.
+
+        Parameters:
+        values: Array of bar lengths, one per BMI category, suppressed values as 0
+        errors: Optional array of standard errors to draw as error bars
+        labels: BMI category labels for the y axis
+        title: Plot title
+        title_size: Font size of the title
+        xlabel: Label for the x axis
+        value_labels: Label non-suppressed bars with their values
+
+        Returns:
+        The matplotlib Figure.
+        """
+        values = np.asarray(values, dtype=float)
+        n_bars = len(values)
+        if n_bars != self.n_bars:
+            self._build(n_bars)
+        y = np.arange(n_bars)
+        max_x = values.max() if n_bars and values.max() > 0 else 1
+        colors = sns.color_palette(n_colors=n_bars)
+
+        for bar, value, color in zip(self.bars.patches, values, colors):
+            bar.set_width(value)
+            bar.set_facecolor(color)
+
+        suppressed = values == 0
+        show_errors = errors is not None
+        errors = np.zeros(n_bars) if errors is None else np.asarray(errors, float)
+        # Suppressed bars get no error bar
+        errors = np.where(suppressed, np.nan, errors)
+        data_line, (left_caps, right_caps), (bar_lines,) = self.errorbars.lines
+        for artist in (left_caps, right_caps, bar_lines):
+            artist.set_visible(show_errors)
+        left_caps.set_data(values - errors, y)
+        right_caps.set_data(values + errors, y)
+        bar_lines.set_segments(
+            np.stack(
+                [
+                    np.column_stack([values - errors, y]),
+                    np.column_stack([values + errors, y]),
+                ],
+                axis=1,
+            )
+        )
+
+        for text, value, is_suppressed, i in zip(self.texts, values, suppressed, y):
+            if is_suppressed:
+                text.set_text("Suppressed Data")
+                text.set_position((max_x / 2.3, i))
+                text.set_fontsize(16)
+            elif value_labels:
+                text.set_text("{:,.0f}".format(value))
+                text.set_position((value + 1, i))
+                text.set_fontsize(plt.rcParams["font.size"])
+            else:
+                text.set_text("")
+
+        self.ax.set_xlim(left=0, right=max_x + max_x / 10)
+        self.ax.set_yticklabels(labels)
+        self.ax.set_title(title, fontsize=title_size, pad=20)
+        self.ax.set_xlabel(xlabel, fontsize=16)
+        return self.fig
+
+
+# Shared renderer for the notebook's interactive plots
+RENDERER = BarPlotRenderer()
+
+
+class FigureCache:
+    """
+    A bounded least-recently-used cache of rendered plot images, keyed on the plot
+    arguments and a fingerprint of the data plotted. A key's fingerprint changes
+    whenever the rows behind a plot change, so stale images are never shown and
+    age out of the cache.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._images = OrderedDict()
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, key):
+        return key in self._images
+
+    def get(self, key):
+        """Return the image for a key, or None, marking it as recently used."""
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        """Add an image, evicting the least recently used beyond maxsize."""
+        self._images[key] = image
+        self._images.move_to_end(key)
+        while len(self._images) > self.maxsize:
+            self._images.popitem(last=False)
+
+    def invalidate(self, fingerprint=None):
+        """Drop the images of one data fingerprint, or all images if None."""
+        if fingerprint is None:
+            self._images.clear()
+            return
+        for key in [k for k in self._images if k[-1] == fingerprint]:
+            del self._images[key]
+
+
+# Shared cache for the notebook's interactive plots
+FIGURE_CACHE = FigureCache()
+
+
+def data_fingerprint(subsected_df):
+    """
+    Return a fingerprint of the rows and values behind a plot.
+    """
+    hashes = pd.util.hash_pandas_object(subsected_df.astype(str), index=True)
+    return hashlib.sha1(hashes.values.tobytes()).hexdigest()
+
+
+def show_cached(cache, key):
+    """
+    Show the cached image for a plot if there is one, returning whether it was shown.
+    """
+    if cache is None:
+        return False
+    image = cache.get(key)
+    if image is None:
+        return False
+    display(Image(data=image))
+    return True
+
+
+def show_figure(fig, cache, key):
+    """
+    Show a figure, rendering it into the cache first if one is given.
+    """
+    if cache is not None:
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png", bbox_inches="tight")
+        cache.put(key, buf.getvalue())
+        display(Image(data=buf.getvalue()))
+    else:
+        display(fig)
+
 
 def plot_pop(df, selected_demo, sam_type, demographic_type, population_group):
     """
     Creates a horizontal bar plot that plots the counts of the perscribed sample type by BMI category
 
     Parameters:
-    df: Data frame created using create_population_df() function
+    df: Data frame created using create_population_df() function, or a PlotData of it
     selected_demo: selected subsected demographic from dropdown. Options will change depending on demographic type.
     sam_type: type of population, selected from dropdown, expected Values ['Population', 'Sample']
     demographic_type: Demographic that they are comparing, select from dropdown earlier in notebook, expected values ['sex', 'race', 'age']
     population_group: Type of population, expected inputs ['Pediatric', 'Adult']
 
     Returns:
-    A horizontal bar plot that plots the counts of the perscribed sample type by BMI category."""
-    if population_group == "Pediatric":
-        plt.figure(figsize=(10, 8))
-        selected_demo_mask = df[demographic_type] == selected_demo
-        prev_type_mask = df["Population type"] == sam_type
-        subsected_df = df[selected_demo_mask & prev_type_mask]
-        subsected_df["Population"] = subsected_df["Population"].fillna(0)
-        ax = sns.barplot(
-            data=subsected_df, y="Weight Category", x="Population", ci=None
-        )
-        max_x = max(subsected_df["Population"])
-        plt.xlim(left=0, right=max_x + max_x / 10)  # set the xlim to left, right
-        for p in ax.patches:
-            width = p.get_width()  # get bar length
-            if width == 0:
-                ax.text(
-                    width + max_x / 2.3,
-                    p.get_y()
-                    + p.get_height() / 2,  # get Y coordinate + X coordinate / 2
-                    "Suppressed Data",  # set Name to ad
-                    ha="left",  # horizontal alignment
-                    va="center",  # vertical alignment
-                    size=16,
-                )  # font size
-            else:
-                ax.text(
-                    width + 1,  # set the text at 1 unit right of the bar
-                    p.get_y()
-                    + p.get_height() / 2,  # get Y coordinate + X coordinate / 2
-                    "{:,.0f}".format(width),  # set variable to display, 2 decimals
-                    ha="left",  # horizontal alignment
-                    va="center",
-                )  # vertical alignment
-        # after plotting the data, format the labels
-        label_format = "{:,.0f}"
-        ax.xaxis.set_major_locator(mticker.MaxNLocator(3))
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels([label_format.format(x) for x in ticks_loc])
-        # plt.savefig(path + '{}'.format(Type) + "_{}".format(Race)+".png")
-        state = list(subsected_df["state"])[0]
-        plt.title(
-            "{}".format(sam_type)
-            + " Size by BMI Category for \n{}".format(selected_demo)
-            + " {} Data".format(population_group)
-            + " in {}".format(state),
-            fontsize=20,
-            pad=20,
-        )
-        plt.xlabel("{}".format(sam_type), fontsize=16)
-        # subsected_df['Weight Category'] = ['\n'.join(wrap(x, 12)) for x in  subsected_df['Weight Category']]
-        peds_labels = [
-            "(1) Underweight \n(<5th percentile)",
-            "(2) Healthy Weight \n(5th to <85th percentile)",
-            "(3) Overweight \n(85th to <95th percentile)",
-            "(4) Obesity \n(>95th percentile)",
-            "(4b) Severe Obesity \n(>120% of the 95th percentile)",
-        ]
-        ax.yaxis.set_ticklabels(peds_labels)
-        plt.ylabel("BMI Category", fontsize=16)
-        plt.show()
-    elif population_group == "Adult":
-        plt.figure(figsize=(10, 8))
-        selected_demo_mask = df[demographic_type] == selected_demo
-        sample_type_mask = df["Population type"] == sam_type
-        summary_mask = df["Weight Category"] != "(4) Obesity (Classes 1, 2, and 3) (BMI 30+)"
-        subsected_df = df[selected_demo_mask & sample_type_mask & summary_mask]
-        subsected_df["Population"] = subsected_df["Population"].fillna(0)
-        ax = sns.barplot(
-            data=subsected_df, y="Weight Category", x="Population", ci=None
-        )
-        max_x = max(subsected_df["Population"])
-        plt.xlim(left=0, right=max_x + max_x / 10)  # set the xlim to left, right
-        for p in ax.patches:
-            width = p.get_width()  # get bar length
-            if width == 0:
-                ax.text(
-                    width + max_x / 2.3,
-                    p.get_y()
-                    + p.get_height() / 2,  # get Y coordinate + X coordinate / 2
-                    "Suppressed Data",  # set Name to ad
-                    ha="left",  # horizontal alignment
-                    va="center",  # vertical alignment
-                    size=16,
-                )  # font size
-            else:
-                ax.text(
-                    width + 1,  # set the text at 1 unit right of the bar
-                    p.get_y()
-                    + p.get_height() / 2,  # get Y coordinate + X coordinate / 2
-                    "{:,.0f}".format(width),  # set variable to display, 2 decimals
-                    ha="left",  # horizontal alignment
-                    va="center",
-                )  # vertical alignment
-        # after plotting the data, format the labels
-        label_format = "{:,.0f}"
-        ax.xaxis.set_major_locator(mticker.MaxNLocator(3))
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels([label_format.format(x) for x in ticks_loc])
-        # plt.savefig(path + '{}'.format(Type) + "_{}".format(Race)+".png")
-        state = list(subsected_df["state"])[0]
-        plt.title(
-            "{}".format(sam_type)
-            + " Size by BMI Category for \n{}".format(selected_demo)
-            + " {}".format(population_group)
-            + " Data"
-            + " in {}".format(state),
-            fontsize=20,
-            pad=20,
-        )
-        plt.xlabel("{}".format(sam_type), fontsize=16)
-        # subsected_df['Weight Category'] = ['\n'.join(wrap(x, 12)) for x in  subsected_df['Weight Category']]
-        adult_labels = [
-            "(1) Underweight \n(BMI<18.5)",
-            "(2) Healthy Weight \n(18.5<=BMI<25)",
-            "(3) Overweight \n(25<=BMI<30)",
-            "(4a) Obesity (Class 1) \n(30<=BMI<35)",
-            "(4b) Obesity (Class 2) \n(35<=BMI<40)",
-            "(4c) Obesity (Class 3) - Severe Obesity \n(BMI 40+)",
-        ]
+    A horizontal bar plot that plots the counts of the perscribed sample type by BMI category.
+    """
+    _plot_pop(df, selected_demo, sam_type, demographic_type, population_group, None)
+
 
-        ax.yaxis.set_ticklabels(adult_labels)
-        plt.ylabel("BMI Category", fontsize=16)
-        plt.show()
+def plot_pop_cached(df, selected_demo, sam_type, demographic_type, population_group):
+    """
+    Same as plot_pop(), but repeat plots are shown from FIGURE_CACHE instead of
+    being drawn again.
+    """
+    _plot_pop(
+        df, selected_demo, sam_type, demographic_type, population_group, FIGURE_CACHE
+    )
+
+
+def _plot_pop(df, selected_demo, sam_type, demographic_type, population_group, cache):
+    subsected_df = plot_rows(
+        df, demographic_type, selected_demo, sam_type, population_group
+    )
+    key = (
+        "plot_pop",
+        selected_demo,
+        sam_type,
+        demographic_type,
+        population_group,
+        data_fingerprint(subsected_df),
+    )
+    if show_cached(cache, key):
+        return
+
+    fig = pop_figure(subsected_df, selected_demo, sam_type, population_group)
+    show_figure(fig, cache, key)
+
+
+def pop_figure(
+    subsected_df, selected_demo, sam_type, population_group, renderer=RENDERER
+):
+    """
+    Draw the plot_pop() bar plot for the rows of one demographic value and sample
+    type, as returned by plot_subset(), without showing it.
+
+    Returns:
+    The matplotlib Figure of the renderer.
+    """
+    values = subsected_df.groupby("Weight Category", sort=False)["Population"].mean()
+    state = list(subsected_df["state"])[0]
+    return renderer.draw(
+        values.to_numpy(),
+        labels=WEIGHT_CATEGORY_LABELS[population_group][: len(values)],
+        title="{}".format(sam_type)
+        + " Size by BMI Category for \n{}".format(selected_demo)
+        + " {}".format(population_group)
+        + " Data"
+        + " in {}".format(state),
+        title_size=20,
+        xlabel="{}".format(sam_type),
+        value_labels=True,
+    )
 
 
-def plot_prevalence(df, selected_demo, prevalence_type, demographic_type, population_group):
+def plot_prevalence(
+    df, selected_demo, prevalence_type, demographic_type, population_group
+):
     """
     Creates a horizontal bar plot that plots the prevelance of the perscribed sample type by BMI category
 
     Parameters:
-    df: Data frame created using create_population_df() function
+    df: Data frame created using create_prevalence_df() function, or a PlotData of it
     selected_demo: selected subsected demographic from dropdown. Options will change depending on demographic type.
     prevalence_type: type of prevalence, selected from dropdown, expected Values ['Crude', 'Age-Adjusted', 'Weighted']
     demographic_type: Demographic that they are comparing, select from dropdown earlier in notebook, expected values ['sex', 'race', 'age']
@@ -164,132 +425,252 @@ def plot_prevalence(df, selected_demo, prevalence_type, demographic_type, popula
 
     Returns:
     A horizontal bar plot that plots the perevalence of the perscribed sample type by BMI category with the
-    standard error calculated with CODI-PQ represented by error bars. """
-
-
-    if population_group == "Pediatric":
-        plt.figure(figsize=(10, 8))
-        selected_demo_mask = (df[demographic_type] == selected_demo)
-        prev_type_mask = df["Prevalence type"] == prevalence_type
-        subsected_df = df[selected_demo_mask & prev_type_mask]
-        subsected_df = subsected_df.fillna(0)
-        subsected_df["Prevalence"] = pd.to_numeric(subsected_df["Prevalence"])
-        subsected_df["Standard Error"] = pd.to_numeric(subsected_df["Standard Error"])
-        ax = sns.barplot(data=subsected_df, y="Weight Category", x="Prevalence", ci=None)
-        max_x = max(subsected_df["Prevalence"])
-        plt.xlim(left=0, right=max_x + max_x / 10)  # set the xlim to left, right
-        for p in ax.patches:
-            width = p.get_width()  # get bar length
-            if width == 0:
-                ax.text(
-                    width + max_x / 2.3,
-                    p.get_y() + p.get_height() / 2,  # get Y coordinate + X coordinate / 2
-                    "Suppressed Data",  # set Name to ad
-                    ha="left",  # horizontal alignment
-                    va="center",  # vertical alignment
-                    size=16,
-                )  # font size
-        ax.errorbar(
-            y=subsected_df["Weight Category"],
-            x=subsected_df["Prevalence"],
-            xerr=subsected_df["Standard Error"],
-            linewidth=1.5,
-            color="black",
-            alpha=0.4,
-            capsize=8,
-            ls="none",
-            capthick = 2
-        )
-        label_format = "{:,.0f}"
-
-        ax.xaxis.set_major_locator(mticker.MaxNLocator(3))
-        ticks_loc = ax.get_xticks().tolist()
-        ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-        ax.set_xticklabels([label_format.format(x) for x in ticks_loc])
-        state = subsected_df["state"].unique()[0]
-        plt.title(
-            "BMI Category {}".format(prevalence_type)
-            + "\n Prevalence for {}".format(selected_demo)
-            + " {}".format(population_group)
-            + " Data"
-            + " in {}".format(state),
-            fontsize=14,
-            pad=20,
-        )
-        plt.xlabel("Prevalence", fontsize=16)
-        # subsected_df['BMI Category'] = ['\n'.join(wrap(x, 12)) for x in  subsected_df['BMI Category']]
-        plt.ylabel("BMI Category", fontsize=16)
-        peds_labels = [
-            "(1) Underweight \n(<5th percentile)",
-            "(2) Healthy Weight \n(5th to <85th percentile)",
-            "(3) Overweight \n(85th to <95th percentile)",
-            "(4) Obesity \n(>95th percentile)",
-            "(4b) Severe Obesity \n(>120% of the 95th percentile)",
-        ]
-        ax.yaxis.set_ticklabels(peds_labels)
-        plt.show()
-    elif population_group == 'Adult':
-            plt.figure(figsize=(10, 8))
-            selected_demo_mask = df[demographic_type] == selected_demo
-            prev_type_mask = df["Prevalence type"] == prevalence_type
-            summary_mask = df["Weight Category"] != "(4) Obesity (Classes 1, 2, and 3) (BMI 30+)"
-            subsected_df = df[selected_demo_mask & prev_type_mask & summary_mask]
-            subsected_df = subsected_df.fillna(0)
-            subsected_df["Prevalence"] = pd.to_numeric(subsected_df["Prevalence"])
-            subsected_df["Standard Error"] = pd.to_numeric(subsected_df["Standard Error"])
-            ax = sns.barplot(data=subsected_df, y="Weight Category", x="Prevalence", ci=None)
-            max_x = max(subsected_df["Prevalence"])
-            plt.xlim(left=0, right=max_x + max_x / 10)  # set the xlim to left, right
-            for p in ax.patches:
-                width = p.get_width()  # get bar length
-                if width == 0:
-                    ax.text(
-                        width + max_x / 2.3,
-                        p.get_y() + p.get_height() / 2,  # get Y coordinate + X coordinate / 2
-                        "Suppressed Data",  # set Name to ad
-                        ha="left",  # horizontal alignment
-                        va="center",  # vertical alignment
-                        size=16,
-                    )  # font size
+    standard error calculated with CODI-PQ represented by error bars."""
+    _plot_prevalence(
+        df, selected_demo, prevalence_type, demographic_type, population_group, None
+    )
+
+
+def plot_prevalence_cached(
+    df, selected_demo, prevalence_type, demographic_type, population_group
+):
+    """
+    Same as plot_prevalence(), but repeat plots are shown from FIGURE_CACHE instead
+    of being drawn again.
+    """
+    _plot_prevalence(
+        df,
+        selected_demo,
+        prevalence_type,
+        demographic_type,
+        population_group,
+        FIGURE_CACHE,
+    )
+
+
+def _plot_prevalence(
+    df, selected_demo, prevalence_type, demographic_type, population_group, cache
+):
+    subsected_df = plot_rows(
+        df, demographic_type, selected_demo, prevalence_type, population_group
+    )
+    key = (
+        "plot_prevalence",
+        selected_demo,
+        prevalence_type,
+        demographic_type,
+        population_group,
+        data_fingerprint(subsected_df),
+    )
+    if show_cached(cache, key):
+        return
+
+    fig = prevalence_figure(
+        subsected_df, selected_demo, prevalence_type, population_group
+    )
+    show_figure(fig, cache, key)
+
+
+def prevalence_figure(
+    subsected_df, selected_demo, prevalence_type, population_group, renderer=RENDERER
+):
+    """
+    Draw the plot_prevalence() bar plot for the rows of one demographic value and
+    prevalence type, as returned by plot_subset(), without showing it.
+
+    Returns:
+    The matplotlib Figure of the renderer.
+    """
+    values = subsected_df.groupby("Weight Category", sort=False)[
+        ["Prevalence", "Standard Error"]
+    ].mean()
+    state = subsected_df["state"].unique()[0]
+    return renderer.draw(
+        values["Prevalence"].to_numpy(),
+        errors=values["Standard Error"].to_numpy(),
+        labels=WEIGHT_CATEGORY_LABELS[population_group][: len(values)],
+        title="BMI Category {}".format(prevalence_type)
+        + "\n Prevalence for {}".format(selected_demo)
+        + " {}".format(population_group)
+        + " Data"
+        + " in {}".format(state),
+        title_size=14,
+        xlabel="Prevalence",
+    )
+
+
+def draw_facets(
+    values,
+    demo_values,
+    labels,
+    errors=None,
+    title="",
+    xlabel="",
+    ncols=4,
+    value_labels=False,
+):
+    """
+    Draw a grid of horizontal bar plots, one panel per demographic value, with
+    shared axes.
+
+    Parameters:
+    values: Array of shape (demographic values, BMI categories), suppressed as 0
+    demo_values: Demographic value of each row of values, used as panel titles
+    labels: BMI category labels for the y axis
+    errors: Optional array of standard errors the same shape as values
+    title: Figure title
+    xlabel: Label for the x axis
+    ncols: Number of panels per row
+    value_labels: Label non-suppressed bars with their values
+
+    Returns:
+    The matplotlib Figure.
+    """
+    values = np.asarray(values, dtype=float)
+    n_panels, n_bars = values.shape
+    ncols = max(1, min(ncols, n_panels))
+    nrows = -(-n_panels // ncols)
+    fig = Figure(figsize=(4 * ncols + 2, 0.5 * n_bars * nrows + 1.5))
+    axes = fig.subplots(nrows, ncols, sharex=True, sharey=True, squeeze=False)
+
+    suppressed = values == 0
+    max_x = values.max() if values.size and values.max() > 0 else 1
+    if errors is not None:
+        errors = np.where(suppressed, np.nan, np.asarray(errors, dtype=float))
+        max_x = max(max_x, np.nanmax(values + errors, initial=0))
+    y = np.arange(n_bars)
+    colors = sns.color_palette(n_colors=n_bars)
+
+    for i, ax in enumerate(axes.flat):
+        if i >= n_panels:
+            ax.set_visible(False)
+            continue
+        ax.barh(y, values[i], height=0.8, color=colors)
+        if errors is not None:
             ax.errorbar(
-                y=subsected_df["Weight Category"],
-                x=subsected_df["Prevalence"],
-                xerr=subsected_df["Standard Error"],
-                linewidth=1.5,
+                values[i],
+                y,
+                xerr=errors[i],
+                linewidth=1,
                 color="black",
                 alpha=0.4,
-                capsize=8,
+                capsize=3,
                 ls="none",
-                capthick = 2
             )
-            label_format = "{:,.0f}"
-
-            ax.xaxis.set_major_locator(mticker.MaxNLocator(3))
-            ticks_loc = ax.get_xticks().tolist()
-            ax.xaxis.set_major_locator(mticker.FixedLocator(ticks_loc))
-            ax.set_xticklabels([label_format.format(x) for x in ticks_loc])
-            state = subsected_df["state"].unique()[0]
-            plt.title(
-                "BMI Category {}".format(prevalence_type)
-                + "\n Prevalence for {}".format(selected_demo)
-                + " {}".format(population_group)
-                + " Data"
-                + " in {}".format(state),
-                fontsize=14,
-                pad=20,
-            )
-            plt.xlabel("Prevalence", fontsize=16)
-            # subsected_df['BMI Category'] = ['\n'.join(wrap(x, 12)) for x in  subsected_df['BMI Category']]
-            plt.ylabel("BMI Category", fontsize=16)
-            adult_labels = [
-                "(1) Underweight \n(BMI<18.5)",
-                "(2) Healthy Weight \n(18.5<=BMI<25)",
-                "(3) Overweight \n(25<=BMI<30)",
-                "(4a) Obesity (Class 1) \n(30<=BMI<35)",
-                "(4b) Obesity (Class 2) \n(35<=BMI<40)",
-                "(4c) Obesity (Class 3) - Severe Obesity \n(BMI 40+)",
-            ]
-
-            ax.yaxis.set_ticklabels(adult_labels)
-            # plt.savefig(path + '{}'.format(prevalence_type) + "_{}".format(selected_demo)+".png")
-            plt.show()
+        for j in np.flatnonzero(suppressed[i]):
+            ax.text(max_x / 2, j, "Suppressed", ha="center", va="center", fontsize=8)
+        if value_labels:
+            for j in np.flatnonzero(~suppressed[i]):
+                ax.text(
+                    values[i, j],
+                    j,
+                    " {:,.0f}".format(values[i, j]),
+                    va="center",
+                    fontsize=8,
+                )
+        ax.set_title("{}".format(demo_values[i]), fontsize=11)
+
+    ax = axes[0, 0]
+    ax.set_yticks(y)
+    ax.set_yticklabels(labels)
+    ax.invert_yaxis()
+    ax.set_xlim(0, max_x * 1.15)
+    ax.xaxis.set_major_locator(mticker.MaxNLocator(3))
+    ax.xaxis.set_major_formatter(mticker.StrMethodFormatter("{x:,.0f}"))
+    for i, ax in enumerate(axes.flat[:n_panels]):
+        ax.tick_params(axis="y", labelsize=8)
+        # Label the x axis of the lowest panel in each column
+        if i + ncols >= n_panels:
+            ax.tick_params(axis="x", labelbottom=True)
+            ax.set_xlabel(xlabel)
+    fig.suptitle(title, fontsize=14)
+    fig.tight_layout()
+    return fig
+
+
+def _facet_data(df, demographic_type, sample_type, population_group, columns):
+    """
+    Return per-category tables of the given value columns for every value of a
+    demographic, leaving out the Adult summary category.
+    """
+    if not isinstance(df, PlotData):
+        df = PlotData(df)
+    tables = [df.table(demographic_type, sample_type, column) for column in columns]
+    if population_group == "Adult":
+        tables = [
+            table.drop(columns=ADULT_SUMMARY_CATEGORY, errors="ignore")
+            for table in tables
+        ]
+    state = df.df["state"].dropna().unique()
+    return tables, state[0] if len(state) else ""
+
+
+def plot_pop_facets(df, sam_type, demographic_type, population_group, ncols=4):
+    """
+    Creates a grid of horizontal bar plots of the counts of the perscribed sample type
+    by BMI category, one panel for each value of the demographic, on shared axes.
+
+    Parameters:
+    df: Data frame created using create_population_df() function, or a PlotData of it
+    sam_type: type of population, expected Values ['Population', 'Sample']
+    demographic_type: Demographic that they are comparing, expected values ['sex', 'race', 'age', 'zcta3']
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    ncols: Number of panels per row
+
+    Returns:
+    The matplotlib Figure, shown by interact() or as the result of a notebook cell.
+    """
+    (values,), state = _facet_data(
+        df, demographic_type, sam_type, population_group, ["Population"]
+    )
+    fig = draw_facets(
+        values.to_numpy(),
+        values.index,
+        WEIGHT_CATEGORY_LABELS[population_group][: values.shape[1]],
+        title="{} Size by BMI Category and {} for {} Data in {}".format(
+            sam_type, demographic_type, population_group, state
+        ),
+        xlabel="{}".format(sam_type),
+        ncols=ncols,
+        value_labels=True,
+    )
+    return fig
+
+
+def plot_prevalence_facets(
+    df, prevalence_type, demographic_type, population_group, ncols=4
+):
+    """
+    Creates a grid of horizontal bar plots of the prevalence of the perscribed
+    prevalence type by BMI category, one panel for each value of the demographic, on
+    shared axes, with standard errors as error bars.
+
+    Parameters:
+    df: Data frame created using create_prevalence_df() function, or a PlotData of it
+    prevalence_type: type of prevalence, expected Values ['Crude', 'Age-Adjusted', 'Weighted']
+    demographic_type: Demographic that they are comparing, expected values ['sex', 'race', 'age', 'zcta3']
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    ncols: Number of panels per row
+
+    Returns:
+    The matplotlib Figure, shown by interact() or as the result of a notebook cell.
+    """
+    (values, errors), state = _facet_data(
+        df,
+        demographic_type,
+        prevalence_type,
+        population_group,
+        ["Prevalence", "Standard Error"],
+    )
+    fig = draw_facets(
+        values.to_numpy(),
+        values.index,
+        WEIGHT_CATEGORY_LABELS[population_group][: values.shape[1]],
+        errors=errors.to_numpy(),
+        title="BMI Category {} Prevalence by {} for {} Data in {}".format(
+            prevalence_type, demographic_type, population_group, state
+        ),
+        xlabel="Prevalence",
+        ncols=ncols,
+    )
+    return fig
@@ -0,0 +1,280 @@
+"""
+A small reactive computation graph for the notebook's derived data.
+
+Inputs hold values set from outside, such as the dropdown selections of the
+notebook. Nodes compute a value from other inputs and nodes, and cache it. Setting
+an input to a new value invalidates only the nodes downstream of it; they are
+recomputed the next time they are read, while every other node keeps its cached
+value. Changing demographic_type, for example, reruns the suppression check and
+redraws the plots, but does not ingest the results or rebuild the plot data.
+
+    graph = reactive.notebook_graph(results_folder, "Pediatric", "zcta3", "NC")
+    graph.get("suppression")
+    graph.set("demographic_type", "sex")   # only dependents of demographic_type rerun
+    graph.link(dropdown, "demographic_type")
+"""
+
+import threading
+
+from . import check_suppressed, create_dataframes, maps, plots
+from .cube import cube_or_frame
+
+
+def _same(old, new):
+    """
+    Check whether a new input value equals the old one. Values that cannot be
+    compared to a single bool, such as DataFrames, are the same only if identical.
+    """
+    if old is new:
+        return True
+    try:
+        return bool(old == new)
+    except (TypeError, ValueError):
+        return False
+
+
+class Graph:
+    """
+    A graph of named inputs and cached nodes with explicit dependencies.
+
+    Each node keeps its value until one of its upstream inputs changes. Watchers
+    registered with watch() are called with the new value of a node after a change
+    invalidates it, so displays stay current without rerunning everything.
+    """
+
+    def __init__(self):
+        self._inputs = {}
+        self._nodes = {}
+        self._values = {}
+        self._dependents = {}
+        self._watchers = {}
+        self._lock = threading.RLock()
+        # Number of times each node has been computed
+        self.computations = {}
+
+    def input(self, name, value=None):
+        """Add an input with an initial value."""
+        with self._lock:
+            self._check_new(name)
+            self._inputs[name] = value
+            self._dependents[name] = set()
+        return self
+
+    def node(self, name, func, deps):
+        """
+        Add a node computing func(*values of deps). Dependencies must already exist.
+        """
+        with self._lock:
+            self._check_new(name)
+            for dep in deps:
+                if dep not in self._dependents:
+                    raise KeyError(f"Unknown dependency {dep!r} of node {name!r}")
+            self._nodes[name] = (func, list(deps))
+            self._dependents[name] = set()
+            for dep in deps:
+                self._dependents[dep].add(name)
+            self.computations[name] = 0
+        return self
+
+    def _check_new(self, name):
+        if name in self._dependents:
+            raise ValueError(f"{name!r} is already in the graph")
+
+    def get(self, name):
+        """Return the value of an input, or of a node, computing it if invalid."""
+        with self._lock:
+            if name in self._inputs:
+                return self._inputs[name]
+            if name not in self._values:
+                func, deps = self._nodes[name]
+                self._values[name] = func(*(self.get(dep) for dep in deps))
+                self.computations[name] += 1
+            return self._values[name]
+
+    def set(self, name, value):
+        """
+        Set an input. If the value changed, invalidate the nodes downstream of it
+        and call the watchers of any invalidated node with its new value.
+
+        Returns:
+        The set of names of the invalidated nodes.
+        """
+        with self._lock:
+            if name not in self._inputs:
+                raise KeyError(f"Unknown input {name!r}")
+            if _same(self._inputs[name], value):
+                return set()
+            self._inputs[name] = value
+            invalidated = self.downstream(name)
+            for node in invalidated:
+                self._values.pop(node, None)
+            watchers = [
+                (node, callback)
+                for node in invalidated
+                for callback in self._watchers.get(node, [])
+            ]
+        for node, callback in watchers:
+            callback(self.get(node))
+        return invalidated
+
+    def update(self, **values):
+        """Set several inputs at once; returns the set of invalidated nodes."""
+        invalidated = set()
+        for name, value in values.items():
+            invalidated |= self.set(name, value)
+        return invalidated
+
+    def downstream(self, name):
+        """Return the names of every node that depends on name, directly or not."""
+        found = set()
+        stack = [name]
+        while stack:
+            for dependent in self._dependents[stack.pop()]:
+                if dependent not in found:
+                    found.add(dependent)
+                    stack.append(dependent)
+        return found
+
+    def is_valid(self, name):
+        """Check whether a node has a cached value."""
+        return name in self._inputs or name in self._values
+
+    def watch(self, name, callback):
+        """Call callback(value) whenever a change invalidates a node."""
+        with self._lock:
+            self._watchers.setdefault(name, []).append(callback)
+
+    def link(self, widget, name):
+        """
+        Set an input from the value of an ipywidgets widget whenever it changes,
+        starting from the widget's current value.
+        """
+        self.set(name, widget.value)
+        widget.observe(lambda change: self.set(name, change["new"]), names="value")
+
+
+def _prevalence_plot(
+    plot_data, demographic_type, selected_demo, prevalence_type, population_group
+):
+    # No plot until a demographic value with rows is selected
+    if selected_demo is None:
+        return None
+    rows = plots.plot_rows(
+        plot_data, demographic_type, selected_demo, prevalence_type, population_group
+    )
+    if rows.empty:
+        return None
+    # A renderer of its own, so the cached figure is not redrawn by other plots
+    return plots.prevalence_figure(
+        rows, selected_demo, prevalence_type, population_group, plots.BarPlotRenderer()
+    )
+
+
+def _pop_plot(plot_data, demographic_type, selected_demo, sam_type, population_group):
+    if selected_demo is None:
+        return None
+    rows = plots.plot_rows(
+        plot_data, demographic_type, selected_demo, sam_type, population_group
+    )
+    if rows.empty:
+        return None
+    return plots.pop_figure(
+        rows, selected_demo, sam_type, population_group, plots.BarPlotRenderer()
+    )
+
+
+def notebook_graph(
+    results_folder,
+    population_group,
+    demographic_type,
+    selected_state,
+    selected_demo=None,
+    prevalence_type="Crude",
+    sam_type="Sample",
+    category=None,
+):
+    """
+    Build the graph of the notebook's data: the ingested prevalence and population
+    frames, their plot data, the cube of both (see cube.py), the suppression
+    table, the suppressed ZCTA3s of the selected category and prevalence type, the
+    boundaries and map values of the selected state, and the prevalence and
+    population plots of the selected demographic value. The suppression table,
+    suppressed ZCTA3s and map values are read from the cube.
+
+    Parameters:
+    results_folder: Folder of CODI-PQ outputs
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    demographic_type: Demographic to compare, expected values ['sex', 'race', 'age', 'zcta3']
+    selected_state: Two-letter state abbreviation
+    selected_demo: Demographic value to plot; the plot nodes are None until a value
+        with data is selected
+    prevalence_type: Prevalence type to plot and map, one of ['Age-Adjusted', 'Crude', 'Weighted']
+    sam_type: Population type to plot, one of ['Population', 'Sample']
+    category: Weight category to map
+
+    Returns:
+    A Graph with those parameters as inputs.
+    """
+    graph = Graph()
+    graph.input("results_folder", results_folder)
+    graph.input("population_group", population_group)
+    graph.input("demographic_type", demographic_type)
+    graph.input("selected_state", selected_state)
+    graph.input("selected_demo", selected_demo)
+    graph.input("prevalence_type", prevalence_type)
+    graph.input("sam_type", sam_type)
+    graph.input("category", category)
+    graph.node(
+        "prev_data",
+        create_dataframes.create_prevalence_df,
+        ["results_folder", "population_group"],
+    )
+    graph.node(
+        "pop_data",
+        create_dataframes.create_population_df,
+        ["results_folder", "population_group"],
+    )
+    graph.node("cube", cube_or_frame, ["prev_data", "pop_data"])
+    # Plot data groups by each demographic type on first use, so it is built once
+    # per dataset rather than again for every demographic type
+    graph.node("prev_plot_data", plots.PlotData, ["prev_data"])
+    graph.node("pop_plot_data", plots.PlotData, ["pop_data"])
+    graph.node(
+        "suppression",
+        check_suppressed.check_suppressed,
+        ["cube", "demographic_type"],
+    )
+    graph.node(
+        "suppressed_zcta3s",
+        check_suppressed.suppressed_zcta3,
+        ["cube", "category", "prevalence_type"],
+    )
+    graph.node("state_boundaries", maps.load_state_boundaries, ["selected_state"])
+    graph.node(
+        "map_values",
+        maps.state_prevalence_values,
+        ["selected_state", "cube", "category", "prevalence_type"],
+    )
+    graph.node(
+        "prevalence_plot",
+        _prevalence_plot,
+        [
+            "prev_plot_data",
+            "demographic_type",
+            "selected_demo",
+            "prevalence_type",
+            "population_group",
+        ],
+    )
+    graph.node(
+        "pop_plot",
+        _pop_plot,
+        [
+            "pop_plot_data",
+            "demographic_type",
+            "selected_demo",
+            "sam_type",
+            "population_group",
+        ],
+    )
+    return graph
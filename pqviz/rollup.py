@@ -0,0 +1,365 @@
+"""
+Population-weighted roll-up of ZCTA3 prevalence to states and custom regions.
+
+A region's prevalence is the average of its ZCTA3s' prevalence, weighted by
+their populations; ZCTA3s with suppressed values are left out of the regions
+they belong to, and so are results of combined geographies, such as "270,271",
+whose people are counted in their ZCTA3s. Standard errors are propagated
+treating the ZCTA3 estimates as independent:
+
+    p_region = sum(w_i * p_i) / sum(w_i)
+    se_region = sqrt(sum(w_i ** 2 * se_i ** 2)) / sum(w_i)
+
+Regions are described by a sparse membership matrix with a row per region and a
+column per ZCTA3, holding the share of each ZCTA3 that belongs to the region
+(1 unless a region file says otherwise). The prevalence of every weight
+category, prevalence type and demographic is laid out as the columns of one
+ZCTA3 x column array, so all of them are rolled up by one sparse matrix product.
+
+Custom regions are read from a csv file with a zcta3 column, a region column,
+and optionally a share column:
+
+    zcta3,region,share
+    270,Piedmont,1
+    271,Piedmont,0.5
+    271,Coastal Plain,0.5
+
+    regions = rollup.load_regions("regions.csv")
+    rollup.rollup(prev_data, pop_data, regions)
+
+The CDC PLACES measures, reported by ZCTA5, are rolled up to ZCTA3 the same way,
+weighted by the TotalPopulation of each ZCTA5, so they can be joined to ZCTA3
+prevalence and correlated with it:
+
+    rollup.places_correlations(prev_data)
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from . import maps
+from .common import restore_states
+
+
+# Demographic columns that, with weight category and prevalence type, identify
+# a prevalence estimate of a ZCTA3
+ESTIMATE_COLUMNS = ["Weight Category", "Prevalence type", "sex", "race", "age", "year"]
+
+# Prevalence types whose values are shares of the weighted population, used to
+# estimate the population of each ZCTA3, in order of preference
+POPULATION_PREVALENCE_TYPES = ["Weighted", "Crude"]
+
+
+def _zcta3_rows(prev_data):
+    """
+    Return the rows of single ZCTA3s. Rows of whole states and of combined
+    geographies, such as "270,271" or ZCTA3s of two states without a single
+    state, are left out, as their people are already counted in the ZCTA3s they
+    combine.
+    """
+    zcta3 = prev_data["zcta3"]
+    single = zcta3.notna() & ~zcta3.astype(str).str.contains(",", regex=False)
+    return prev_data.loc[single & prev_data["state"].notna()]
+
+
+def state_regions(prev_data):
+    """
+    Return the membership of each ZCTA3 in its state, from the state of the rows
+    reporting it, in the form of load_regions().
+    """
+    rows = _zcta3_rows(prev_data)[["zcta3", "state"]]
+    regions = pd.DataFrame(
+        {
+            "zcta3": rows["zcta3"].astype(str),
+            "region": [getattr(s, "abbr", s) for s in rows["state"]],
+        }
+    ).drop_duplicates()
+    return regions.assign(share=1.0).reset_index(drop=True)
+
+
+def load_regions(fname):
+    """
+    Read a region file: a csv with zcta3 and region columns, and optionally a share
+    column giving the share of a ZCTA3's population in the region (default 1).
+
+    Returns:
+    A DataFrame with zcta3, region and share columns.
+    """
+    regions = pd.read_csv(fname, dtype={"zcta3": str, "region": str})
+    missing = {"zcta3", "region"}.difference(regions.columns)
+    if missing:
+        raise ValueError(f"Region file {fname} is missing columns {sorted(missing)}")
+    if "share" not in regions.columns:
+        regions["share"] = 1.0
+    regions["zcta3"] = regions["zcta3"].str.zfill(3)
+    return regions[["zcta3", "region", "share"]]
+
+
+def membership_matrix(regions, zcta3s):
+    """
+    Build the sparse membership matrix of regions over ZCTA3s.
+
+    Parameters:
+    regions: DataFrame with zcta3, region and share columns
+    zcta3s: Array of the ZCTA3s of the columns, in order
+
+    Returns:
+    A CSR matrix of shape (regions, ZCTA3s), and the array of region labels of
+    its rows. Region rows for ZCTA3s not in zcta3s are ignored.
+    """
+    region_labels, region_codes = np.unique(
+        regions["region"].astype(str), return_inverse=True
+    )
+    zcta3_codes = pd.Index(zcta3s).get_indexer(regions["zcta3"])
+    found = zcta3_codes >= 0
+    matrix = sparse.csr_matrix(
+        (
+            regions["share"].to_numpy(dtype=float)[found],
+            (region_codes[found], zcta3_codes[found]),
+        ),
+        shape=(len(region_labels), len(zcta3s)),
+    )
+    return matrix, region_labels
+
+
+def zcta3_populations(prev_data, pop_data, population_type="Population"):
+    """
+    Estimate the population of each ZCTA3 and demographic. Each weight category's
+    population count is divided by its prevalence, as a share, and the ratio is
+    taken over all categories with both values.
+
+    Parameters:
+    prev_data: DataFrame created using create_prevalence_df()
+    pop_data: DataFrame created using create_population_df()
+    population_type: 'Population' for the weighted population, estimated with
+        the weighted prevalence, or 'Sample' for the sample size, estimated with
+        the crude prevalence
+
+    Returns:
+    A Series of populations indexed by zcta3, sex, race, age and year.
+    """
+    keys = ["Weight Category", "zcta3", "sex", "race", "age", "year"]
+    counts = pop_data.loc[pop_data["Population type"] == population_type]
+    counts = counts.groupby(keys, observed=True)["Population"].mean()
+
+    prevalence = prev_data.assign(Prevalence=pd.to_numeric(prev_data["Prevalence"]))
+    preferred = (
+        ["Crude"] if population_type == "Sample" else POPULATION_PREVALENCE_TYPES
+    )
+    types = [t for t in preferred if t in set(prevalence["Prevalence type"])]
+    if not types:
+        raise ValueError(f"{population_type} counts need one of {preferred} prevalence")
+    prevalence = prevalence.loc[prevalence["Prevalence type"] == types[0]]
+    shares = prevalence.groupby(keys, observed=True)["Prevalence"].mean() / 100
+
+    both = pd.concat({"count": counts, "share": shares}, axis=1).dropna()
+    totals = both.groupby(keys[1:], observed=True).sum()
+    return (totals["count"] / totals["share"]).rename("Population")
+
+
+def rollup(prev_data, pop_data, regions=None):
+    """
+    Roll up ZCTA3 prevalence to regions, weighted by population, for every weight
+    category, prevalence type and demographic at once.
+
+    Parameters:
+    prev_data: DataFrame created using create_prevalence_df() from ZCTA3 results
+    pop_data: DataFrame created using create_population_df() from the same results
+    regions: DataFrame of region membership from load_regions(), or a region
+        file to read with it; defaults to the states of the ZCTA3s
+
+    Returns:
+    A DataFrame with a row per region and estimate: the region, the columns of
+    ESTIMATE_COLUMNS, Prevalence, Standard Error, the population of the ZCTA3s
+    with values, the share of the region's population they cover, and their
+    number. States are us.State objects when rolling up to states.
+    """
+    by_state = regions is None
+    if by_state:
+        regions = state_regions(prev_data)
+    elif not isinstance(regions, pd.DataFrame):
+        regions = load_regions(regions)
+
+    rows = _zcta3_rows(prev_data)
+    rows = rows.assign(
+        zcta3=rows["zcta3"].astype(str),
+        Prevalence=pd.to_numeric(rows["Prevalence"]),
+        **{"Standard Error": pd.to_numeric(rows["Standard Error"])},
+    )
+    # ZCTA3 x estimate arrays; duplicate rows are averaged as in the bar plots
+    prevalence = rows.pivot_table(
+        "Prevalence", "zcta3", ESTIMATE_COLUMNS, aggfunc="mean", observed=True
+    )
+    se = rows.pivot_table(
+        "Standard Error", "zcta3", ESTIMATE_COLUMNS, aggfunc="mean", observed=True
+    ).reindex_like(prevalence)
+
+    # Population of each ZCTA3 for the demographics of each column
+    populations = zcta3_populations(rows, pop_data).unstack(
+        ["sex", "race", "age", "year"]
+    )
+    columns = prevalence.columns.droplevel(["Weight Category", "Prevalence type"])
+    weights = populations.reindex(index=prevalence.index, columns=columns).to_numpy()
+
+    has_value = ~np.isnan(prevalence.to_numpy()) & ~np.isnan(weights)
+    w = np.where(has_value, weights, 0.0)
+    p = np.where(has_value, prevalence.to_numpy(), 0.0)
+    v = np.where(has_value, np.nan_to_num(se.to_numpy()) ** 2, 0.0)
+    all_w = np.nan_to_num(weights)
+
+    matrix, region_labels = membership_matrix(regions, prevalence.index)
+    weight_sum = matrix @ w
+    with np.errstate(invalid="ignore", divide="ignore"):
+        region_prevalence = (matrix @ (w * p)) / weight_sum
+        region_se = np.sqrt(matrix.multiply(matrix) @ (w**2 * v)) / weight_sum
+        coverage = weight_sum / (matrix @ all_w)
+    counts = (matrix > 0).astype(float) @ has_value.astype(float)
+
+    index = pd.MultiIndex.from_product(
+        [region_labels, range(len(prevalence.columns))], names=["region", "column"]
+    )
+    result = pd.DataFrame(
+        {
+            "Prevalence": region_prevalence.ravel(),
+            "Standard Error": region_se.ravel(),
+            "Population": weight_sum.ravel(),
+            "Coverage": coverage.ravel(),
+            "ZCTA3s": counts.ravel().astype(int),
+        },
+        index=index,
+    )
+    result = result.loc[result["ZCTA3s"] > 0].reset_index()
+    estimates = prevalence.columns.to_frame(index=False)
+    result = pd.concat(
+        [
+            result[["region"]],
+            estimates.iloc[result["column"]].reset_index(drop=True),
+            result.drop(columns=["region", "column"]),
+        ],
+        axis=1,
+    )
+    if by_state:
+        result = restore_states(result.rename(columns={"region": "state"}))
+    return result
+
+
+def aggregate_places(places):
+    """
+    Roll up CDC PLACES measures from ZCTA5 to ZCTA3. Each measure of
+    PLACES_MEASURES is averaged over the ZCTA5s of a ZCTA3 with a value for it,
+    weighted by their TotalPopulation; TotalPopulation itself is summed.
+
+    Parameters:
+    places: DataFrame of CDC PLACES data, as from maps.load_places()
+
+    Returns:
+    A DataFrame indexed by zcta3 with a column for each measure.
+    """
+    zcta3s, codes = np.unique(
+        places["ZCTA5"].astype(str).str.zfill(5).str[:3].to_numpy(),
+        return_inverse=True,
+    )
+    # ZCTA3 x ZCTA5 membership, to sum every measure at once
+    matrix = sparse.csr_matrix(
+        (np.ones(len(codes)), (codes, np.arange(len(codes)))),
+        shape=(len(zcta3s), len(codes)),
+    )
+    population = pd.to_numeric(places["TotalPopulation"], errors="coerce")
+    population = np.nan_to_num(population.to_numpy(dtype=float))
+    names = [name for _, name, _ in maps.PLACES_MEASURES if name != "TotalPopulation"]
+    values = places[names].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+
+    has_value = ~np.isnan(values)
+    weights = np.where(has_value, population[:, None], 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (matrix @ (weights * np.nan_to_num(values))) / (matrix @ weights)
+    result = pd.DataFrame(means, index=pd.Index(zcta3s, name="zcta3"), columns=names)
+    result.insert(0, "TotalPopulation", matrix @ population)
+    return result
+
+
+@lru_cache(maxsize=1)
+def places_zcta3():
+    """
+    Return the CDC PLACES measures rolled up to ZCTA3, loading the PLACES data on
+    first use. The result is cached, so callers must not modify it in place.
+    """
+    return aggregate_places(maps.load_places())
+
+
+def join_places(prev_data, places=None):
+    """
+    Join the CDC PLACES measures of each ZCTA3 to the rows of a prevalence frame.
+
+    Parameters:
+    prev_data: DataFrame created using create_prevalence_df() from ZCTA3 results
+    places: PLACES measures by ZCTA3, as from aggregate_places(); defaults to
+        places_zcta3()
+
+    Returns:
+    A copy of prev_data with a column for each PLACES measure.
+    """
+    places = places_zcta3() if places is None else places
+    measures = places.reindex(prev_data["zcta3"].astype(str).to_numpy())
+    return pd.concat(
+        [prev_data.reset_index(drop=True), measures.reset_index(drop=True)], axis=1
+    )
+
+
+def places_correlations(prev_data, places=None):
+    """
+    Correlate the prevalence of each weight category and prevalence type with
+    every CDC PLACES measure across ZCTA3s, in one pass. Pearson correlations are
+    taken over the ZCTA3s with both values, using sums over the masked arrays, so
+    suppressed ZCTA3s only drop out of the pairs they are missing from.
+
+    Parameters:
+    prev_data: DataFrame created using create_prevalence_df() from ZCTA3 results
+    places: PLACES measures by ZCTA3, as from aggregate_places(); defaults to
+        places_zcta3()
+
+    Returns:
+    A DataFrame with a row per weight category, prevalence type and measure: the
+    correlation and the number of ZCTA3s it was computed over.
+    """
+    places = places_zcta3() if places is None else places
+    rows = _zcta3_rows(prev_data)
+    prevalence = rows.assign(
+        zcta3=rows["zcta3"].astype(str),
+        Prevalence=pd.to_numeric(rows["Prevalence"]),
+    ).pivot_table(
+        "Prevalence",
+        "zcta3",
+        ["Weight Category", "Prevalence type"],
+        aggfunc="mean",
+        observed=True,
+    )
+    x = prevalence.to_numpy(dtype=float)
+    y = places.reindex(prevalence.index).to_numpy(dtype=float)
+    x_mask = (~np.isnan(x)).astype(float)
+    y_mask = (~np.isnan(y)).astype(float)
+    x = np.nan_to_num(x)
+    y = np.nan_to_num(y)
+
+    # Sums over the ZCTA3s where both values are present, for every pair at once
+    n = x_mask.T @ y_mask
+    sum_x = x.T @ y_mask
+    sum_y = x_mask.T @ y
+    sum_xx = (x**2).T @ y_mask
+    sum_yy = x_mask.T @ y**2
+    sum_xy = x.T @ y
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = (n * sum_xy - sum_x * sum_y) / np.sqrt(
+            (n * sum_xx - sum_x**2) * (n * sum_yy - sum_y**2)
+        )
+
+    estimates = prevalence.columns.to_frame(index=False)
+    result = estimates.loc[estimates.index.repeat(len(places.columns))]
+    return result.reset_index(drop=True).assign(
+        measure=np.tile(places.columns, len(estimates)),
+        correlation=r.ravel(),
+        ZCTA3s=n.ravel().astype(int),
+    )
@@ -0,0 +1,394 @@
+"""
+Local HTTP query service over one shared, in-memory copy of a PQ results folder.
+
+The prevalence and population data of a results folder are ingested and indexed
+once, when the server starts, and answered to any number of clients from memory.
+Requests are handled with asyncio, with the slower work (filtering, plotting) run
+in a thread pool, and responses are kept in a bounded cache so repeat queries are
+answered without any computation. Endpoints, all GET:
+
+    /                                   list of endpoints
+    /prevalence?<column>=<value>...     prevalence rows matching every filter
+    /population?<column>=<value>...     population rows matching every filter
+    /suppression?demographic_type=race  suppressed values by weight category
+    /choropleth/<state>?category=...&prevalence_type=...
+                                        prevalence of each ZCTA5 in a state
+    /places/<state>?measure=Obesity_CrudePrev
+                                        a CDC PLACES measure of each ZCTA5 in a state
+    /plots/prevalence.png?demographic_type=...&selected_demo=...&prevalence_type=...
+    /plots/population.png?demographic_type=...&selected_demo=...&sam_type=...
+                                        rendered plots
+
+Run as a subcommand of the pqviz entry point:
+
+    python -m pqviz serve sample_data/zcta3 --port 8766
+"""
+
+import asyncio
+from collections import OrderedDict
+import io
+import json
+import threading
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import numpy as np
+import pandas as pd
+import us
+
+from . import check_suppressed, create_dataframes, maps, plots
+from .crosswalk import load_crosswalk
+
+
+SERVER_PORT = 8766
+
+# Number of responses held in the response cache
+RESPONSE_CACHE_SIZE = 1024
+
+# Columns of the prevalence and population tables indexed at load, for filters
+INDEXED_COLUMNS = ["state", "Weight Category", "Prevalence type", "Population type"]
+
+ENDPOINTS = [
+    "/prevalence",
+    "/population",
+    "/suppression",
+    "/choropleth/<state>",
+    "/places/<state>",
+    "/plots/prevalence.png",
+    "/plots/population.png",
+]
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+class QueryError(Exception):
+    """A request that cannot be answered, with the HTTP status to answer it with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _filter_values(df, column):
+    """Return the values of a column as the text filters are compared with."""
+    if column == "state":
+        return df["state"].map(lambda s: getattr(s, "abbr", s)).astype(str)
+    return df[column].astype(str)
+
+
+def _numeric(df, columns):
+    """Return a copy of a frame with the given columns converted to numbers."""
+    return df.assign(**{column: pd.to_numeric(df[column]) for column in columns})
+
+
+def _records(df):
+    """Convert rows to JSON-ready records, with states as abbreviations."""
+    df = df.copy()
+    if "state" in df.columns:
+        df["state"] = [getattr(s, "abbr", s) for s in df["state"]]
+    df = df.astype(object).where(df.notna(), None)
+    return df.to_dict(orient="records")
+
+
+class Dataset:
+    """
+    The prevalence and population data of a results folder, ingested once and
+    indexed for queries: values as numbers, NaN where suppressed, the positions of the rows of each
+    value of INDEXED_COLUMNS, and plot data grouped by demographic. CDC PLACES
+    data is loaded on first use.
+
+    Parameters:
+    results_folder: Folder of CODI-PQ outputs
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    """
+
+    def __init__(self, results_folder, population_group):
+        self.population_group = population_group
+        self.prev_data = create_dataframes.create_prevalence_df(
+            results_folder, population_group
+        )
+        self.pop_data = create_dataframes.create_population_df(
+            results_folder, population_group
+        )
+        self.prev_plot_data = plots.PlotData(self.prev_data)
+        self.pop_plot_data = plots.PlotData(self.pop_data)
+        # Values as numbers, keeping suppressed values NaN so they are sent as null
+        self.tables = {
+            "prevalence": _numeric(
+                self.prev_data, ["Prevalence", "Standard Error"]
+            ).assign(Suppressed=self.prev_data["Prevalence"].isna()),
+            "population": _numeric(self.pop_data, ["Population"]),
+        }
+        # Positions of the rows of each value of the indexed columns, by table
+        self.indexes = {
+            table: {
+                column: df.groupby(
+                    _filter_values(df, column).to_numpy(), sort=False
+                ).indices
+                for column in INDEXED_COLUMNS
+                if column in df.columns
+            }
+            for table, df in self.tables.items()
+        }
+        self._places = None
+        # Matplotlib is not thread-safe, so plots are drawn one at a time
+        self._plot_lock = threading.Lock()
+        self._places_lock = threading.Lock()
+
+    @property
+    def places(self):
+        with self._places_lock:
+            if self._places is None:
+                try:
+                    self._places = maps.load_places()
+                except FileNotFoundError:
+                    raise QueryError("CDC PLACES data is not available", 404)
+            return self._places
+
+    def rows(self, table, filters):
+        """
+        Return the rows of a table matching every column=value filter. Filters on
+        indexed columns select rows by position; any others are compared only
+        over the rows those select.
+        """
+        df = self.tables[table]
+        indexes = self.indexes[table]
+        positions = np.arange(len(df))
+        for column, value in filters.items():
+            if column not in df.columns:
+                raise QueryError(f"Unknown column {column!r}")
+            if column in indexes:
+                matches = indexes[column].get(value, np.array([], dtype=np.intp))
+                positions = np.intersect1d(positions, matches, assume_unique=True)
+        rows = df.iloc[positions]
+        for column, value in filters.items():
+            if column not in indexes:
+                rows = rows.loc[_filter_values(rows, column).to_numpy() == value]
+        return _records(rows)
+
+    def suppression(self, demographic_type):
+        if demographic_type not in self.prev_data.columns:
+            raise QueryError(f"Unknown demographic type {demographic_type!r}")
+        table = check_suppressed.check_suppressed(self.prev_data, demographic_type)
+        return [] if table is None else _records(table)
+
+    def choropleth(self, selected_state, category, prevalence_type):
+        if us.states.lookup(selected_state) is None:
+            raise QueryError(f"Unknown state {selected_state!r}", 404)
+        valmap, suppressed_zcta3s = maps.state_prevalence_values(
+            selected_state, self.prev_data, category, prevalence_type
+        )
+        return {
+            "state": selected_state,
+            "category": category,
+            "prevalence_type": prevalence_type,
+            "values": valmap,
+            "suppressed_zcta3s": suppressed_zcta3s,
+        }
+
+    def places_values(self, selected_state, measure):
+        # Accept the display name of a measure as well as its column name
+        names = {display: name for display, name, _ in maps.PLACES_MEASURES}
+        measure = names.get(measure, measure)
+        places = self.places
+        if measure not in places.columns:
+            raise QueryError(f"Unknown PLACES measure {measure!r}")
+        zctas = load_crosswalk().state_zcta5s(selected_state.upper())
+        rows = places.loc[places["ZCTA5"].isin(zctas)]
+        values = pd.to_numeric(rows[measure], errors="coerce")
+        return {
+            "state": selected_state,
+            "measure": measure,
+            "values": dict(zip(rows["ZCTA5"], values)),
+        }
+
+    def plot(self, kind, demographic_type, selected_demo, sample_type):
+        plot_data = self.prev_plot_data if kind == "prevalence" else self.pop_plot_data
+        if demographic_type not in plot_data.df.columns:
+            raise QueryError(f"Unknown demographic type {demographic_type!r}")
+        rows = plots.plot_rows(
+            plot_data,
+            demographic_type,
+            selected_demo,
+            sample_type,
+            self.population_group,
+        )
+        if rows.empty:
+            raise QueryError("No data for this plot", 404)
+        draw = plots.prevalence_figure if kind == "prevalence" else plots.pop_figure
+        with self._plot_lock:
+            fig = draw(
+                rows,
+                selected_demo,
+                sample_type,
+                self.population_group,
+                plots.BarPlotRenderer(),
+            )
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", bbox_inches="tight")
+        return buf.getvalue()
+
+
+def _require(params, *names):
+    missing = [name for name in names if name not in params]
+    if missing:
+        raise QueryError(f"Missing parameters: {', '.join(missing)}")
+    return [params[name] for name in names]
+
+
+def answer(dataset, path, params):
+    """
+    Answer one request against a dataset.
+
+    Returns:
+    The response body as bytes and its content type.
+    """
+    parts = [unquote(p) for p in path.strip("/").split("/") if p]
+    if not parts:
+        body = {"endpoints": ENDPOINTS}
+    elif parts == ["prevalence"] or parts == ["population"]:
+        body = dataset.rows(parts[0], params)
+    elif parts == ["suppression"]:
+        (demographic_type,) = _require(params, "demographic_type")
+        body = dataset.suppression(demographic_type)
+    elif len(parts) == 2 and parts[0] == "choropleth":
+        category, prevalence_type = _require(params, "category", "prevalence_type")
+        body = dataset.choropleth(parts[1], category, prevalence_type)
+    elif len(parts) == 2 and parts[0] == "places":
+        (measure,) = _require(params, "measure")
+        body = dataset.places_values(parts[1], measure)
+    elif parts == ["plots", "prevalence.png"]:
+        args = _require(params, "demographic_type", "selected_demo", "prevalence_type")
+        return dataset.plot("prevalence", *args), "image/png"
+    elif parts == ["plots", "population.png"]:
+        args = _require(params, "demographic_type", "selected_demo", "sam_type")
+        return dataset.plot("population", *args), "image/png"
+    else:
+        raise QueryError(f"Unknown endpoint {path!r}", 404)
+    return json.dumps(body, default=str).encode(), "application/json"
+
+
+class QueryServer:
+    """
+    Asyncio HTTP/1.1 server answering queries against one Dataset, caching the
+    most recently used responses.
+    """
+
+    def __init__(self, dataset, cache_size=RESPONSE_CACHE_SIZE):
+        self.dataset = dataset
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    async def respond(self, method, target):
+        if method != "GET":
+            raise QueryError("Only GET is supported", 405)
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        key = (url.path, tuple(sorted(params.items())))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(
+            None, answer, self.dataset, url.path, params
+        )
+        self.cache[key] = response
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return response
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                # Skip the body of a request, which is not read, so that it is not
+                # taken for the next request; a body of unknown length, as when
+                # chunked, ends the connection after the response
+                keep_alive = headers.get("connection", "").lower() != "close"
+                length = headers.get("content-length", "0")
+                if "transfer-encoding" in headers or not length.isdigit():
+                    keep_alive = False
+                else:
+                    length = int(length)
+                    while length > 0:
+                        chunk = await reader.read(min(length, 65536))
+                        if not chunk:
+                            break
+                        length -= len(chunk)
+
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                    status = 200
+                    body, content_type = await self.respond(method, target)
+                except QueryError as e:
+                    status = e.status
+                    body = json.dumps({"error": str(e)}).encode()
+                    content_type = "application/json"
+                except ValueError:
+                    status = 400
+                    body = json.dumps({"error": "Malformed request"}).encode()
+                    content_type = "application/json"
+                except Exception as e:
+                    status = 500
+                    body = json.dumps({"error": repr(e)}).encode()
+                    content_type = "application/json"
+
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+                        f"Content-Type: {content_type}\r\n"
+                        f"Content-Length: {len(body)}\r\n"
+                        "Access-Control-Allow-Origin: *\r\n"
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="localhost", port=SERVER_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving PQ queries at http://{host}:{port}/")
+        async with server:
+            await server.serve_forever()
+
+
+def serve(
+    results_folder, population_group="Pediatric", host="localhost", port=SERVER_PORT
+):
+    """
+    Ingest a results folder and serve queries against it until interrupted.
+
+    Parameters:
+    results_folder: Folder of CODI-PQ outputs
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    host: Interface to listen on
+    port: Port to listen on
+    """
+    dataset = Dataset(results_folder, population_group)
+    try:
+        asyncio.run(QueryServer(dataset).serve(host, port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,302 @@
+"""
+Neighboring ZCTAs within a state, and spatial smoothing of ZCTA3 prevalence.
+
+Two ZCTAs are neighbors when their boundaries touch or overlap. Candidate pairs
+come from a query of the state's spatial index (an STRtree over the boundary
+bounding boxes), so only ZCTAs whose boxes intersect are tested against each
+other, rather than every pair in the state. The ZCTA5 adjacency is held as a
+sparse matrix and stored in a binary sidecar next to the state's boundary file,
+rebuilt whenever the boundary file is newer. Two ZCTA3s are neighbors when any
+of their ZCTA5s are:
+
+    A3 = M @ A5 @ M.T     (M: ZCTA3 x ZCTA5 membership)
+
+Prevalence of small ZCTA3s is noisy. It is smoothed with a local empirical
+Bayes estimate: each ZCTA3's prevalence is shrunk toward the mean of its
+neighborhood (itself and its neighbors), weighted by sample size, and more so
+the smaller its own sample is relative to the spread of the neighborhood. With
+p_j the prevalence and n_j the sample size of each ZCTA3 j in the neighborhood
+of i, as shares:
+
+    m_i = sum(n_j * p_j) / sum(n_j)
+    prior_i = max(0, sum(n_j * p_j ** 2) / sum(n_j) - m_i ** 2 - m_i * (1 - m_i) / mean(n_j))
+    w_i = prior_i / (prior_i + m_i * (1 - m_i) / n_i)
+    smoothed_i = w_i * p_i + (1 - w_i) * m_i
+
+A suppressed or missing ZCTA3 has no p_i of its own and is estimated as m_i,
+the mean of its neighbors with values, when it has any.
+
+The sums over neighborhoods are products of the sparse adjacency with the
+ZCTA3 x column arrays of values, so every weight category and prevalence type
+is smoothed at once.
+
+    spatial.smooth_state("NC", cube)
+"""
+
+from functools import lru_cache
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import us
+
+from . import maps, rollup
+from .cube import MISSING, Cube
+
+
+# Levels of geography state_adjacency() can return
+ADJACENCY_LEVELS = ["zcta3", "zcta5"]
+
+
+def adjacency_fname(selected_state):
+    """Return the file of the ZCTA5 adjacency sidecar of a state."""
+    return maps.BOUNDARY_DIR / f"{selected_state}_adjacency.npz"
+
+
+def build_adjacency(selected_state):
+    """
+    Find the neighboring ZCTA5s of a state from its boundary file, using the
+    spatial index of the boundaries to find candidate pairs.
+
+    Parameters:
+    selected_state: Two-letter state abbreviation
+
+    Returns:
+    A sorted array of the state's ZCTA5s, and a symmetric CSR matrix over them
+    with 1 for each pair of neighbors.
+    """
+    zctas = gpd.GeoDataFrame.from_features(
+        maps.load_state_boundaries(selected_state)["features"], crs=maps.BOUNDARY_CRS
+    )
+    zctas = zctas.drop_duplicates("ZCTA5CE10").sort_values("ZCTA5CE10")
+    zctas = zctas.reset_index(drop=True)
+    zcta5s = zctas["ZCTA5CE10"].to_numpy(dtype="U5")
+    rows, cols = zctas.sindex.query(zctas.geometry, predicate="intersects")
+    pairs = rows != cols
+    return zcta5s, _symmetric(rows[pairs], cols[pairs], len(zcta5s))
+
+
+def _symmetric(rows, cols, n):
+    """Build a binary symmetric CSR matrix from pairs of positions."""
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(n, n), dtype=float
+    )
+    matrix = matrix + matrix.T
+    matrix.data[:] = 1.0
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def load_adjacency(selected_state):
+    """
+    Load the ZCTA5 adjacency of a state, from its sidecar if it is up to date, or
+    else from the boundary file, saving the sidecar for next time. Results are
+    cached, so callers must not modify them in place.
+
+    Returns:
+    A sorted array of the state's ZCTA5s, and their adjacency as a CSR matrix.
+    """
+    fname = adjacency_fname(selected_state)
+    boundary_fname = maps.BOUNDARY_DIR / f"{selected_state}_zctas.geojson.gz"
+    if fname.is_file() and fname.stat().st_mtime >= boundary_fname.stat().st_mtime:
+        with np.load(fname, allow_pickle=False) as arrays:
+            zcta5s = arrays["zcta5s"]
+            return zcta5s, _symmetric(arrays["rows"], arrays["cols"], len(zcta5s))
+
+    zcta5s, matrix = build_adjacency(selected_state)
+    upper = sparse.triu(matrix, k=1).tocoo()
+    try:
+        np.savez(
+            fname,
+            zcta5s=zcta5s,
+            rows=upper.row.astype(np.int32),
+            cols=upper.col.astype(np.int32),
+        )
+    except OSError:
+        # A read-only install can still use the adjacency, just without the sidecar
+        pass
+    return zcta5s, matrix
+
+
+@lru_cache(maxsize=None)
+def state_adjacency(selected_state, level="zcta3"):
+    """
+    Return the adjacency of the ZCTA3s or ZCTA5s of a state. Results are cached,
+    so callers must not modify them in place.
+
+    Parameters:
+    selected_state: State name or two-letter abbreviation
+    level: One of ADJACENCY_LEVELS
+
+    Returns:
+    A sorted array of the state's ZCTA3s or ZCTA5s, and a symmetric CSR matrix
+    over them with 1 for each pair of neighbors.
+    """
+    if level not in ADJACENCY_LEVELS:
+        raise ValueError(
+            f"Unknown adjacency level {level!r}, expected one of {ADJACENCY_LEVELS}"
+        )
+    zcta5s, matrix = load_adjacency(us.states.lookup(selected_state).abbr)
+    if level == "zcta5":
+        return zcta5s, matrix
+
+    zcta3s, codes = np.unique(zcta5s.astype("U3"), return_inverse=True)
+    membership = sparse.csr_matrix(
+        (np.ones(len(codes)), (codes, np.arange(len(codes)))),
+        shape=(len(zcta3s), len(codes)),
+    )
+    zcta3_matrix = (membership @ matrix @ membership.T).tocoo()
+    pairs = zcta3_matrix.row != zcta3_matrix.col
+    return zcta3s, _symmetric(
+        zcta3_matrix.row[pairs], zcta3_matrix.col[pairs], len(zcta3s)
+    )
+
+
+def zcta3_sample_sizes(df, pop_data=None):
+    """
+    Estimate the sample size of each ZCTA3: each weight category's sample count is
+    divided by its crude prevalence, as a share, and the ratio is taken over all
+    categories with both values.
+
+    Parameters:
+    df: DataFrame of prevalence data, or a Cube of prevalence and population data
+    pop_data: DataFrame created using create_population_df(), needed with a
+        DataFrame of prevalence data
+
+    Returns:
+    A Series of sample sizes indexed by zcta3.
+    """
+    if not isinstance(df, Cube):
+        if pop_data is None:
+            raise ValueError("Sample sizes need population data")
+        samples = rollup.zcta3_populations(df, pop_data, population_type="Sample")
+        return samples.groupby(level="zcta3").mean().rename("Sample")
+
+    if df.sample is None:
+        raise ValueError("Sample sizes need a Cube built with population data")
+    if df.code("type", "Crude") < 0:
+        raise ValueError("Sample counts need Crude prevalence")
+    keep = ["category", "zcta3"]
+    counts = df.reduce("sample", {}, keep)
+    shares = df.reduce("prevalence", {"type": "Crude"}, keep) / 100
+    both = ~np.isnan(counts) & ~np.isnan(shares)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        samples = np.where(both, counts, 0).sum(axis=0)
+        samples /= np.where(both, shares, 0).sum(axis=0)
+    zcta3s = df.axes["zcta3"]
+    valid = (zcta3s != MISSING) & np.isfinite(samples)
+    return pd.Series(samples[valid], index=zcta3s[valid], name="Sample")
+
+
+def empirical_bayes(prevalence, samples, adjacency):
+    """
+    Smooth prevalence over neighborhoods with the local empirical Bayes estimate
+    described above, for every column at once.
+
+    Parameters:
+    prevalence: Array of prevalence in percent, of shape (areas, columns), NaN
+        where suppressed or missing
+    samples: Array of the sample size of each area, NaN where unknown
+    adjacency: Symmetric sparse matrix of neighboring areas
+
+    Returns:
+    An array of smoothed prevalence in percent, of the shape of prevalence. Where
+    the prevalence is missing it is the mean of the neighbors with values, or NaN
+    if there are none.
+    """
+    p = np.asarray(prevalence, dtype=float) / 100
+    n = np.asarray(samples, dtype=float)
+    has_value = ~np.isnan(p) & ~np.isnan(n)[:, None] & (n[:, None] > 0)
+    weights = np.where(has_value, n[:, None], 0.0)
+    values = np.where(has_value, p, 0.0)
+
+    # Neighborhoods include the area itself
+    neighborhood = adjacency + sparse.identity(adjacency.shape[0], format="csr")
+    total = neighborhood @ weights
+    count = neighborhood @ has_value.astype(float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (neighborhood @ (weights * values)) / total
+        spread = (neighborhood @ (weights * values**2)) / total - mean**2
+        binomial = mean * (1 - mean)
+        prior = np.maximum(spread - binomial / (total / count), 0.0)
+        shrink = prior / (prior + binomial / n[:, None])
+    # A neighborhood without spread, e.g. an area alone, keeps its own value
+    shrink = np.where(np.isnan(shrink), 1.0, shrink)
+    smoothed = shrink * values + (1 - shrink) * mean
+    # Areas without a value take their neighborhood mean, which then leaves out
+    # the area itself; areas with a value but no sample size keep their value
+    smoothed = np.where(has_value, smoothed, np.where(np.isnan(p), mean, p))
+    return smoothed * 100
+
+
+def smooth_state(selected_state, df, pop_data=None):
+    """
+    Smooth the prevalence of the ZCTA3s of a state for every weight category and
+    prevalence type, weighted by their sample sizes.
+
+    Parameters:
+    selected_state: State name or two-letter abbreviation
+    df: DataFrame of prevalence data, or a Cube of prevalence and population data
+    pop_data: DataFrame created using create_population_df(), needed with a
+        DataFrame of prevalence data
+
+    Returns:
+    A DataFrame with a row per ZCTA3 with a value or neighbors with values, weight
+    category and prevalence type: the prevalence, NaN where suppressed or missing,
+    the smoothed prevalence and the sample size.
+    """
+    abbr = us.states.lookup(selected_state).abbr
+    zcta3s, adjacency = state_adjacency(abbr)
+    samples = zcta3_sample_sizes(df, pop_data).reindex(zcta3s)
+
+    if isinstance(df, Cube):
+        prevalence = df.reduce(
+            "prevalence", {"state": abbr}, ["zcta3", "category", "type"]
+        )
+        prevalence = pd.DataFrame(
+            prevalence.reshape(len(df.axes["zcta3"]), -1),
+            index=df.axes["zcta3"],
+            columns=pd.MultiIndex.from_product(
+                [df.axes["category"], df.axes["type"]],
+                names=["Weight Category", "Prevalence type"],
+            ),
+        )
+    else:
+        rows = df.loc[
+            df["zcta3"].notna()
+            & (df["state"].map(lambda s: getattr(s, "abbr", s)) == abbr)
+        ]
+        prevalence = rows.assign(
+            zcta3=rows["zcta3"].astype(str),
+            Prevalence=pd.to_numeric(rows["Prevalence"]),
+        ).pivot_table(
+            "Prevalence",
+            "zcta3",
+            ["Weight Category", "Prevalence type"],
+            aggfunc="mean",
+            observed=True,
+        )
+    prevalence = prevalence.reindex(zcta3s)
+    smoothed = empirical_bayes(prevalence.to_numpy(), samples.to_numpy(), adjacency)
+
+    result = pd.DataFrame(
+        {
+            "Prevalence": prevalence.to_numpy().ravel(),
+            "Smoothed prevalence": smoothed.ravel(),
+            "Sample": np.repeat(samples.to_numpy(), prevalence.shape[1]),
+        },
+        index=pd.MultiIndex.from_product(
+            [zcta3s, range(prevalence.shape[1])], names=["zcta3", "column"]
+        ),
+    )
+    result = result.loc[result["Smoothed prevalence"].notna()].reset_index()
+    estimates = prevalence.columns.to_frame(index=False)
+    return pd.concat(
+        [
+            result[["zcta3"]],
+            estimates.iloc[result["column"]].reset_index(drop=True),
+            result.drop(columns=["zcta3", "column"]),
+        ],
+        axis=1,
+    )
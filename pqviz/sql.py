@@ -0,0 +1,145 @@
+"""
+Embedded SQL over ingested PQ results, with DuckDB.
+
+The prevalence and population datasets of a store (see store.py), and optionally
+the CDC PLACES data, are registered as tables of an in-process DuckDB database.
+Arrow datasets are scanned in place from their memory-mapped files, and Parquet
+files through DuckDB's Parquet reader; either way DuckDB reads only the columns
+a query uses and pushes filters down into the scan. Results come back as
+DataFrames in the same form as create_prevalence_df(), so they can be passed
+straight to the plotting and mapping functions.
+
+    db = sql.PQDatabase("sample_data/zcta3", "Pediatric")
+    db.query('''
+        SELECT zcta3, "Prevalence", "Standard Error"
+        FROM prevalence
+        WHERE "Prevalence type" = 'Age-Adjusted'
+          AND "Weight Category" LIKE '(4) Obesity%'
+          AND "Standard Error" < 2
+        ORDER BY "Prevalence" DESC
+        LIMIT 20
+    ''')
+"""
+
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+
+from . import store
+
+
+class PQDatabase:
+    """
+    An in-memory DuckDB database with PQ datasets registered as tables.
+
+    Parameters:
+    results_folder: Folder of CODI-PQ outputs to register as the prevalence and
+        population tables; if None, register tables with register() instead
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    store_dir: Directory of the shared datasets the results are stored in
+    places: Also register the CDC PLACES data as the places table
+    threads: Number of threads DuckDB runs queries with; defaults to all CPUs
+    """
+
+    def __init__(
+        self,
+        results_folder=None,
+        population_group="Pediatric",
+        store_dir=store.STORE_DIR,
+        places=False,
+        threads=None,
+    ):
+        self.con = duckdb.connect(":memory:")
+        if threads:
+            self.con.execute(f"SET threads = {int(threads)}")
+        # Keep registered Arrow tables alive for as long as the database
+        self._tables = {}
+        if results_folder is not None:
+            prev_fname, pop_fname = store.materialize(
+                results_folder, population_group, store_dir
+            )
+            self.register("prevalence", prev_fname)
+            self.register("population", pop_fname)
+        if places:
+            store.shared_places(store_dir)
+            self.register("places", store.dataset_fname(store_dir, "places"))
+
+    def register(self, name, fname):
+        """
+        Register an Arrow IPC (.arrow, .feather) or Parquet (.parquet) file, or a
+        directory of Parquet files, as a table.
+        """
+        fname = Path(fname)
+        if fname.is_dir() or fname.suffix == ".parquet":
+            pattern = fname / "**" / "*.parquet" if fname.is_dir() else fname
+            self.con.execute(
+                f"CREATE OR REPLACE VIEW {_identifier(name)} AS "
+                f"SELECT * FROM read_parquet({_literal(pattern.as_posix())}, "
+                "hive_partitioning = true)"
+            )
+        else:
+            table = store.open_dataset(fname)
+            self._tables[name] = table
+            # Missing values are stored as NaN, which DuckDB sorts and compares as
+            # a number; the view turns them back into NULL
+            floats = [
+                f"NULLIF({_identifier(field.name)}, 'NaN'::DOUBLE) "
+                f"AS {_identifier(field.name)}"
+                for field in table.schema
+                if pa.types.is_floating(field.type)
+            ]
+            source = f"{name}_arrow"
+            self.con.register(source, table)
+            replace = f" REPLACE ({', '.join(floats)})" if floats else ""
+            self.con.execute(
+                f"CREATE OR REPLACE VIEW {_identifier(name)} AS "
+                f"SELECT *{replace} FROM {_identifier(source)}"
+            )
+
+    def tables(self):
+        """List the names of the registered tables."""
+        sources = {f"{name}_arrow" for name in self._tables}
+        return sorted(
+            row[0]
+            for row in self.con.execute("SHOW TABLES").fetchall()
+            if row[0] not in sources
+        )
+
+    def query(self, sql, params=None):
+        """
+        Run a query and return its result as a DataFrame. A state column holding
+        state abbreviations is turned into us.State objects, as in the frames the
+        plotting functions expect.
+
+        Parameters:
+        sql: SQL query, optionally with ? placeholders
+        params: Values for the placeholders
+
+        Returns:
+        A DataFrame of the query result.
+        """
+        df = self.con.execute(sql, params or []).df()
+        return store.restore_states(df)
+
+    def query_arrow(self, sql, params=None):
+        """Run a query and return its result as a pyarrow Table."""
+        return self.con.execute(sql, params or []).arrow()
+
+    def export_parquet(self, name, fname):
+        """Write a registered table to a Parquet file."""
+        self.con.execute(
+            f"COPY {_identifier(name)} TO {_literal(Path(fname).as_posix())} "
+            "(FORMAT PARQUET)"
+        )
+
+    def close(self):
+        self.con.close()
+
+
+def _identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
@@ -0,0 +1,184 @@
+"""
+Shared, memory-mapped copies of ingested datasets in Arrow IPC (Feather v2) files.
+
+Ingesting a results folder into pandas gives every notebook kernel a private copy
+of the prevalence and population frames, and of the CDC PLACES table. Here each
+dataset is instead written once, uncompressed, to an Arrow IPC file and opened
+memory-mapped and read-only. The numeric columns of the tables then point into
+the mapped file, so kernels on the same host share those pages through the OS
+page cache instead of each holding their own copy. Text columns are stored
+dictionary-encoded, so their values are kept once per file.
+
+The files record a fingerprint of the results folder they were built from, and
+are rebuilt when the results change.
+
+    prev_data, pop_data = store.shared_frames("sample_data/zcta3", "Pediatric")
+"""
+
+from functools import lru_cache
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from . import create_dataframes, maps
+from .common import inputs_fingerprint, restore_states
+
+
+STORE_DIR = Path("pqviz_store")
+
+# Columns of PQ data held as numbers; the other columns are text
+NUMERIC_COLUMNS = ["Prevalence", "Standard Error", "Population"]
+
+# Arrow schema metadata keys
+INPUTS_KEY = b"pqviz.inputs"
+STATE_KEY = b"pqviz.state_column"
+
+
+def dataset_fname(store_dir, name):
+    """Return the path of a dataset within a store directory."""
+    return Path(store_dir) / f"{name}.arrow"
+
+
+def to_table(df, metadata=None):
+    """
+    Convert a DataFrame of PQ or PLACES data to an Arrow table. States are stored
+    as abbreviations, values as float64 with missing values as NaN rather than
+    nulls, and text as dictionary-encoded strings.
+    """
+    df = df.copy()
+    has_states = "state" in df.columns
+    if has_states:
+        df["state"] = [getattr(s, "abbr", s) for s in df["state"]]
+    if "geometry" in df.columns:
+        df = pd.DataFrame(df.drop(columns="geometry"))
+
+    columns = {}
+    for column in df.columns:
+        if column in NUMERIC_COLUMNS or pd.api.types.is_numeric_dtype(df[column]):
+            values = pd.to_numeric(df[column], errors="coerce").astype(np.float64)
+            # Keep NaN as a float rather than a null, as columns with nulls are
+            # copied, not mapped, when converted back to pandas
+            columns[column] = pa.array(values.to_numpy(), from_pandas=False)
+        else:
+            # Text columns may hold other objects, such as the Path of each file
+            values = df[column].astype(str).where(df[column].notna(), None)
+            columns[column] = pa.array(values, type=pa.string()).dictionary_encode()
+    table = pa.table(columns)
+
+    metadata = dict(metadata or {})
+    if has_states:
+        metadata[STATE_KEY] = b"1"
+    return table.replace_schema_metadata(metadata)
+
+
+def write_dataset(df, fname, metadata=None):
+    """
+    Write a DataFrame to an uncompressed Arrow IPC file, which can be memory-mapped
+    without decoding. The file is written to a temporary name first and moved into
+    place, so kernels reading the old file keep a consistent view.
+    """
+    fname = Path(fname)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    table = to_table(df, metadata)
+    tmp_fname = fname.with_suffix(f".{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp_fname), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    tmp_fname.replace(fname)
+
+
+@lru_cache(maxsize=None)
+def _open_table(fname, mtime_ns):
+    source = pa.memory_map(fname, "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def open_dataset(fname):
+    """
+    Open an Arrow IPC dataset memory-mapped and read-only, as a pyarrow Table whose
+    buffers point into the file. Each file is mapped once per process, and mapped
+    again if it has been rewritten since.
+    """
+    fname = Path(fname)
+    return _open_table(str(fname), fname.stat().st_mtime_ns)
+
+
+def dataset_metadata(fname):
+    """Return the schema metadata of a dataset without reading its data."""
+    with pa.memory_map(str(fname), "r") as source:
+        return pa.ipc.open_file(source).schema.metadata or {}
+
+
+def read_frame(fname):
+    """
+    Read a dataset as a DataFrame. Numeric columns are views of the memory-mapped
+    file rather than copies, and text columns are Categoricals with their
+    categories in sorted order. States are turned back into us.State objects, as
+    in frames from create_prevalence_df().
+    """
+    table = open_dataset(fname)
+    df = table.to_pandas(split_blocks=True, self_destruct=False)
+    # Order categories as text, so sorting and grouping match the text columns
+    for column in df.select_dtypes("category").columns:
+        df[column] = df[column].cat.reorder_categories(
+            sorted(df[column].cat.categories)
+        )
+    if (table.schema.metadata or {}).get(STATE_KEY):
+        df = restore_states(df)
+    return df
+
+
+def materialize(results_folder, population_group, store_dir=STORE_DIR, force=False):
+    """
+    Ingest a results folder into prevalence and population datasets in a store,
+    unless the store already holds datasets built from the same results.
+
+    Parameters:
+    results_folder: Folder of CODI-PQ outputs
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    store_dir: Directory of the shared datasets
+    force: Rebuild the datasets even if they are current
+
+    Returns:
+    The paths of the prevalence and population datasets.
+    """
+    inputs = f"{inputs_fingerprint(results_folder)}:{population_group}".encode()
+    fnames = []
+    for kind, create_df in [
+        ("prevalence", create_dataframes.create_prevalence_df),
+        ("population", create_dataframes.create_population_df),
+    ]:
+        fname = dataset_fname(store_dir, f"{population_group.lower()}_{kind}")
+        fnames.append(fname)
+        if (
+            not force
+            and fname.is_file()
+            and dataset_metadata(fname).get(INPUTS_KEY) == inputs
+        ):
+            continue
+        df = create_df(Path(results_folder), population_group)
+        write_dataset(df, fname, {INPUTS_KEY: inputs})
+    return fnames
+
+
+def shared_frames(results_folder, population_group, store_dir=STORE_DIR):
+    """
+    Return the prevalence and population frames of a results folder, read from
+    memory-mapped datasets in a store, building them first if needed.
+    """
+    prev_fname, pop_fname = materialize(results_folder, population_group, store_dir)
+    return read_frame(prev_fname), read_frame(pop_fname)
+
+
+def shared_places(store_dir=STORE_DIR):
+    """
+    Return the CDC PLACES data, read from a memory-mapped dataset in a store,
+    building it from maps.load_places() first if needed.
+    """
+    fname = dataset_fname(store_dir, "places")
+    if not fname.is_file():
+        write_dataset(maps.load_places(), fname)
+    return read_frame(fname)
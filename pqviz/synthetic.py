@@ -0,0 +1,286 @@
+"""
+Synthetic CODI-PQ output files, for exercising ingest at the scale of a national
+run without real data.
+
+Each report is one CSV in the layout CODI-PQ writes: a row per weight category
+(Order 1) with sample and population counts, crude, weighted and age-adjusted
+prevalence and their standard errors, a totals row (Order 2), and footer rows
+(Order 3 and up) describing the query. The footer rows ingest reads sit at the
+positions of each population group's layout:
+
+                  age  sex  race  geography  years
+    Pediatric       5    6     7         10     11
+    Adult           5    6     8         11     12
+
+Reports are spread over the ZCTA3s of the given states, from the crosswalk, and
+over every combination of sex, race and age group, one of which is "all",
+covering every geography for one combination before the next. Some
+reports cover a whole state, as "(37) North Carolina", or several ZCTA3s, as
+"(37270, 37271)", some of them in two states, as "(37286, 45296)". Counts are
+drawn from a multinomial over the weight categories; categories with fewer than
+SUPPRESSION_MIN children or adults, and a share of the others, are suppressed
+with ".". Counts of 1,000 or more are written with thousands separators, so
+they are quoted as in real reports.
+
+    synthetic.generate_reports("synthetic/pediatric", "Pediatric", 10_000)
+"""
+
+import csv
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+import us
+
+from .crosswalk import load_crosswalk
+
+# Weight categories of each population group, in report order, and the share of
+# the population in each of the categories that partition it
+WEIGHT_CATEGORIES = {
+    "Pediatric": [
+        ("(1) Underweight (<5th percentile)", 0.04),
+        ("(2) Healthy Weight (5th to <85th percentile)", 0.62),
+        ("(3) Overweight (85th to <95th percentile)", 0.16),
+        ("(4) Obesity (>95th percentile)", 0.18),
+        ("(4b) Severe Obesity (>120% of the 95th percentile)", None),
+    ],
+    "Adult": [
+        ("(1) Underweight (BMI<18.5)", 0.02),
+        ("(2) Healthy Weight (18.5<=BMI<25)", 0.29),
+        ("(3) Overweight (25<=BMI<30)", 0.33),
+        ("(4) Obesity (Classes 1, 2, and 3) (BMI 30+)", None),
+        ("(4a) Obesity (Class 1) (30<=BMI<35)", 0.20),
+        ("(4b) Obesity (Class 2) (35<=BMI<40)", 0.10),
+        ("(4c) Obesity (Class 3) - Severe Obesity (BMI 40+)", 0.06),
+    ],
+}
+
+AGE_GROUPS = {
+    "Pediatric": ["02 - 04", "05 - 09", "10 - 14", "15 - 17", "18 - 19"],
+    "Adult": ["20 - 34", "35 - 49", "50 - 64", "65 - 79"],
+}
+SEXES = ["Male", "Female"]
+RACES = ["White", "Black", "Asian", "Other"]
+
+COLUMNS = [
+    "Order",
+    "Weight Category",
+    "Sample",
+    "Population",
+    "Crude Prevalence",
+    "Crude Prevalence Standard Error",
+    "Weighted Prevalence",
+    "Weighted Prevalence Standard Error",
+    "Age-Adjusted Prevalence",
+    "Age-Adjusted Prevalence Standard Error",
+]
+
+# Smallest count of a weight category reported without suppression
+SUPPRESSION_MIN = 11
+
+# Footer rows after the query parameters, the same in every report
+CAVEATS = [
+    "Technical Documentation: See https://github.com/NORC-UChicago/CODI-PQ for "
+    "more information and full details on data sources and methodologies.",
+    "Query Date: Monday, January 3, 2022 9:00:00 AM",
+    "Suggested Citation: Synthetic CODI-PQ output generated by PQViz.",
+    "Caveats",
+    "Records with either missing or invalid age, sex, height, weight, or "
+    "geography are not included in counts and prevalence estimates.",
+    "The method used to calculate the standard errors are documented in the "
+    "technical documentation.",
+    "The population estimates are based on age-race-sex-location specific counts "
+    "from the 2014-2018 American Community Survey Five-year Estimates.",
+    "The method used to calculate age-adjusted prevalence is documented in the "
+    "technical documentation.",
+]
+
+
+def state_geographies(states, combined=0.05, seed=0):
+    """
+    List the geographies reports are spread over: every ZCTA3 of the states, as
+    its state FIPS code and ZCTA3, each whole state, some combinations of ZCTA3s
+    with neighboring codes, and some combinations of a ZCTA3 of each state with
+    one of the next.
+
+    Parameters:
+    states: Two-letter state abbreviations
+    combined: Number of combinations of two or three ZCTA3s of a state, and of
+        ZCTA3s of two states, as a share of their ZCTA3s
+    seed: Seed of the random generator, so results can be reproduced
+
+    Returns:
+    A list of (location code, geography text) pairs, e.g. ("37270", "(37270)").
+    """
+    rng = np.random.default_rng(seed)
+    crosswalk = load_crosswalk()
+    geographies = []
+    state_codes = []
+    for abbr in states:
+        state = us.states.lookup(abbr)
+        zcta3s = np.unique(crosswalk.zcta5_to_zcta3(crosswalk.state_zcta5s(abbr)))
+        codes = [f"{state.fips}{zcta3}" for zcta3 in zcta3s]
+        geographies += [(code, f"({code})") for code in codes]
+        for _ in range(int(round(len(codes) * combined))):
+            start = rng.integers(max(len(codes) - 2, 1))
+            group = codes[start : start + rng.integers(2, 4)]
+            code = ", ".join(group)
+            geographies.append((code, f"({code})"))
+        geographies.append((state.fips, f"({state.fips}) {state.name}"))
+        state_codes.append(codes)
+
+    # Areas spanning a state line combine ZCTA3s of two states, e.g. "37286, 45296"
+    for codes, next_codes in zip(state_codes, state_codes[1:]):
+        for _ in range(max(int(round(min(len(codes), len(next_codes)) * combined)), 1)):
+            code = f"{rng.choice(codes)}, {rng.choice(next_codes)}"
+            geographies.append((code, f"({code})"))
+    return geographies
+
+
+def _strata(population_group):
+    """Return every (sex, race, age) selection, each a list of values."""
+    choices = [
+        [SEXES] + [[v] for v in SEXES],
+        [RACES] + [[v] for v in RACES],
+        [AGE_GROUPS[population_group]] + [[v] for v in AGE_GROUPS[population_group]],
+    ]
+    return list(product(*choices))
+
+
+def _count(value):
+    return f"{int(value):,d}"
+
+
+def _footer(population_group, sex, race, age, geography, years, suppressed):
+    """Return the footer rows of a report, from Order 3 on."""
+    rows = [
+        "Query Version: IQVIA",
+        "Query Parameters: AGE RACE SEX GEOGRAPHY YEAR",
+        f"AGE: ({', '.join(age)})",
+        f"SEX: ({', '.join(sex)})",
+    ]
+    if population_group == "Adult":
+        rows.append("SEX Suppressed: (None)")
+    rows += [
+        f"RACE: ({', '.join(race)})",
+        "RACE Suppressed: (None)",
+        "RACE Imputed: 13.00% of race values were imputed.",
+        f"Geography: {geography}",
+        f"Years: {years}",
+        "Weighting cells were collapsed for: (Age)",
+        "AGE adjusted: (Yes)",
+        (
+            "Error Codes: (One or more rows has suppressed results.)"
+            if suppressed
+            else "Error Codes: (None)"
+        ),
+    ]
+    return rows + CAVEATS
+
+
+def generate_reports(
+    output_dir,
+    population_group,
+    reports,
+    states=("NC", "SC", "VA"),
+    years="2016 - 2018",
+    suppress_rate=0.05,
+    seed=0,
+):
+    """
+    Write synthetic CODI-PQ reports into a folder, one CSV per report.
+
+    Parameters:
+    output_dir: Folder to write the reports into
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    reports: Number of reports to write
+    states: Two-letter abbreviations of the states to spread reports over
+    years: Years of the query, as written in the report
+    suppress_rate: Share of categories suppressed beyond those with small counts
+    seed: Seed of the random generator, so results can be reproduced
+
+    Returns:
+    A list of the files written.
+    """
+    rng = np.random.default_rng(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    categories = WEIGHT_CATEGORIES[population_group]
+    strata = _strata(population_group)
+    geographies = state_geographies(states, seed=seed)
+    cells = len(strata) * len(geographies)
+
+    # Reports cover every geography for a stratum before moving to the next one,
+    # starting with all sexes, races and ages
+    picks = np.arange(reports) % cells
+    geography_ix, strata_ix = picks % len(geographies), picks // len(geographies)
+    selected = np.array([len(s) * len(r) * len(a) for s, r, a in strata], dtype=float)
+    size = selected[strata_ix] / selected.max()
+
+    # Samples of each report and their counts over the partitioning categories
+    partition = [i for i, (_, share) in enumerate(categories) if share is not None]
+    shares = np.array([categories[i][1] for i in partition])
+    samples = np.maximum(rng.lognormal(np.log(4000 * size), 0.8), 20).astype(int)
+    pvals = rng.dirichlet(shares * 200, size=reports)
+    partition_counts = rng.multinomial(samples, pvals)
+    weights = rng.uniform(8, 15, size=reports)
+
+    counts = np.zeros((reports, len(categories)), dtype=int)
+    counts[:, partition] = partition_counts
+    if population_group == "Pediatric":
+        # Severe obesity is a subset of obesity
+        counts[:, 4] = rng.binomial(counts[:, 3], 0.3)
+    else:
+        # The summary row is the sum of the obesity classes
+        counts[:, 3] = counts[:, 4:].sum(axis=1)
+    populations = np.round(
+        counts * weights[:, None] * rng.uniform(0.9, 1.1, size=counts.shape)
+    )
+    total_populations = populations[:, partition].sum(axis=1)
+
+    crude = counts / samples[:, None]
+    weighted = populations / total_populations[:, None]
+    adjusted = np.clip(crude + rng.normal(0, 0.003, size=crude.shape), 0, 1)
+    crude_se = np.sqrt(crude * (1 - crude) / samples[:, None])
+    suppressed = (counts < SUPPRESSION_MIN) | (
+        rng.random(size=counts.shape) < suppress_rate
+    )
+
+    written = []
+    for i in range(reports):
+        sex, race, age = strata[strata_ix[i]]
+        code, geography = geographies[geography_ix[i]]
+        rows = []
+        for j, (category, _) in enumerate(categories):
+            if suppressed[i, j]:
+                rows.append([1, category] + ["."] * 8)
+                continue
+            rows.append(
+                [
+                    1,
+                    category,
+                    _count(counts[i, j]),
+                    _count(populations[i, j]),
+                    f"{crude[i, j] * 100:.2f}",
+                    f"{crude_se[i, j] * 100:.2f}",
+                    f"{weighted[i, j] * 100:.2f}",
+                    f"{crude_se[i, j] * 110:.2f}",
+                    f"{adjusted[i, j] * 100:.2f}",
+                    f"{crude_se[i, j] * 105:.2f}",
+                ]
+            )
+        rows.append(
+            [2, "Totals:", _count(samples[i]), _count(total_populations[i])] + [""] * 6
+        )
+        footer = _footer(
+            population_group, sex, race, age, geography, years, suppressed[i].any()
+        )
+        rows += [[order, text] + [""] * 8 for order, text in enumerate(footer, 3)]
+
+        fname = output_dir / f"CODI_PQ_Report_{code.split(',')[0]}_{i:06d}.csv"
+        with open(fname, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+        written.append(fname)
+    return written
@@ -0,0 +1,315 @@
+"""
+Pre-render and serve Mapbox Vector Tiles (MVT) of the bundled ZCTA boundary files.
+
+For maps larger than a single state, sending geojson through the widget channel
+does not scale. Instead, boundaries are cut into tiles of the standard web
+mercator tile grid, cached on disk, and served from a small local HTTP server so
+the browser only fetches the tiles for its current viewport. Everything runs
+offline against the files in reference_data/state_boundaries.
+
+Run as a subcommand of the pqviz entry point:
+
+    python -m pqviz tiles --states NC SC
+
+and pass tile_url() to maps.choropleth_map_pq() or maps.choropleth_map_places().
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+from pathlib import Path
+import re
+import threading
+
+import geopandas as gpd
+import mapbox_vector_tile
+import pandas as pd
+import shapely
+from shapely.geometry import box
+
+from .maps import (
+    BOUNDARY_CRS,
+    STATE_BOUNDS,
+    TILE_LAYER,
+    TILE_MAX_ZOOM,
+    load_state_boundaries,
+)
+
+
+# Directory of rendered tiles, laid out as {states}/{z}/{x}/{y}.pbf, with a
+# subdirectory for each set of states tiles are rendered from
+TILE_DIR = Path("reference_data/tiles")
+
+# Zoom levels rendered ahead of time by default; others are rendered on request
+TILE_MIN_ZOOM = 3
+
+TILE_PORT = 8765
+
+# Size of the web mercator world in meters, and MVT coordinate extent per tile
+WORLD_SIZE = 2 * 20037508.342789244
+TILE_EXTENT = 4096
+
+# Fraction of a tile added around its edges before clipping, so polygon borders
+# do not show seams between neighboring tiles
+TILE_BUFFER = 64 / TILE_EXTENT
+
+# Number of encoded tiles held in memory by the server
+TILE_CACHE_SIZE = 2048
+
+TILE_PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)\.pbf$")
+
+
+def tile_url(port=TILE_PORT, host="localhost"):
+    """
+    Return the URL template for tiles served by serve_tiles(), for use with
+    ipyleaflet's VectorTileLayer.
+    """
+    return f"http://{host}:{port}/{{z}}/{{x}}/{{y}}.pbf"
+
+
+def tile_bbox(z, x, y):
+    """
+    Return the (minx, miny, maxx, maxy) web mercator extent of a tile in meters.
+    """
+    size = WORLD_SIZE / 2**z
+    minx = -WORLD_SIZE / 2 + x * size
+    maxy = WORLD_SIZE / 2 - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tiles_for_bounds(bounds, z):
+    """
+    List the tiles at zoom level z covering a [[south, west], [north, east]] extent,
+    as found in maps.STATE_BOUNDS.
+    """
+    (south, west), (north, east) = bounds
+    x0, y0 = lonlat_to_tile(west, north, z)
+    x1, y1 = lonlat_to_tile(east, south, z)
+    return [(z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def lonlat_to_tile(lon, lat, z):
+    """
+    Return the (x, y) tile at zoom level z containing a point.
+    """
+    n = 2**z
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+@lru_cache(maxsize=None)
+def load_boundaries(states=None):
+    """
+    Load ZCTA boundaries for a set of states into one GeoDataFrame in web mercator.
+    ZCTAs crossing state lines appear in more than one state file and are kept once.
+
+    Parameters:
+    states: Tuple of two-letter state abbreviations; if None, all states
+
+    Returns:
+    A GeoDataFrame of ZCTA5 ids and geometries, with a spatial index.
+    """
+    states = states or tuple(sorted(STATE_BOUNDS))
+    frames = [
+        gpd.GeoDataFrame.from_features(
+            load_state_boundaries(abbr)["features"], crs=BOUNDARY_CRS
+        )[["ZCTA5CE10", "geometry"]]
+        for abbr in states
+    ]
+    zctas = pd.concat(frames, ignore_index=True).drop_duplicates("ZCTA5CE10")
+    zctas = gpd.GeoDataFrame(zctas, geometry="geometry", crs=BOUNDARY_CRS)
+    zctas = zctas.to_crs(epsg=3857).reset_index(drop=True)
+    # Build the spatial index now rather than on the first tile request
+    zctas.sindex
+    return zctas
+
+
+def render_tile(zctas, z, x, y):
+    """
+    Encode the ZCTA boundaries intersecting one tile as a Mapbox Vector Tile.
+    Geometries are clipped to the tile and simplified to its resolution.
+
+    Parameters:
+    zctas: GeoDataFrame from load_boundaries()
+    z, x, y: Tile coordinates
+
+    Returns:
+    The encoded tile as bytes; empty if no boundaries fall within the tile.
+    """
+    minx, miny, maxx, maxy = tile_bbox(z, x, y)
+    pad = (maxx - minx) * TILE_BUFFER
+    rows = zctas.sindex.query(box(minx - pad, miny - pad, maxx + pad, maxy + pad))
+    if len(rows) == 0:
+        return b""
+
+    subset = zctas.iloc[rows]
+    geoms = shapely.clip_by_rect(
+        subset.geometry.values, minx - pad, miny - pad, maxx + pad, maxy + pad
+    )
+    geoms = shapely.simplify(geoms, (maxx - minx) / TILE_EXTENT)
+    features = [
+        {
+            "geometry": geom,
+            "properties": {"ZCTA5CE10": zcta},
+            "id": int(zcta),
+        }
+        for zcta, geom in zip(subset["ZCTA5CE10"], geoms)
+        if not geom.is_empty
+    ]
+    if not features:
+        return b""
+    return mapbox_vector_tile.encode(
+        {"name": TILE_LAYER, "features": features},
+        default_options={
+            "quantize_bounds": (minx, miny, maxx, maxy),
+            "extents": TILE_EXTENT,
+        },
+    )
+
+
+def tile_set_dir(tile_dir, states=None):
+    """
+    Return the directory within a tile directory of the tiles rendered from a set
+    of states, as tiles of the same z/x/y hold different features for different
+    states: 'all' for all states, or the sorted state abbreviations joined by '_'.
+    """
+    return Path(tile_dir) / ("_".join(sorted(states)) if states else "all")
+
+
+def tile_fname(tile_dir, z, x, y):
+    """Return the path of a tile within the directory of a set of states."""
+    return Path(tile_dir) / str(z) / str(x) / f"{y}.pbf"
+
+
+def write_tile(tile_dir, z, x, y, data):
+    """Write an encoded tile into a tile directory."""
+    fname = tile_fname(tile_dir, z, x, y)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so concurrent readers never see a partial tile
+    tmp_fname = fname.with_suffix(f".{threading.get_ident()}.tmp")
+    tmp_fname.write_bytes(data)
+    tmp_fname.replace(fname)
+
+
+def prerender_tiles(
+    states=None,
+    min_zoom=TILE_MIN_ZOOM,
+    max_zoom=TILE_MAX_ZOOM,
+    tile_dir=TILE_DIR,
+    overwrite=False,
+):
+    """
+    Render the tiles covering a set of states at a range of zoom levels to disk.
+    Tiles already present are kept unless overwrite is set.
+
+    Parameters:
+    states: List of two-letter state abbreviations; if None, all states
+    min_zoom: Lowest zoom level to render
+    max_zoom: Highest zoom level to render
+    tile_dir: Directory to write tiles into, within the directory of the states
+    overwrite: Re-render tiles that already exist
+
+    Returns:
+    The number of tiles rendered.
+    """
+    states = tuple(sorted(states)) if states else None
+    tile_dir = tile_set_dir(tile_dir, states)
+    zctas = load_boundaries(states)
+    tiles = set()
+    for abbr in states or STATE_BOUNDS:
+        for z in range(min_zoom, max_zoom + 1):
+            tiles.update(tiles_for_bounds(STATE_BOUNDS[abbr], z))
+
+    rendered = 0
+    for z, x, y in sorted(tiles):
+        if not overwrite and tile_fname(tile_dir, z, x, y).is_file():
+            continue
+        write_tile(tile_dir, z, x, y, render_tile(zctas, z, x, y))
+        rendered += 1
+    print(f"Rendered {rendered} of {len(tiles)} tiles into {tile_dir}")
+    return rendered
+
+
+class TileServer(ThreadingHTTPServer):
+    """
+    HTTP server for vector tiles. Tiles are read from the directory of its states
+    within tile_dir, or rendered and written there on first request, and the most
+    recently used are kept in memory.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, tile_dir=TILE_DIR, states=None):
+        super().__init__(address, TileRequestHandler)
+        self.states = tuple(sorted(states)) if states else None
+        self.tile_dir = tile_set_dir(tile_dir, self.states)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_tile(self, z, x, y):
+        key = (z, x, y)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        fname = tile_fname(self.tile_dir, z, x, y)
+        if fname.is_file():
+            data = fname.read_bytes()
+        else:
+            data = render_tile(load_boundaries(self.states), z, x, y)
+            write_tile(self.tile_dir, z, x, y, data)
+
+        with self.lock:
+            self.cache[key] = data
+            if len(self.cache) > TILE_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return data
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = TILE_PATH.match(self.path.split("?")[0])
+        if not match:
+            self.send_error(404)
+            return
+        z, x, y = (int(v) for v in match.groups())
+        if x >= 2**z or y >= 2**z:
+            self.send_error(404)
+            return
+
+        data = self.server.get_tile(z, x, y)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+        self.send_header("Content-Length", str(len(data)))
+        # The notebook is served from a different origin than the tiles
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_tiles(port=TILE_PORT, tile_dir=TILE_DIR, states=None, host="localhost"):
+    """
+    Serve vector tiles over HTTP until interrupted.
+
+    Parameters:
+    port: Port to listen on
+    tile_dir: Directory of pre-rendered tiles, also used to cache new tiles
+    states: List of states to render missing tiles from; if None, all states
+    host: Interface to listen on
+    """
+    server = TileServer((host, port), tile_dir=tile_dir, states=states)
+    print(f"Serving tiles from {server.tile_dir} at {tile_url(port, host)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
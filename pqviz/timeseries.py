@@ -0,0 +1,263 @@
+"""
+Multi-year PQ results: typed year ranges, an append-only store partitioned by
+year, and year-over-year changes and trends.
+
+Each CODI-PQ run covers a range of years, reported as text such as
+" 2016 - 2018". Here the range is parsed into integer year_start and year_end
+columns. Runs are appended to a store of Parquet files, one directory per
+year_end, so adding this year's run writes only its own files and never reads
+the runs already stored:
+
+    pqviz_timeseries/pediatric/prevalence/year_end=2018/<run>.parquet
+
+The store can be read back whole or for some years, or registered as a table
+with sql.PQDatabase.register(). Changes and trends are computed for every
+series at once, a series being one weight category, prevalence type and
+demographic of one geography, on a series x year array:
+
+    timeseries.append_run("results/2021", "Pediatric")
+    prev_data = timeseries.read_series("Pediatric")
+    timeseries.year_over_year(prev_data)
+    timeseries.trends(prev_data)
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from . import create_dataframes
+from .common import inputs_fingerprint, restore_states
+from .store import to_table
+
+TIMESERIES_DIR = Path("pqviz_timeseries")
+
+# Columns identifying a series of one estimate over the years
+SERIES_COLUMNS = [
+    "Weight Category",
+    "Prevalence type",
+    "sex",
+    "race",
+    "age",
+    "state",
+    "zcta3",
+]
+
+# Column of the year each estimate is placed at in changes and trends
+YEAR_COLUMN = "year_end"
+
+
+def add_year_columns(df):
+    """
+    Parse the year text of PQ results, either one year or a range such as
+    " 2016 - 2018", into integer year_start and year_end columns.
+
+    Returns:
+    A copy of the DataFrame with year_start and year_end, as nullable integers.
+    """
+    years = df["year"].astype(str).str.extract(r"(\d{4})(?:\s*-\s*(\d{4}))?")
+    years[1] = years[1].fillna(years[0])
+    return df.assign(
+        year_start=pd.to_numeric(years[0]).astype("Int64"),
+        year_end=pd.to_numeric(years[1]).astype("Int64"),
+    )
+
+
+def series_dir(store_dir, population_group, kind):
+    """Return the directory of the prevalence or population series of a store."""
+    return Path(store_dir) / population_group.lower() / kind
+
+
+def append_run(results_folder, population_group, store_dir=TIMESERIES_DIR):
+    """
+    Ingest one run of CODI-PQ results and append it to the store, in a file per
+    year_end partition named for the run. Runs already stored are not read, and
+    appending the same run again does nothing.
+
+    Parameters:
+    results_folder: Folder of CODI-PQ outputs of one run
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    store_dir: Directory of the time-series store
+
+    Returns:
+    The list of files written.
+    """
+    run = inputs_fingerprint(results_folder)[:16]
+    written = []
+    for kind, create_df in [
+        ("prevalence", create_dataframes.create_prevalence_df),
+        ("population", create_dataframes.create_population_df),
+    ]:
+        kind_dir = series_dir(store_dir, population_group, kind)
+        if any(kind_dir.glob(f"{YEAR_COLUMN}=*/{run}.parquet")):
+            continue
+        df = add_year_columns(create_df(Path(results_folder), population_group))
+        df["run"] = run
+        for year_end, part in df.groupby(YEAR_COLUMN):
+            fname = kind_dir / f"{YEAR_COLUMN}={year_end}" / f"{run}.parquet"
+            fname.parent.mkdir(parents=True, exist_ok=True)
+            table = to_table(part.drop(columns=YEAR_COLUMN))
+            tmp_fname = fname.with_suffix(".tmp")
+            pq.write_table(table, tmp_fname)
+            tmp_fname.replace(fname)
+            written.append(fname)
+    return written
+
+
+def read_series(
+    population_group, kind="prevalence", store_dir=TIMESERIES_DIR, years=None
+):
+    """
+    Read the stored runs of a population group as one DataFrame, in the form of
+    create_prevalence_df() or create_population_df() with year_start, year_end
+    and run columns.
+
+    Parameters:
+    population_group: Type of population, expected inputs ['Pediatric', 'Adult']
+    kind: 'prevalence' or 'population'
+    store_dir: Directory of the time-series store
+    years: Optional collection of year_end values to read; other partitions are
+        not opened
+
+    Returns:
+    A DataFrame of all stored rows.
+    """
+    kind_dir = series_dir(store_dir, population_group, kind)
+    if not any(kind_dir.glob(f"{YEAR_COLUMN}=*/*.parquet")):
+        raise FileNotFoundError(f"No {kind} series stored in {kind_dir}")
+    filters = None if years is None else [(YEAR_COLUMN, "in", [int(y) for y in years])]
+    table = pq.read_table(kind_dir, partitioning="hive", filters=filters)
+    df = table.to_pandas()
+    df[YEAR_COLUMN] = df[YEAR_COLUMN].astype("Int64")
+    df["year_start"] = df["year_start"].astype("Int64")
+    for column in SERIES_COLUMNS + ["year", "run", "filename"]:
+        if column in df.columns:
+            df[column] = df[column].astype(object).where(df[column].notna(), None)
+    return restore_states(df)
+
+
+def _series_columns(df):
+    """Return the columns identifying a series of prevalence or population data."""
+    if "Prevalence type" in df.columns:
+        return SERIES_COLUMNS
+    return [
+        "Population type" if column == "Prevalence type" else column
+        for column in SERIES_COLUMNS
+    ]
+
+
+def _series_array(df, value="Prevalence"):
+    """
+    Lay out values as a series x year array. Rows for the same series and year,
+    e.g. from overlapping runs, are averaged.
+
+    Returns:
+    The series as a DataFrame of their identifying columns, the sorted years, and
+    the array.
+    """
+    if YEAR_COLUMN not in df.columns:
+        df = add_year_columns(df)
+    columns = _series_columns(df)
+    keys = df[columns].copy()
+    keys["state"] = [getattr(s, "abbr", s) for s in keys["state"]]
+    keys = keys.astype(str)
+    series_codes = keys.groupby(columns, sort=True).ngroup().to_numpy()
+    years, year_codes = np.unique(
+        df[YEAR_COLUMN].to_numpy(dtype=int), return_inverse=True
+    )
+
+    values = pd.to_numeric(df[value]).to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    shape = (series_codes.max() + 1, len(years))
+    flat = np.ravel_multi_index((series_codes[valid], year_codes[valid]), shape)
+    size = shape[0] * shape[1]
+    sums = np.bincount(flat, weights=values[valid], minlength=size)
+    counts = np.bincount(flat, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        array = (sums / counts).reshape(shape)
+
+    first_rows = np.unique(series_codes, return_index=True)[1]
+    labels = df[columns].iloc[first_rows].reset_index(drop=True)
+    return labels, years, array
+
+
+def year_over_year(df, value="Prevalence"):
+    """
+    Compute the change of every series from each year with a value to the next
+    year with a value.
+
+    Parameters:
+    df: DataFrame of prevalence or population data over several years, e.g. from
+        read_series()
+    value: Column of the values to compare
+
+    Returns:
+    A DataFrame with the identifying columns of each series, the year and previous
+    year compared, the value in each, the change and the relative change in
+    percent.
+    """
+    labels, years, array = _series_array(df, value)
+    # Carry each series' last value forward, to compare with the previous year
+    # that has a value rather than only the adjacent column
+    present = ~np.isnan(array)
+    last = np.where(present, np.arange(len(years)), -1)
+    last = np.maximum.accumulate(last, axis=1)
+    previous = np.full_like(last, -1)
+    previous[:, 1:] = last[:, :-1]
+
+    rows, cols = np.nonzero(present & (previous >= 0))
+    prev_cols = previous[rows, cols]
+    current = array[rows, cols]
+    before = array[rows, prev_cols]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        relative = (current - before) / before * 100
+    result = labels.iloc[rows].reset_index(drop=True)
+    return result.assign(
+        year=years[cols],
+        previous_year=years[prev_cols],
+        **{
+            value: current,
+            f"previous {value}": before,
+            "change": current - before,
+            "percent change": relative,
+        },
+    )
+
+
+def trends(df, value="Prevalence", min_years=2):
+    """
+    Fit a least-squares linear trend to every series at once.
+
+    Parameters:
+    df: DataFrame of prevalence or population data over several years, e.g. from
+        read_series()
+    value: Column of the values to fit
+    min_years: Fewest years with a value a series needs for a trend
+
+    Returns:
+    A DataFrame with the identifying columns of each series, its first and last year
+    with a value, the number of years, and the slope, the change per year.
+    """
+    labels, years, array = _series_array(df, value)
+    present = ~np.isnan(array)
+    x = np.where(present, years[None, :].astype(float), 0.0)
+    y = np.where(present, array, 0.0)
+    n = present.sum(axis=1)
+    sum_x = x.sum(axis=1)
+    sum_y = y.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * (x * y).sum(axis=1) - sum_x * sum_y) / (
+            n * (x**2).sum(axis=1) - sum_x**2
+        )
+
+    keep = n >= min_years
+    first = np.argmax(present, axis=1)
+    last = len(years) - 1 - np.argmax(present[:, ::-1], axis=1)
+    result = labels.loc[keep].reset_index(drop=True)
+    return result.assign(
+        first_year=years[first[keep]],
+        last_year=years[last[keep]],
+        years=n[keep],
+        slope=slope[keep],
+    )
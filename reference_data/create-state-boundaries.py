@@ -62,7 +62,7 @@ def main(args):
     zctas = gpd.read_file(Path(args.ZCTASHAPEFILE))
     if args.debug:
         print(f"Loading ZCTA-ZIP mapping file {args.zctamappingfile}")
-    z2z = pd.read_csv(Path(args.zctamappingfile))
+    z2z = pd.read_csv(Path(args.zctamappingfile), dtype=str)
 
     outdir = Path(args.dirname)
     os.makedirs(outdir, exist_ok=True)